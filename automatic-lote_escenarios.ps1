@@ -0,0 +1,5 @@
+Powershell.exe -ExecutionPolicy ByPass -NoExit -Command "& '~\AppData\Local\Continuum\anaconda3\shell\condabin\conda-hook.ps1';
+cd $PSScriptRoot;
+conda activate herramienta_distr;
+python scripts\lote_escenarios.py input\escenarios | Out-File messages\lote_escenarios.txt -Encoding UTF8;
+exit"
\ No newline at end of file
@@ -0,0 +1,4 @@
+Powershell.exe -ExecutionPolicy ByPass -NoExit -Command "& '~\AppData\Local\Continuum\anaconda3\shell\condabin\conda-hook.ps1';
+cd $PSScriptRoot;
+conda activate herramienta_distr;
+python scripts\servicio.py input --solver highspy | Tee-Object messages\servicio.txt"
\ No newline at end of file
@@ -5,28 +5,37 @@ Este script no se usa por el cliente, es para tener trazabilidad de cómo se con
 script son diferentes a los que estamos usando dado que este  código no correrá desde Powershell ni desde la interfaz.
 Este código se corre internamente.
 """
+import os
 import pandas as pd
 from limpieza_masters import remover_tildes_espacios
 
 
-def limpieza_nacional(data, fam_dict, tipo: str):
-    """
-    Limpia datos de T1 y T2 de RFI, dejándolos en un formato similar para luego concatenar.
+LLAVES_DEMANDA = ['fecha', 'familia', 'id_ciudad_origen', 'id_ciudad_destino']
 
-    :param data: datos de demanda limpios, con estructura de master demanda
-    :param fam_dict: Diccionario de familias y SKUs
-    :param apoyo_t2: Tabla de homologación de destinos de T2
-    :param tarifario: Tarifario de transporte
-    :param tipo: indicar si es 't1' o 't2'
+
+def diccionario_familias(fam_dict):
+    """
+    Construye la búsqueda SKU -> familia una sola vez, para cruzar cada bloque del RFI con un .map en vez de un merge.
+    Si un SKU aparece repetido se toma la primera familia.
+    :param fam_dict: Diccionario de familias y SKUs (diccionario_sku_familia.xlsx), con columnas 'sku' y 'familia'
+    :return: pd.Series de familias con índice sku
     """
+    fam_dict = fam_dict.dropna(subset=['sku']).drop_duplicates('sku')
+    return pd.Series(fam_dict['familia'].values, index=fam_dict['sku'].values)
 
+
+def _bloque_nacional(data, familias, tipo, anio='2019'):
+    """
+    Limpia un bloque de T1 o T2 del RFI: filtra el año, ajusta orígenes, destinos y cantidades, y le pone la familia a
+    cada SKU. Retorna los totales del bloque agrupados por LLAVES_DEMANDA (sin limpiar textos) y las filas sin familia.
+    """
     # Eliminar filas con NaN en origen, destino, sku
     data = data.dropna(subset=['id_ciudad_origen', 'id_ciudad_destino', 'sku'])
 
-    # Configurar columna fecha a formato fecha, crear col fecha con año-mes. Filtrar solo 2019
+    # Configurar columna fecha a formato fecha, crear col fecha con año-mes. Filtrar el año lo antes posible
     data = data.astype({'fecha': 'datetime64'})
     data['fecha'] = data['fecha'].dt.strftime('%Y-%m')
-    data = data.loc[data['fecha'].str[:4] == '2019']
+    data = data.loc[data['fecha'].str[:4] == anio]
 
     # Filtrar nacional en t2, cambiar origen CGNA a CGNA_CEDI para t2 y CGNA_PLANT para t1 y poner cantidades en
     # toneladas positivas
@@ -41,28 +50,85 @@ def limpieza_nacional(data, fam_dict, tipo: str):
     else:
         pass
 
-    # Conteo inicial de demanda para saber cuánto se descartará
-    demanda_inicial = data['cantidad'].sum()
-
     # Ajustar destino CGNA a CGNA_CEDI
     data['id_ciudad_destino'] = data['id_ciudad_destino'].str.replace('CGNA', 'CGNA_CEDI')
 
-    # Seleccionar solo columnas relevantes
+    # Seleccionar solo columnas relevantes, y unir familias a data de demanda
     data = data.loc[:, ['fecha', 'id_ciudad_origen', 'id_ciudad_destino', 'sku', 'cantidad']]
-
-    # Unir familias a data de demanda
-    data = data.merge(fam_dict, how='left', on='sku')
+    data['familia'] = data['sku'].map(familias)
     data_omitida = data.loc[data['familia'].isna()]
     data = data.loc[~data['familia'].isna()]
 
     # Agrupar datos
-    data = data.groupby(['fecha', 'familia', 'id_ciudad_origen', 'id_ciudad_destino'])['cantidad'].sum().reset_index()
+    return data.groupby(LLAVES_DEMANDA)['cantidad'].sum(), data_omitida
+
+
+def _acumular(total, parcial):
+    """
+    Suma los totales agrupados de un bloque a los acumulados. El tamaño del acumulado depende de las llaves únicas, no
+    de las filas leídas.
+    """
+    if total is None:
+        return parcial
+    return pd.concat([total, parcial]).groupby(level=list(range(parcial.index.nlevels))).sum()
+
+
+def _terminar_nacional(total):
+    """
+    Deja los totales de T1 o T2 con la estructura de master demanda, con los textos limpios.
+    """
+    if total is None:
+        return pd.DataFrame(columns=LLAVES_DEMANDA + ['cantidad'])
+    data = total.reset_index()
 
     # Limpiar textos
     for col in ['id_ciudad_origen', 'id_ciudad_destino', 'familia']:
         data[col] = remover_tildes_espacios(data[col])
 
-    return data, data_omitida
+    return data
+
+
+def limpieza_nacional(data, fam_dict, tipo: str):
+    """
+    Limpia datos de T1 y T2 de RFI, dejándolos en un formato similar para luego concatenar. Para extractos de varios
+    años que no caben en memoria, ver limpieza_nacional_por_bloques.
+
+    :param data: datos de demanda limpios, con estructura de master demanda
+    :param fam_dict: Diccionario de familias y SKUs
+    :param apoyo_t2: Tabla de homologación de destinos de T2
+    :param tarifario: Tarifario de transporte
+    :param tipo: indicar si es 't1' o 't2'
+    """
+    total, data_omitida = _bloque_nacional(data, diccionario_familias(fam_dict), tipo)
+
+    return _terminar_nacional(total), data_omitida
+
+
+def limpieza_nacional_por_bloques(ruta, fam_dict, tipo: str, anio='2019', tamano_bloque=200000, ruta_omitidos=None):
+    """
+    Igual que limpieza_nacional, pero leyendo el extracto de T1 o T2 por bloques de `tamano_bloque` filas. Cada bloque
+    se filtra por año, se cruza con la búsqueda SKU -> familia y se suma a los totales acumulados, de modo que la
+    memoria no depende del largo del histórico. Las filas sin familia se agregan a `ruta_omitidos` a medida que salen.
+
+    :param ruta: ruta del .csv (t1_rfi.csv o t2_rfi.csv)
+    :param fam_dict: Diccionario de familias y SKUs
+    :param tipo: indicar si es 't1' o 't2'
+    :param anio: año a conservar, como texto
+    :param ruta_omitidos: .csv donde se agregan las filas sin familia. Si es None, no se guardan
+    :return: datos con estructura de master demanda, y número de filas omitidas
+    """
+    columnas = ['fecha', 'id_ciudad_origen', 'id_ciudad_destino', 'sku', 'cantidad', 'nacional_exportacion']
+    familias = diccionario_familias(fam_dict)
+    total, omitidas = None, 0
+
+    for bloque in pd.read_csv(ruta, usecols=lambda col: col in columnas, chunksize=tamano_bloque):
+        parcial, data_omitida = _bloque_nacional(bloque, familias, tipo, anio)
+        total = _acumular(total, parcial)
+        if ruta_omitidos is not None and data_omitida.shape[0] > 0:
+            data_omitida.to_csv(ruta_omitidos, mode='a', header=not os.path.exists(ruta_omitidos), index=False)
+        omitidas += data_omitida.shape[0]
+
+    return _terminar_nacional(total), omitidas
 
 
 def variables_decision_nacional(data, tarifario, apoyo_t2):
@@ -139,15 +205,19 @@ def variables_decision_nacional(data, tarifario, apoyo_t2):
     return data, data_omitida
 
 
-def limpieza_exp(exp):
+def _bloque_exp(exp, anio=2019):
+    """
+    Limpia un bloque del archivo de exportación. Retorna los totales del bloque agrupados por LLAVES_DEMANDA y las
+    filas descartadas por tener vacíos.
+    """
+    # Borrar filas con NaN. Filtrar año
+    exp = exp.loc[exp['año'] == anio].copy()
+    exp_omitida = exp.loc[exp[['familia', 'id_ciudad_destino', 'cantidad']].isna().any(axis=1)]
+    exp = exp.dropna(subset=['familia', 'id_ciudad_destino', 'cantidad'])
 
     # Crear id_ciudad_origen para poder cruzar con tarifario
     exp['id_ciudad_origen'] = 'CGNA_PORT'
 
-    # Borrar filas con NaN. Filtrar año
-    exp = exp.loc[exp['año'] == 2019]
-    exp = exp.dropna(subset=['familia', 'id_ciudad_destino', 'cantidad'])
-
     #  Limpiar campos de texto de EXP
     exp['id_ciudad_destino'] = remover_tildes_espacios(exp['id_ciudad_destino'])
     exp['familia'] = remover_tildes_espacios(exp['familia'])
@@ -156,9 +226,39 @@ def limpieza_exp(exp):
     exp['fecha'] = exp['año'].astype(str) + '-' + exp['mes'].astype(str).str.pad(2, fillchar='0')
 
     # Agrupar por columnas relevantes
-    exp = exp.groupby(['fecha', 'familia', 'id_ciudad_origen', 'id_ciudad_destino'])['cantidad'].sum().reset_index()
+    return exp.groupby(LLAVES_DEMANDA)['cantidad'].sum(), exp_omitida
+
+
+def limpieza_exp(exp):
+
+    total, _ = _bloque_exp(exp)
+
+    return total.reset_index()
 
-    return exp
+
+def limpieza_exp_por_bloques(ruta, anio=2019, tamano_bloque=200000, ruta_omitidos=None):
+    """
+    Igual que limpieza_exp, pero leyendo el archivo de exportación por bloques de `tamano_bloque` filas y acumulando
+    los totales. Las filas con vacíos en familia, destino o cantidad se agregan a `ruta_omitidos`.
+
+    :param ruta: ruta del .csv (exp_rfi.csv)
+    :param anio: año a conservar
+    :param ruta_omitidos: .csv donde se agregan las filas descartadas. Si es None, no se guardan
+    :return: datos con estructura de master demanda, y número de filas omitidas
+    """
+    columnas = ['año', 'mes', 'familia', 'id_ciudad_destino', 'cantidad']
+    total, omitidas = None, 0
+
+    for bloque in pd.read_csv(ruta, usecols=columnas, chunksize=tamano_bloque):
+        parcial, exp_omitida = _bloque_exp(bloque, anio)
+        total = _acumular(total, parcial)
+        if ruta_omitidos is not None and exp_omitida.shape[0] > 0:
+            exp_omitida.to_csv(ruta_omitidos, mode='a', header=not os.path.exists(ruta_omitidos), index=False)
+        omitidas += exp_omitida.shape[0]
+
+    if total is None:
+        return pd.DataFrame(columns=LLAVES_DEMANDA + ['cantidad']), omitidas
+    return total.reset_index(), omitidas
 
 
 def variables_decision_exp(exp, tarifario, factor_eficiencia):
@@ -198,16 +298,24 @@ def variables_decision_exp(exp, tarifario, factor_eficiencia):
 
 
 if __name__ == '__main__':
-    t1 = pd.read_csv('../rfi/t1_rfi.csv')
-    t2 = pd.read_csv('../rfi/t2_rfi.csv')
-    exp = pd.read_csv('../rfi/exp_rfi.csv')
     dict_sku_fam = pd.read_excel('../rfi/diccionario_sku_familia.xlsx')
     tarifario = pd.read_csv('../rfi/master_tarifario.csv')
     apoyo_t2 = pd.read_csv('../rfi/apoyo_t2_rfi.csv')
 
-    t1_limpio, t1_omitido = limpieza_nacional(t1, dict_sku_fam, tipo='t1')  # Omitido es familias en blanco
-    t2_limpio, t2_omitido = limpieza_nacional(t2, dict_sku_fam, tipo='t2')
-    exp_limpio = limpieza_exp(exp)
+    # Los extractos se leen por bloques, y los omitidos se van guardando en la carpeta de RFI
+    ruta_omitidos = '../rfi/baseline_demanda_omitida.csv'
+    ruta_exp_omitidos = '../rfi/baseline_exportacion_omitida.csv'
+    for ruta in [ruta_omitidos, ruta_exp_omitidos]:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    # Omitido es familias en blanco
+    t1_limpio, t1_omitido = limpieza_nacional_por_bloques('../rfi/t1_rfi.csv', dict_sku_fam, tipo='t1',
+                                                          ruta_omitidos=ruta_omitidos)
+    t2_limpio, t2_omitido = limpieza_nacional_por_bloques('../rfi/t2_rfi.csv', dict_sku_fam, tipo='t2',
+                                                          ruta_omitidos=ruta_omitidos)
+    exp_limpio, exp_omitido = limpieza_exp_por_bloques('../rfi/exp_rfi.csv', ruta_omitidos=ruta_exp_omitidos)
+    print(f"Filas omitidas: {t1_omitido} en T1, {t2_omitido} en T2, {exp_omitido} en exportación")
 
     demanda_concat = pd.concat([t1_limpio, t2_limpio, exp_limpio], ignore_index=True)
 
@@ -217,7 +325,3 @@ if __name__ == '__main__':
         demanda_concat.to_excel(writer1, sheet_name='master_demanda', index=False)
         tarifario.to_excel(writer1, sheet_name='master_tarifario', index=False)
         apoyo_t2.to_excel(writer1, sheet_name='master_homologacion', index=False)
-
-    # Baseline omitido preliminarmente. Lo guardaremos en la carpeta de RFI
-    pd.concat([t1_omitido, t2_omitido], ignore_index=True).to_csv('../rfi/baseline_demanda_omitida.csv')
-
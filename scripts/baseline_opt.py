@@ -1,21 +1,17 @@
 """
-Código para ejecutar la optimización del baseline
+Código para ejecutar la optimización del baseline. Equivale a
+`python scripts/herramienta.py optimize input/datamaster_base_opt.xlsx --prefijo base_opt_` (ver herramienta.py para
+todas las opciones).
 """
-from output import *
-import time
-from limpieza_masters import limpieza_data
+import sys
+from herramienta import main
 
+# Backend de solución (ver solvers.BACKENDS). Se puede indicar como argumento del script
+solver = sys.argv[1] if len(sys.argv) > 1 else 'glpk'
+# Modo de solución (ver output.ejecucion): monolitico, horizonte_rodante, descomposicion, flujo, entero o diseno
+modo = sys.argv[2] if len(sys.argv) > 2 else 'monolitico'
 
-start_time = time.time()
-sheet_names = ['master_producto', 'master_ubicaciones', 'master_demanda',
-               'master_tarifario', 'master_red_infraestructura']
-data = limpieza_data('input/datamaster_base_opt.xlsx', sheet_names)
-
-output = [i for i in ejecucion(data)]
-output_names = ['base_opt_decision_consolidado.csv']
-output_path = 'output/'
-
-# Guardar output
-guardar_outputs([output[0]], [output_names[0]], output_path)
-print(f"Tiempo total de ejecucion: {time.time() - start_time} segundos\n",
-      f"Costo total operacion {output[2]} COP")
\ No newline at end of file
+# Con el modo 'descomposicion' se usa un pool de procesos, que en Windows importa de nuevo este script
+if __name__ == '__main__':
+    main(['optimize', 'input/datamaster_base_opt.xlsx', '--prefijo', 'base_opt_', '--nombre', 'baseline_opt',
+          '--solver', solver, '--modo', modo])
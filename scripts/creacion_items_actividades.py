@@ -1,5 +1,59 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+
+# Tipos de items (filas del modelo). Se guardan como categoría
+TIPOS_ITEMS = ['produccion', 'flujo', 'demanda', 'capacidad_din', 'capacidad_est']
+
+
+def _catalogo_nodos(master_red, master_ubicaciones, master_demanda):
+    """
+    Diccionario de nodos compartido por items y actividades: nodos de la red (sin CLIENTE), ubicaciones y ciudades de
+    la demanda, ordenados. Al usar el mismo diccionario en las dos tablas, los códigos enteros de 'nodo', 'origen' y
+    'destino' son comparables y los cruces de matriz_coef se hacen sobre enteros.
+
+    :return: pd.Index con los nombres de los nodos
+    """
+    nodos = pd.concat([master_red['id_locacion_origen'], master_red['id_locacion_destino'],
+                       master_ubicaciones['id_locacion'], master_demanda['id_ciudad']], ignore_index=True)
+    nodos = nodos.dropna().unique()
+    return pd.Index(sorted(x for x in nodos if x != 'CLIENTE'))
+
+
+def _catalogo_familias(master_demanda):
+    """
+    Diccionario de familias compartido por items y actividades, en el orden en que aparecen en el master de demanda.
+
+    :return: pd.Index con los nombres de las familias
+    """
+    return pd.Index(master_demanda['familia'].dropna().unique())
+
+
+def _categoria(columna, catalogo):
+    """
+    Convierte una columna a categoría con el diccionario `catalogo`. Los valores que no estén en el catálogo se agregan
+    al final, para no perder información (p. ej. un nodo de producción que no está en la red).
+    """
+    faltantes = pd.Index(columna.dropna().unique()).difference(catalogo)
+    return pd.Categorical(columna, categories=catalogo.append(faltantes) if len(faltantes) else catalogo)
+
+
+def _pares_mes_familia(master_demanda):
+    """
+    Retorna los pares (fecha, familia) presentes en el master de demanda, en el orden en que se recorren en la
+    construcción de items y actividades: meses ordenados ascendentemente y, dentro de cada mes, las familias en el orden
+    en que aparecen en el master de demanda. Se agregan las columnas `orden_mes` y `orden_par` con la posición del mes
+    y del par.
+
+    :param master_demanda:
+    :return: pd.DataFrame con columnas 'fecha', 'familia', 'orden_mes', 'orden_par'
+    """
+    pares = master_demanda.loc[:, ['fecha', 'familia']].drop_duplicates()
+    pares = pares.sort_values('fecha', kind='mergesort').reset_index(drop=True)
+    pares['orden_mes'] = pares['fecha'].rank(method='dense').astype(int) - 1
+    pares['orden_par'] = np.arange(pares.shape[0])
+
+    return pares
 
 
 def build_items(master_red: pd.DataFrame, master_ubicaciones: pd.DataFrame, master_demanda, master_producto):
@@ -8,229 +62,334 @@ def build_items(master_red: pd.DataFrame, master_ubicaciones: pd.DataFrame, mast
     ignorando material importado, ya que toca hacer cambios a la tabla de ubicación para agregar a CGNA_PLANT como
     CGNA_PLANT_DISTR
 
+    Las partes que no dependen del mes (restricciones de capacidad, nodos de flujo y nodos de producción) se calculan
+    una sola vez y se cruzan con los pares (fecha, familia) del master de demanda, sin ciclos por mes ni por familia.
+    El orden de las filas es: por cada mes, por cada familia, producción, flujo y demanda; y al final del mes las
+    restricciones de capacidad dinámica y estática.
+
+    'producto', 'nodo' y 'tipo' son categorías: 'nodo' y 'producto' usan los mismos diccionarios que build_activities,
+    y 'tiempo' es el mes entero del master de demanda.
+
     :param master_producto:
     :param master_demanda:
     :param master_ubicaciones:
     :param master_red:
     :return:
     """
+    columnas = ['tiempo', 'producto', 'nodo', 'tipo', 'valor']
 
-    # De hecho, se debe crear primero la sección de restricciones estáticas y dinámicas, ya que no dependen de producto.
-    # Delimitar cantidad de tiempo
-    MONTHS = sorted(master_demanda['fecha'].unique())
+    # Pares (fecha, familia) en orden de recorrido, y meses ordenados
+    pares = _pares_mes_familia(master_demanda)
+    meses = pares.loc[:, ['fecha', 'orden_mes']].drop_duplicates()
 
     # Nodos totales y únicos de la red
     nodos = pd.concat([master_red.loc[:, 'id_locacion_origen'], master_red.loc[:, 'id_locacion_destino']],
                       ignore_index=True).unique()
 
-    # Creamos DF final que tiene estructura definida en documentacion: `tiempo`, `producto`, `nodo`, `tipo`, `valor`
-    item_df = pd.DataFrame(columns=['tiempo', 'producto', 'nodo', 'tipo', 'valor'])
-    for t in MONTHS:
-
-        # RESTR DINAMICA Y ESTATICA: Extraemos restricciones dinámicas y estáticas y lo ponemos en formato de `item_df`
-        nodos_restr = master_ubicaciones.loc[:, ['id_locacion', 'capacidad_din', 'capacidad_est']]
-        nodos_restr = pd.melt(nodos_restr, id_vars=['id_locacion'], value_vars=['capacidad_din', 'capacidad_est'])
-        nodos_restr.columns = item_df.columns[-3:]
-
-        # Borramos las filas que tengan `nodos_restr[valor].isna()`
-        nodos_restr = nodos_restr.dropna(subset=['valor'])
-
-        # Añadimos tiempo `t` y producto `NaN` a esas restricciones para que se pueda concatenar a `item_df`
-        nodos_restr['tiempo'] = t
-        nodos_restr['producto'] = np.nan
-
-        # PRODUCTOS: seleccionamos los productos (familias) del master de demanda para el mes en cuestion
-        PRODUCTS = master_demanda.loc[master_demanda['fecha'] == t, 'familia'].unique()
-        for k in PRODUCTS:
-            # PRODUCCION: Buscamos el sitio origen del producto y su producción máx en master de productos.
-            # Debería ser solo UN origen
-            nodos_prod = master_producto.loc[master_producto['familia'] == k, ['familia',
-                                                                               'ubicacion_producto', 'produccion_max']]
-            # Renombrar y agregar columnas de tipo y tiempo
-            nodos_prod.columns = ['producto', 'nodo', 'valor']
-            nodos_prod['tipo'] = 'produccion'
-            nodos_prod['tiempo'] = t
-
-            # DEMANDA: buscar todos los clientes para producto k en tiempo t. Los clientes los tomaremos como ciudades
-            clientes_demanda = master_demanda.loc[(master_demanda['fecha'] == t) & (master_demanda['familia'] == k),
-                                                  ['id_ciudad', 'cantidad']]
-            # Renombrar y crear columnas restantes para que tenga estructura de `item_df`
-            clientes_demanda.columns = ['nodo', 'valor']
-            clientes_demanda['tiempo'] = t
-            clientes_demanda['producto'] = k
-            clientes_demanda['tipo'] = 'demanda'
-
-            # FLUJO: los nodos restantes son de flujo. Estos son la diferencia de conjuntos entre todos los nodos de la
-            # red, el nodo de produccion, y el nodo de demanda. Recordar que hay que borrar CLIENTE de los nodos únicos,
-            # ya que en ITEMS ya estará representado como `clientes_demanda`
-            nodos_flujo = list(set(nodos) - ({'CLIENTE'} | set(nodos_prod['nodo'])))
-            nodos_flujo = pd.DataFrame(data={'tiempo': t, 'producto': k, 'nodo': nodos_flujo,
-                                             'tipo': 'flujo', 'valor': 0})
-
-            # ITEMS: Concatenar las secciones que iteran por producto a `item_df`
-            item_df = pd.concat([item_df, nodos_prod, nodos_flujo, clientes_demanda], ignore_index=True)
-
-        # ITEMS: Concatenar las restricciones estática y dinámica a `item_df`
-        item_df = pd.concat([item_df, nodos_restr], ignore_index=True)
+    # RESTR DINAMICA Y ESTATICA: Extraemos restricciones dinámicas y estáticas una sola vez y lo ponemos en formato de
+    # `item_df`. Borramos las filas que tengan `nodos_restr[valor].isna()`
+    nodos_restr = master_ubicaciones.loc[:, ['id_locacion', 'capacidad_din', 'capacidad_est']]
+    nodos_restr = pd.melt(nodos_restr, id_vars=['id_locacion'], value_vars=['capacidad_din', 'capacidad_est'])
+    nodos_restr.columns = ['nodo', 'tipo', 'valor']
+    nodos_restr['orden_fila'] = np.arange(nodos_restr.shape[0])
+    nodos_restr = nodos_restr.dropna(subset=['valor'])
+
+    # Cruzar restricciones con todos los meses. Producto es `NaN` y van al final de cada mes
+    nodos_restr['key'] = 0
+    meses_restr = meses.assign(key=0)
+    nodos_restr = meses_restr.merge(nodos_restr, on='key').drop(columns=['key'])
+    nodos_restr = nodos_restr.rename(columns={'fecha': 'tiempo'})
+    nodos_restr['producto'] = np.nan
+    nodos_restr['orden_par'] = pares.shape[0]
+    nodos_restr['seccion'] = 0
+
+    # PRODUCCION: Buscamos el sitio origen de cada producto y su producción máx en master de productos, y lo cruzamos
+    # con los pares (fecha, familia). Debería ser solo UN origen por familia
+    producto = master_producto.loc[:, ['familia', 'ubicacion_producto', 'produccion_max']].copy()
+    producto['orden_fila'] = np.arange(producto.shape[0])
+    nodos_prod = pares.merge(producto, on='familia', how='inner')
+    nodos_prod = nodos_prod.rename(columns={'fecha': 'tiempo', 'familia': 'producto', 'ubicacion_producto': 'nodo',
+                                            'produccion_max': 'valor'})
+    nodos_prod['tipo'] = 'produccion'
+    nodos_prod['seccion'] = 0
+
+    # FLUJO: los nodos restantes son de flujo. Estos son la diferencia de conjuntos entre todos los nodos de la red, el
+    # nodo de produccion, y el nodo de demanda. Recordar que hay que borrar CLIENTE de los nodos únicos, ya que en ITEMS
+    # ya estará representado como `clientes_demanda`. Se cruzan todos los pares con los nodos y se quitan los nodos de
+    # producción de cada familia
+    nodos_flujo = pd.DataFrame({'nodo': [x for x in nodos if x != 'CLIENTE']})
+    nodos_flujo['orden_fila'] = np.arange(nodos_flujo.shape[0])
+    nodos_flujo['key'] = 0
+    nodos_flujo = pares.assign(key=0).merge(nodos_flujo, on='key').drop(columns=['key'])
+    nodos_flujo = nodos_flujo.merge(producto.loc[:, ['familia', 'ubicacion_producto']].drop_duplicates(),
+                                    left_on=['familia', 'nodo'], right_on=['familia', 'ubicacion_producto'],
+                                    how='left', indicator=True)
+    nodos_flujo = nodos_flujo.loc[nodos_flujo['_merge'] == 'left_only'].drop(columns=['ubicacion_producto', '_merge'])
+    nodos_flujo = nodos_flujo.rename(columns={'fecha': 'tiempo', 'familia': 'producto'})
+    nodos_flujo['tipo'] = 'flujo'
+    nodos_flujo['valor'] = 0
+    nodos_flujo['seccion'] = 1
+
+    # DEMANDA: todos los clientes de cada producto en cada tiempo. Los clientes los tomaremos como ciudades
+    clientes_demanda = master_demanda.loc[:, ['fecha', 'familia', 'id_ciudad', 'cantidad']].copy()
+    clientes_demanda['orden_fila'] = np.arange(clientes_demanda.shape[0])
+    clientes_demanda = clientes_demanda.merge(pares, on=['fecha', 'familia'], how='inner')
+    clientes_demanda = clientes_demanda.rename(columns={'fecha': 'tiempo', 'familia': 'producto', 'id_ciudad': 'nodo',
+                                                        'cantidad': 'valor'})
+    clientes_demanda['tipo'] = 'demanda'
+    clientes_demanda['seccion'] = 2
+
+    # ITEMS: Concatenar todas las secciones y ordenarlas según el recorrido por mes y familia
+    item_df = pd.concat([nodos_prod, nodos_flujo, clientes_demanda, nodos_restr], ignore_index=True)
+    item_df = item_df.sort_values(['orden_mes', 'orden_par', 'seccion', 'orden_fila'], kind='mergesort')
+    item_df = item_df.loc[:, columnas].reset_index(drop=True)
+
+    # Codificar con los diccionarios compartidos
+    item_df['producto'] = _categoria(item_df['producto'], _catalogo_familias(master_demanda))
+    item_df['nodo'] = _categoria(item_df['nodo'], _catalogo_nodos(master_red, master_ubicaciones, master_demanda))
+    item_df['tipo'] = pd.Categorical(item_df['tipo'], categories=TIPOS_ITEMS)
+    item_df['valor'] = item_df['valor'].astype(float)
 
     return item_df
 
 
 def build_activities(master_red, master_tarifario, master_demanda, master_ubicaciones):
     """
-    Construye la tabla de Actividades que contiene 6 columnas: 'tiempo', 'producto', 'transporte', 'origen', 'destino', 'costo'.
+    Construye la tabla de Actividades que contiene 7 columnas: 'tiempo', 'producto', 'transporte', 'origen', 'destino', 'costo'
+    y 'almacenamiento'.
     Esos origenes y destinos pueden ser id_locaciones para comunicaciones entre nodos de la infraestructura de Esenttia,
     o pueden ser id_ciudades para las entregas a clientes. En esta tabla se evidencian todas las actividades de distribución
     y almacenamiento de la red, así como sus costos
+
+    El catálogo de arcos (origen, destino, capacidad del vehículo y costo) se resuelve una sola vez, y luego se expande a
+    (mes, familia, cliente) con merges vectorizados. El orden de las filas es: por cada mes, por cada familia, arcos
+    entre nodos de la red, arcos hacia clientes y almacenamiento.
+
+    'producto', 'origen' y 'destino' son categorías con los mismos diccionarios que build_items. El almacenamiento se
+    marca con la columna booleana 'almacenamiento', con origen y destino iguales al nodo que almacena.
+
     :param master_ubicaciones:
     :param master_demanda:
     :param master_red:
     :param master_tarifario:
     :return:
     """
+    columnas = ['tiempo', 'producto', 'transporte', 'origen', 'destino', 'costo', 'almacenamiento']
 
-    # Delimitar cuantos meses hay para t
-    MONTHS = sorted(master_demanda['fecha'].unique())
+    # Pares (fecha, familia) en orden de recorrido
+    pares = _pares_mes_familia(master_demanda).assign(key=0)
 
     # Abrir red infraestructra, seleccionar columnas relevantes ['origen', 'destino']
-    master_red = master_red.loc[:, ['id_locacion_origen', 'id_locacion_destino']]
+    master_red = master_red.loc[:, ['id_locacion_origen', 'id_locacion_destino']].copy()
+    master_red['orden_red'] = np.arange(master_red.shape[0])
 
     # Abrir master tarifario, seleccionar columnas relevantes
-    master_tarifario = master_tarifario[['id_ciudad_origen', 'id_ciudad_destino', 'capacidad', 'costo']]
-
-    # Crear DF final con estructura definida en documentación
-    actividad_df = pd.DataFrame(columns=['tiempo', 'producto', 'transporte', 'origen', 'destino', 'costo'])
-
-    for t in MONTHS:
-        # PRODUCTOS: seleccionamos los productos (familias) del master de demanda para el mes `t`
-        PRODUCTS = master_demanda.loc[master_demanda['fecha'] == t, 'familia'].unique()
-        for k in PRODUCTS:
-            # ALMACENAMIENTO: crear actividad de almacenamiento a partir de los nodos que tengan valor diferente a cero
-            # en capacidad_est en el master de ubicaciones. Es decir, que no sean NaN
-            nodos_alm = master_ubicaciones.loc[~master_ubicaciones['capacidad_est'].isna(),
-                                               ['id_locacion', 'costo_almacenamiento']]
-            # Para distinguir almacenamiento (mov. en dimension tiempo) de demás actividades, agregar 'ALMACENAMIENTO'
-            nodos_alm['id_locacion'] = nodos_alm['id_locacion'] + '_ALMACENAMIENTO'
-
-            # Renombramos columnas
-            nodos_alm.columns = ['origen', 'costo']
-
-            # Agregar columna destino, que es una copia de la columna origen, producto, tiempo, y transporte
-            nodos_alm['destino'] = nodos_alm['origen'].copy()
-            nodos_alm['tiempo'] = t
-            nodos_alm['producto'] = k
-            nodos_alm['transporte'] = np.nan
-
-            # TRANSPORTE: Reemplazar CLIENTE de master_red por `id_ciudad` de `master_demanda`. Haremos un DF de la
-            # demanda, para luego hacerle un join con master_red de acuerdo a los sitios que pueden suplir CLIENTE
-            clientes_demanda = master_demanda.loc[(master_demanda['fecha'] == t) & (master_demanda['familia'] == k),
-                                                  'id_ciudad'].to_frame()
-            clientes_demanda['key'] = 'CLIENTE'
-
-            # Separamos master_red entre los que tienen en destino CLIENTE y los que no
-            master_red_cliente = master_red.loc[master_red['id_locacion_destino'] == 'CLIENTE', :]
-            master_red_no_cliente = master_red.loc[~(master_red['id_locacion_destino'] == 'CLIENTE'), :]
-            # Cruzar `master_red_cliente` con `clientes_demanda`
-            master_red_cliente = master_red_cliente.merge(clientes_demanda, left_on=['id_locacion_destino'],
-                                                          right_on=['key'], how='inner')
-            master_red_cliente = master_red_cliente.drop(columns=['id_locacion_destino', 'key'])
-            master_red_cliente = master_red_cliente.rename(columns={'id_ciudad': 'id_locacion_destino'})
-
-            # Volvemos a unir master_red_cliente con master_red
-            master_red_clean = pd.concat([master_red_no_cliente, master_red_cliente], ignore_index=True)
-
-            # Join entre tarifario y master de red
-            # Se hace inner join porque si no hay vehículos que transporten, no puede existir arco en el `master_red`.
-            nodos_trans = master_red_clean.merge(master_tarifario,
-                                                 left_on=['id_locacion_origen', 'id_locacion_destino'],
-                                                 right_on=['id_ciudad_origen', 'id_ciudad_destino'], how='inner')
-
-            # Renombramos columnas específicas para que tengan formato de `actividad_df`
-            nodos_trans = nodos_trans.rename(columns={'id_locacion_origen': 'origen',
-                                                      'id_locacion_destino': 'destino',
-                                                      'capacidad': 'transporte'})
-
-            # Filtrar columnas relevantes
-            nodos_trans = nodos_trans.loc[:, ['transporte', 'origen', 'destino', 'costo']]
-
-            # Crear columnas restantes para tener estructura de `actividad_df`
-            nodos_trans['tiempo'] = t
-            nodos_trans['producto'] = k
-
-            # ACIVIDADES: Concatenar nodos con transportes y almacenamiento a `actividad_df`
-            actividad_df = pd.concat([actividad_df, nodos_trans, nodos_alm], ignore_index=True)
+    master_tarifario = master_tarifario.loc[:, ['id_ciudad_origen', 'id_ciudad_destino', 'capacidad', 'costo']].copy()
+    master_tarifario['orden_tarifa'] = np.arange(master_tarifario.shape[0])
+
+    # CATALOGO DE ARCOS: Separamos master_red entre los que tienen en destino CLIENTE y los que no. Se hace inner join
+    # con el tarifario porque si no hay vehículos que transporten, no puede existir arco en el `master_red`.
+    master_red_cliente = master_red.loc[master_red['id_locacion_destino'] == 'CLIENTE', :]
+    master_red_no_cliente = master_red.loc[~(master_red['id_locacion_destino'] == 'CLIENTE'), :]
+
+    # Arcos entre nodos de la red. No dependen del mes ni de la familia
+    arcos_red = master_red_no_cliente.merge(master_tarifario, left_on=['id_locacion_origen', 'id_locacion_destino'],
+                                            right_on=['id_ciudad_origen', 'id_ciudad_destino'], how='inner')
+    arcos_red = arcos_red.rename(columns={'id_locacion_origen': 'origen', 'id_locacion_destino': 'destino',
+                                          'capacidad': 'transporte'})
+    arcos_red['orden_cliente'] = 0
+    arcos_red['seccion'] = 0
+    arcos_red['almacenamiento'] = False
+
+    # Arcos hacia CLIENTE: todas las tarifas que salen de los nodos que pueden suplir CLIENTE. El destino es la ciudad
+    # del tarifario, que luego se cruza con las ciudades de `master_demanda`
+    arcos_cliente = master_red_cliente.merge(master_tarifario, left_on=['id_locacion_origen'],
+                                             right_on=['id_ciudad_origen'], how='inner')
+    arcos_cliente = arcos_cliente.rename(columns={'id_locacion_origen': 'origen', 'id_ciudad_destino': 'destino',
+                                                  'capacidad': 'transporte'})
+    arcos_cliente = arcos_cliente.loc[:, ['origen', 'destino', 'transporte', 'costo', 'orden_red', 'orden_tarifa']]
+    arcos_cliente['almacenamiento'] = False
+
+    # ALMACENAMIENTO: crear actividad de almacenamiento a partir de los nodos que tengan valor diferente a cero en
+    # capacidad_est en el master de ubicaciones. Es decir, que no sean NaN. Para distinguir almacenamiento (mov. en
+    # dimension tiempo) de demás actividades, se marca la columna 'almacenamiento'. Destino es una copia de origen
+    nodos_alm = master_ubicaciones.loc[~master_ubicaciones['capacidad_est'].isna(),
+                                       ['id_locacion', 'costo_almacenamiento']]
+    nodos_alm.columns = ['origen', 'costo']
+    nodos_alm['destino'] = nodos_alm['origen'].copy()
+    nodos_alm['transporte'] = np.nan
+    nodos_alm['almacenamiento'] = True
+    nodos_alm['orden_red'] = np.arange(nodos_alm.shape[0])
+    nodos_alm['orden_cliente'] = 0
+    nodos_alm['orden_tarifa'] = 0
+    nodos_alm['seccion'] = 2
+
+    # TRANSPORTE: expandir arcos de la red y almacenamiento a todos los pares (fecha, familia)
+    nodos_trans = pares.merge(arcos_red.assign(key=0), on='key')
+    nodos_alm = pares.merge(nodos_alm.assign(key=0), on='key')
+
+    # TRANSPORTE A CLIENTES: Reemplazar CLIENTE por `id_ciudad` de `master_demanda`, cruzando la demanda de cada par
+    # (fecha, familia) con los arcos hacia clientes
+    clientes_demanda = master_demanda.loc[:, ['fecha', 'familia', 'id_ciudad']].copy()
+    clientes_demanda['orden_cliente'] = np.arange(clientes_demanda.shape[0])
+    clientes_demanda = clientes_demanda.merge(pares, on=['fecha', 'familia'], how='inner')
+    nodos_cliente = clientes_demanda.merge(arcos_cliente, left_on=['id_ciudad'], right_on=['destino'], how='inner')
+    nodos_cliente['seccion'] = 1
+
+    # ACIVIDADES: Concatenar transportes y almacenamiento, y ordenarlos según el recorrido por mes y familia
+    actividad_df = pd.concat([nodos_trans, nodos_cliente, nodos_alm], ignore_index=True)
+    actividad_df = actividad_df.sort_values(['orden_par', 'seccion', 'orden_red', 'orden_cliente', 'orden_tarifa'],
+                                            kind='mergesort')
+    actividad_df = actividad_df.rename(columns={'fecha': 'tiempo', 'familia': 'producto'})
+    actividad_df = actividad_df.loc[:, columnas].reset_index(drop=True)
+
+    # Codificar con los diccionarios compartidos. Origen y destino usan el mismo diccionario de nodos
+    nodos = _catalogo_nodos(master_red, master_ubicaciones, master_demanda)
+    faltantes = pd.Index(pd.concat([actividad_df['origen'], actividad_df['destino']]).unique()).difference(nodos)
+    nodos = nodos.append(faltantes)
+    actividad_df['producto'] = _categoria(actividad_df['producto'], _catalogo_familias(master_demanda))
+    actividad_df['origen'] = pd.Categorical(actividad_df['origen'], categories=nodos)
+    actividad_df['destino'] = pd.Categorical(actividad_df['destino'], categories=nodos)
+    actividad_df['transporte'] = actividad_df['transporte'].astype(float)
+    actividad_df['costo'] = actividad_df['costo'].astype(float)
+    actividad_df['almacenamiento'] = actividad_df['almacenamiento'].astype(bool)
 
     return actividad_df
 
 
-def matriz_coef(items_df: pd.DataFrame, actividades_df: pd.DataFrame):
+def _codigos(columnas, categorias=None):
     """
-    v.2
-    Función optimizada para crear la matriz de coeficientes con base a las actividades (columnas) e ítems (filas)
-    ingresadas. Explota la velocidad de procesamiento de pd.merge() para realizar el cruce de condiciones por escenario
-    o flujo.
+    Códigos enteros de una o varias columnas con un diccionario común. Si no se entrega `categorias`, el diccionario es
+    la unión de las categorías (o valores) de las columnas. Los valores nulos quedan con código -1.
+
+    :param columnas: lista de pd.Series, categóricas o no
+    :return: lista de np.array int64, y el pd.Index del diccionario
+    """
+    if categorias is None:
+        categorias = pd.Index([])
+        for columna in columnas:
+            valores = columna.cat.categories if hasattr(columna, 'cat') else pd.Index(columna.dropna().unique())
+            categorias = categorias.append(valores.difference(categorias))
+    return [pd.Categorical(columna, categories=categorias).codes.astype(np.int64) for columna in columnas], categorias
 
-    Retorna un np.array de coeficientes, siendo los indices `items_df`, y las columnas `actividades_df`.
+
+def _cruce(llave_items, idx, llave_actividades, idy, valor_mat):
+    """
+    Cruce (INNER JOIN) de items y actividades por una llave entera. Retorna las coordenadas y valores de la matriz.
+    """
+    izquierda = pd.DataFrame({'llave': llave_items, 'idx': idx})
+    derecha = pd.DataFrame({'llave': llave_actividades, 'idy': idy, 'valor_mat': valor_mat})
+    return pd.merge(izquierda, derecha, on='llave', how='inner').loc[:, ['idx', 'idy', 'valor_mat']]
+
+
+def _condiciones_coef(items_df: pd.DataFrame, actividades_df: pd.DataFrame):
+    """
+    Realiza el cruce de condiciones entre items (filas) y actividades (columnas). Explota la velocidad de procesamiento
+    de pd.merge() para realizar el cruce de condiciones por escenario o flujo.
+
+    Los cruces se hacen sobre una sola llave entera por fila, que combina el mes, el código de la familia y el código
+    del nodo (con los diccionarios de build_items y build_activities), en vez de cruzar columnas de texto. El
+    almacenamiento se distingue con la columna 'almacenamiento' de las actividades.
+
+    Retorna un pd.DataFrame con tres columnas: `idx` (posición del item), `idy` (posición de la actividad) y
+    `valor_mat` (coeficiente), que corresponde a la representación en coordenadas de la matriz de coeficientes.
 
     :param items_df: pd.DataFrame con los items del problema
     :param actividades_df: pd.DataFrame con las actividades (flujos) del problema
-    :return: np.array con los coeficientes de entrada y salida de las actividades, en relación a las restricciones
+    :return: pd.DataFrame con las coordenadas y valores no nulos de la matriz de coeficientes
     """
-    coef_mat = np.zeros((items_df.shape[0], actividades_df.shape[0]))
-
-    # Crear DFs para manejar tema de mutabilidad y columnas de indice de items y actividades
-    actividades_df = actividades_df.copy()
-    items_df = items_df.copy()
-    actividades_df['idy'] = actividades_df.index
-    items_df['idx'] = items_df.index
+    # Se usa la posición y no el índice, para que la matriz quede alineada con el orden de las filas aunque el índice
+    # no sea un RangeIndex
+    idx = np.arange(items_df.shape[0])
+
+    # Códigos enteros con diccionarios comunes a items y actividades. Los meses se desplazan para que el mes anterior
+    # al primero (condición 4) también tenga código positivo
+    (nodo, origen, destino), nodos = _codigos([items_df['nodo'], actividades_df['origen'], actividades_df['destino']])
+    (producto_items, producto_act), familias = _codigos([items_df['producto'], actividades_df['producto']])
+    tiempo_items = items_df['tiempo'].values.astype(np.int64)
+    tiempo_act = actividades_df['tiempo'].values.astype(np.int64)
+    tiempo_min = min(tiempo_items.min(initial=0), tiempo_act.min(initial=0)) - 1
+    tiempo_items, tiempo_act = tiempo_items - tiempo_min, tiempo_act - tiempo_min
+    n_familias, n_nodos = len(familias) + 1, len(nodos) + 1
+
+    def llave(tiempo, nodo, producto=None):
+        # Llave (tiempo, producto, nodo) en un solo entero. Sin producto, la llave es (tiempo, nodo)
+        producto = -1 if producto is None else producto
+        return (tiempo * n_familias + producto + 1) * n_nodos + nodo + 1
+
+    almacenamiento = actividades_df['almacenamiento'].values.astype(bool)
+    transporte = actividades_df['transporte'].values.astype(float)
+    tipo = items_df['tipo'].values
+    alm, mov = np.where(almacenamiento)[0], np.where(~almacenamiento)[0]
+    est, din = np.where(tipo == 'capacidad_est')[0], np.where(tipo == 'capacidad_din')[0]
 
     # Al ser seis grupos de condiciones, serían 6 JOIN. CONDICIONES:
     # ENTRADA DE FLUJO. al ser INNER, no habrá valores nulos
-    cond1 = pd.merge(items_df, actividades_df, left_on=['tiempo', 'producto', 'nodo'],
-                     right_on=['tiempo', 'producto', 'origen'], how='inner')
-    cond1['valor_mat'] = cond1['transporte'].copy()
+    cond1 = _cruce(llave(tiempo_items, nodo, producto_items), idx,
+                   llave(tiempo_act[mov], origen[mov], producto_act[mov]), mov, transporte[mov])
 
     # SALIDA DE FLUJO
-    cond2 = pd.merge(items_df, actividades_df, left_on=['tiempo', 'producto', 'nodo'],
-                     right_on=['tiempo', 'producto', 'destino'], how='inner')
-    cond2['valor_mat'] = -cond2['transporte'].copy()
+    cond2 = _cruce(llave(tiempo_items, nodo, producto_items), idx,
+                   llave(tiempo_act[mov], destino[mov], producto_act[mov]), mov, -transporte[mov])
 
     # ENTRADA INPUT A ALMACENAMIENTO
-    cond3_items = items_df.copy()
-    cond3_items.loc[:, 'nodo'] = cond3_items.loc[:, 'nodo'] + '_ALMACENAMIENTO'
-    cond3 = pd.merge(cond3_items, actividades_df, left_on=['tiempo', 'producto', 'nodo'],
-                     right_on=['tiempo', 'producto', 'origen'], how='inner')
-    cond3['valor_mat'] = 1
-    del cond3_items
-
-    # SALIDA OUTPUT ALMACENAMIENTO
-    cond4_items = items_df.copy()
-    cond4_items.loc[:, 'tiempo'] -= 1
-    cond4_items.loc[:, 'nodo'] = cond4_items.loc[:, 'nodo'] + '_ALMACENAMIENTO'
-    cond4 = pd.merge(cond4_items, actividades_df, left_on=['tiempo', 'producto', 'nodo'],
-                     right_on=['tiempo', 'producto', 'destino'], how='inner')
-    cond4['valor_mat'] = -1
-    del cond4_items
+    cond3 = _cruce(llave(tiempo_items, nodo, producto_items), idx,
+                   llave(tiempo_act[alm], origen[alm], producto_act[alm]), alm, 1.0)
+
+    # SALIDA OUTPUT ALMACENAMIENTO: el almacenamiento del mes t - 1 entra al nodo en el mes t
+    cond4 = _cruce(llave(tiempo_items - 1, nodo, producto_items), idx,
+                   llave(tiempo_act[alm], destino[alm], producto_act[alm]), alm, -1.0)
 
     # MAXIMO ALMACENAMIENTO (CAP ESTATICA)
-    cond5_items = items_df.loc[items_df['tipo'] == 'capacidad_est'].copy()
-    cond5_items.loc[:, 'nodo'] = cond5_items.loc[:, 'nodo'] + '_ALMACENAMIENTO'
-    cond5 = pd.merge(cond5_items, actividades_df, left_on=['tiempo', 'nodo'], right_on=['tiempo', 'origen'],
-                     how='inner')
-    cond5['valor_mat'] = 1
-    del cond5_items
+    cond5 = _cruce(llave(tiempo_items[est], nodo[est]), est, llave(tiempo_act[alm], origen[alm]), alm, 1.0)
 
     # MAXIMO FLUJO (CAP DINAMICA)
-    cond6_items = items_df.loc[items_df['tipo'] == 'capacidad_din']
-    cond6 = pd.merge(cond6_items, actividades_df, left_on=['tiempo', 'nodo'], right_on=['tiempo', 'destino'],
-                     how='inner')
-    cond6['valor_mat'] = cond6['transporte'].copy()
-    del cond6_items
+    cond6 = _cruce(llave(tiempo_items[din], nodo[din]), din, llave(tiempo_act[mov], destino[mov]), mov,
+                   transporte[mov])
+
+    return pd.concat([cond1, cond2, cond3, cond4, cond5, cond6], ignore_index=True)
+
+
+def matriz_coef(items_df: pd.DataFrame, actividades_df: pd.DataFrame):
+    """
+    v.3
+    Crea la matriz de coeficientes con base a las actividades (columnas) e ítems (filas) ingresadas. La matriz se
+    construye directamente en formato disperso (scipy.sparse) a partir de los seis cruces de condiciones, ya que la
+    gran mayoría de sus entradas son cero. Así se evita reservar una matriz densa de len(items) x len(actividades).
+
+    Retorna una scipy.sparse.csr_matrix de coeficientes, siendo las filas `items_df`, y las columnas `actividades_df`.
 
-    condiciones = pd.concat([cond1, cond2, cond3, cond4, cond5, cond6], ignore_index=True)
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades (flujos) del problema
+    :return: sp.csr_matrix con los coeficientes de entrada y salida de las actividades, en relación a las restricciones
+    """
+    condiciones = _condiciones_coef(items_df, actividades_df)
+
+    # Si una misma celda aparece en más de una condición, prevalece la última (igual que al asignar en la matriz densa)
+    condiciones = condiciones.drop_duplicates(subset=['idx', 'idy'], keep='last')
+
+    coef_mat = sp.coo_matrix((condiciones['valor_mat'].astype(float).values,
+                              (condiciones['idx'].astype(int).values, condiciones['idy'].astype(int).values)),
+                             shape=(items_df.shape[0], actividades_df.shape[0]))
+
+    return coef_mat.tocsr()
+
+
+def matriz_coef_densa(items_df: pd.DataFrame, actividades_df: pd.DataFrame):
+    """
+    v.2
+    Versión densa de matriz_coef(). Se mantiene como referencia para comparar resultados y tiempos en speed_test.py, ya
+    que reserva una matriz np.zeros((len(items), len(actividades))) y la llena fila a fila.
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades (flujos) del problema
+    :return: np.array con los coeficientes de entrada y salida de las actividades, en relación a las restricciones
+    """
+    coef_mat = np.zeros((items_df.shape[0], actividades_df.shape[0]))
+    condiciones = _condiciones_coef(items_df, actividades_df)
 
     # Crear matriz de coeficiente a partir de tabla de condiciones
     for index, condicion in condiciones.iterrows():
-        coef_mat[condicion['idx'], condicion['idy']] = condicion['valor_mat']
+        coef_mat[int(condicion['idx']), int(condicion['idy'])] = condicion['valor_mat']
 
     return coef_mat
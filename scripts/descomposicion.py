@@ -0,0 +1,294 @@
+"""
+En este script se encuentra la descomposición del modelo por familia de producto. Las familias solo comparten las filas
+de capacidad de los nodos ('capacidad_din' y 'capacidad_est', condiciones 5 y 6 de matriz_coef), el resto del modelo es
+un problema de flujo independiente por familia.
+
+Se usa relajación Lagrangiana sobre las filas de capacidad: con precios de capacidad λ >= 0 fijos, cada familia se
+resuelve por separado con costos c_k + A_cap_k' λ, en paralelo en un pool de procesos. En cada iteración se reporta:
+    - cota inferior: valor de la función dual, sum_k z_k(λ) - λ b_cap
+    - cota superior: costo de la mejor solución que cumple las capacidades. Se obtiene con un maestro restringido, un
+      LP pequeño que escoge por familia una combinación convexa de las soluciones ya encontradas (que cumple las filas
+      de la familia) sujeta a las capacidades
+
+Los precios de la siguiente iteración son los duales de capacidad del maestro restringido (Dantzig-Wolfe), que
+convergen en un número finito de iteraciones. Mientras el maestro necesita exceder alguna capacidad (su holgura
+penalizada es positiva), porque las soluciones encontradas aún no alcanzan a cumplir las capacidades, los precios se
+actualizan con pasos de subgradiente (Polyak).
+
+Los scripts que usen este módulo con varios procesos deben correr dentro de `if __name__ == '__main__':`, ya que en
+Windows los procesos del pool importan de nuevo el script principal.
+"""
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+from optimization import matrices_modelo, optimizacion
+from solvers import resolver, ResultadoSolver
+
+# Datos de los subproblemas en cada proceso del pool. Se cargan una sola vez con _iniciar_proceso()
+_SUBPROBLEMAS = {}
+
+
+def _iniciar_proceso(subproblemas, solver, opciones):
+    """
+    Guarda los subproblemas en el proceso, para que cada tarea solo reciba los precios de capacidad.
+    """
+    _SUBPROBLEMAS['datos'] = subproblemas
+    _SUBPROBLEMAS['solver'] = solver
+    _SUBPROBLEMAS['opciones'] = opciones
+
+
+def _resolver_familia(k, precios):
+    """
+    Resuelve el subproblema de la familia k con costos c_k + A_cap_k' λ.
+    :param k: posición de la familia en la lista de subproblemas
+    :param precios: arreglo con los precios λ de las filas de capacidad
+    :return: k, ResultadoSolver
+    """
+    c, A_eq, b_eq, A_ub, b_ub, A_cap = _SUBPROBLEMAS['datos'][k]
+    return k, resolver(c + A_cap.T @ precios, A_eq, b_eq, A_ub, b_ub, backend=_SUBPROBLEMAS['solver'],
+                       **_SUBPROBLEMAS['opciones'])
+
+
+def maestro_restringido(costos, usos, b_cap, penalizacion, solver='highs', **opciones):
+    """
+    Maestro restringido sobre las soluciones de familia encontradas: min sum_k,t costo_kt w_kt + penalizacion' s, con
+    sum_t w_kt = 1 por familia, sum_k,t uso_kt w_kt - s <= b_cap y w, s >= 0. La holgura s, penalizada, mantiene el
+    maestro factible mientras las soluciones encontradas no alcanzan a cumplir las capacidades.
+    :param costos: lista por familia con el costo c_k x_k de cada solución
+    :param usos: lista por familia con el uso de capacidad A_cap_k x_k de cada solución
+    :param b_cap: np.array con el lado derecho de las filas de capacidad
+    :param penalizacion: np.array con el costo por unidad de exceso de cada fila de capacidad
+    :return: ResultadoSolver del maestro. x son los pesos w, ordenados por familia y solución, seguidos de s
+    """
+    tamanos = [len(costos_k) for costos_k in costos]
+    familia = np.repeat(np.arange(len(tamanos)), tamanos)
+    m_cap = b_cap.shape[0]
+    A_eq = sp.csr_matrix((np.ones(familia.shape[0]), (familia, np.arange(familia.shape[0]))),
+                         shape=(len(tamanos), familia.shape[0] + m_cap))
+    A_ub = sp.hstack([sp.csr_matrix(np.column_stack([uso for usos_k in usos for uso in usos_k])),
+                      -sp.identity(m_cap, format='csr')]).tocsr()
+    c = np.concatenate([[costo for costos_k in costos for costo in costos_k], penalizacion])
+    return resolver(c, A_eq, np.ones(len(tamanos)), A_ub, b_cap, backend=solver, **opciones)
+
+
+def subproblemas_familia(items_df, actividades_df, coef_mat):
+    """
+    Separa el modelo en un subproblema por familia y las filas de capacidad que las acoplan.
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :return: diccionario con las llaves
+        - 'familias': lista con el nombre de cada familia
+        - 'subproblemas': lista con (c, A_eq, b_eq, A_ub, b_ub, A_cap) de cada familia
+        - 'columnas': lista con las posiciones de las actividades de cada familia
+        - 'filas': lista con las posiciones de los items de cada familia
+        - 'capacidad': posiciones de las filas de capacidad, 'A_cap' y 'b_cap'
+        - 'c', 'mascara_eq': costos y máscara de filas de igualdad del modelo completo
+    """
+    c, _, b_eq, _, b_ub, mascara_eq = matrices_modelo(items_df, actividades_df, coef_mat)
+    coef_mat = sp.csr_matrix(coef_mat)
+    b = np.empty(items_df.shape[0])
+    b[mascara_eq], b[~mascara_eq] = b_eq, b_ub
+
+    capacidad = items_df['tipo'].isin(['capacidad_din', 'capacidad_est']).values
+    if (capacidad & mascara_eq).any():
+        raise ValueError('Las filas de capacidad deben ser desigualdades')
+    idx_capacidad = np.where(capacidad)[0]
+    A_cap = coef_mat[idx_capacidad]
+
+    producto_items = items_df['producto'].values
+    producto_actividades = actividades_df['producto'].values
+    familias = list(dict.fromkeys(producto_actividades))
+
+    subproblemas, columnas, filas = [], [], []
+    for familia in familias:
+        idy = np.where(producto_actividades == familia)[0]
+        idx = np.where((producto_items == familia) & ~capacidad)[0]
+        A = coef_mat[idx][:, idy]
+        eq = mascara_eq[idx]
+        subproblemas.append((c[idy], A[eq], b[idx][eq], A[~eq], b[idx][~eq], sp.csr_matrix(A_cap[:, idy])))
+        columnas.append(idy)
+        filas.append(idx)
+
+    # Las filas de familia no deben tocar actividades de otras familias
+    cubiertas = np.concatenate(filas + [idx_capacidad])
+    if cubiertas.shape[0] != items_df.shape[0]:
+        raise ValueError(f"Hay {items_df.shape[0] - cubiertas.shape[0]} items sin familia que no son de capacidad")
+
+    return {'familias': familias, 'subproblemas': subproblemas, 'columnas': columnas, 'filas': filas,
+            'capacidad': idx_capacidad, 'A_cap': A_cap, 'b_cap': b[idx_capacidad], 'c': c, 'mascara_eq': mascara_eq}
+
+
+def optimizacion_descomposicion(items_df, actividades_df, coef_mat, solver='highs', procesos=None,
+                                max_iteraciones=100, tolerancia=1e-4, theta=1.0, reparar=True, **opciones):
+    """
+    Resuelve el modelo por relajación Lagrangiana de las filas de capacidad, con un subproblema por familia.
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param solver: backend de solución de los subproblemas (ver solvers.BACKENDS)
+    :param procesos: cantidad de procesos del pool. Por defecto todos los núcleos; con 1 se resuelve en serie
+    :param max_iteraciones: máximo de iteraciones de subgradiente
+    :param tolerancia: brecha relativa (cota superior - cota inferior) / cota superior para terminar
+    :param theta: factor del paso de Polyak, entre 0 y 2. Se reduce a la mitad si la cota inferior no mejora en 20
+    iteraciones
+    :param reparar: resolver el modelo completo si algún subproblema falla, o si al llegar a `max_iteraciones` no hay
+    solución que cumpla las capacidades
+    :param opciones: opciones adicionales que se pasan al backend
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info). En info['historial'] quedan las cotas de
+    cada iteración. Los duales son los de la iteración con la mejor cota inferior (precios de capacidad y duales de cada
+    familia con esos precios), que son factibles para el dual del modelo completo, o los del modelo completo si se
+    reparó
+    """
+    inicio = time.time()
+    datos = subproblemas_familia(items_df, actividades_df, coef_mat)
+    subproblemas, columnas = datos['subproblemas'], datos['columnas']
+    c, A_cap, b_cap, mascara_eq = datos['c'], datos['A_cap'], datos['b_cap'], datos['mascara_eq']
+    n, m_cap = c.shape[0], b_cap.shape[0]
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    procesos = max(1, min(procesos, len(subproblemas)))
+    compilacion = time.time() - inicio
+
+    print(f"Descomposición por familia ha comenzado con {solver}: {len(subproblemas)} familias, {m_cap} filas de "
+          f"capacidad, {procesos} procesos")
+
+    precios = np.zeros(m_cap)
+    mejor_precios = precios.copy()
+    mejor_x, cota_superior, cota_inferior = None, np.inf, -np.inf
+    historial, sin_mejora, estado = [], 0, 'limite'
+    ultimos, mejores = [None] * len(subproblemas), [None] * len(subproblemas)
+    # Soluciones de cada familia para el maestro restringido: x_k, costo c_k x_k y uso de capacidad A_cap_k x_k
+    soluciones = [[] for _ in subproblemas]
+    costos = [[] for _ in subproblemas]
+    usos = [[] for _ in subproblemas]
+    escala = 1.0 + np.abs(b_cap)
+
+    pool = None
+    if procesos > 1:
+        pool = ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso,
+                                   initargs=(subproblemas, solver, opciones))
+    else:
+        _iniciar_proceso(subproblemas, solver, opciones)
+
+    def resolver_todas(precios_familias):
+        # Resuelve todas las familias con los mismos precios, en el pool o en serie
+        mapear = pool.map if pool is not None else map
+        return mapear(_resolver_familia, range(len(subproblemas)), [precios_familias] * len(subproblemas))
+
+    try:
+        for iteracion in range(1, max_iteraciones + 1):
+            inicio_iteracion = time.time()
+            x = np.zeros(n)
+            valor_dual = -precios @ b_cap
+            for k, resultado in resolver_todas(precios):
+                if resultado.estado != 'optimo':
+                    estado = resultado.estado
+                    print(f"Subproblema de la familia {datos['familias'][k]}: {resultado.estado}")
+                    break
+                x[columnas[k]] = resultado.x
+                valor_dual += resultado.objetivo
+                ultimos[k] = resultado
+                soluciones[k].append(resultado.x)
+                costos[k].append(float(subproblemas[k][0] @ resultado.x))
+                usos[k].append(subproblemas[k][5] @ resultado.x)
+            else:
+                estado = 'limite'
+            if estado not in ('limite', 'optimo'):
+                break
+
+            # Cota inferior
+            if valor_dual > cota_inferior + 1e-9 * abs(valor_dual):
+                cota_inferior, mejor_precios, sin_mejora = valor_dual, precios.copy(), 0
+                mejores = list(ultimos)
+            else:
+                sin_mejora += 1
+                if sin_mejora >= 20:
+                    theta, sin_mejora = theta / 2, 0
+
+            # Cota superior: maestro restringido sobre las soluciones encontradas
+            if iteracion == 1:
+                # Exceder toda una fila de capacidad cuesta 100 veces el costo de la primera solución
+                penalizacion = 100 * max(sum(max(costos_k) for costos_k in costos), 1.0) / np.maximum(b_cap, 1.0)
+            maestro = maestro_restringido(costos, usos, b_cap, penalizacion, solver=solver, **opciones)
+            exceso = maestro.x[-m_cap:] if maestro.estado == 'optimo' else None
+            if exceso is not None and np.all(exceso <= 1e-6 * escala) and maestro.objetivo < cota_superior:
+                tamanos = [len(costos_k) for costos_k in costos]
+                pesos = np.split(maestro.x[:-m_cap], np.cumsum(tamanos)[:-1])
+                candidato = np.zeros(n)
+                for k, pesos_k in enumerate(pesos):
+                    candidato[columnas[k]] = pesos_k @ np.array(soluciones[k])
+                cota_superior, mejor_x = float(c @ candidato), candidato
+
+            brecha = (cota_superior - cota_inferior) / abs(cota_superior) if np.isfinite(cota_superior) else np.inf
+            historial.append({'iteracion': iteracion, 'cota_inferior': cota_inferior, 'cota_superior': cota_superior,
+                              'brecha': brecha, 'theta': theta, 'tiempo': time.time() - inicio_iteracion})
+            print(f"Iteración {iteracion}: cota inferior {cota_inferior}, cota superior {cota_superior}, "
+                  f"brecha {brecha:.4%}, {time.time() - inicio_iteracion} segundos")
+            if brecha <= tolerancia:
+                estado = 'optimo'
+                break
+
+            subgradiente = A_cap @ x - b_cap
+            subgradiente[(precios <= 0) & (subgradiente < 0)] = 0
+            norma = subgradiente @ subgradiente
+            if norma <= 0:
+                # x cumple las capacidades con holgura complementaria: es óptima
+                if float(c @ x) < cota_superior:
+                    cota_superior, mejor_x = float(c @ x), x.copy()
+                estado = 'optimo'
+                break
+            if exceso is not None and np.all(exceso <= 1e-6 * escala):
+                # Precios de Dantzig-Wolfe: duales de capacidad del maestro (d objetivo / d b_cap <= 0). Solo sirven si
+                # el maestro cumple las capacidades sin holgura: si no, los duales son la penalización del exceso
+                precios = np.maximum(0, -maestro.duales['ub'])
+            else:
+                # Paso de subgradiente (Polyak), proyectado en λ >= 0
+                objetivo_estimado = cota_superior if np.isfinite(cota_superior) else \
+                    valor_dual + 0.001 * max(abs(valor_dual), 1.0)
+                paso = theta * (objetivo_estimado - valor_dual) / norma
+                precios = np.maximum(0, precios + paso * subgradiente)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Se repara si algún subproblema falló, o si se llegó al límite de iteraciones sin solución que cumpla las
+    # capacidades. Al límite con solución se retorna la mejor encontrada
+    reparado = False
+    if reparar and estado != 'optimo' and (estado != 'limite' or mejor_x is None):
+        print(f"La descomposición terminó con estado {estado} sin solución óptima, se resuelve el modelo completo")
+        completo = optimizacion(items_df, actividades_df, coef_mat, solver=solver, **opciones)
+        if completo.estado == 'optimo':
+            mejor_x, cota_superior, reparado, estado = completo.x, completo.objetivo, True, 'optimo'
+        else:
+            estado = completo.estado
+
+    # Duales en la convención de solvers: d objetivo / d lado derecho. Si se reparó son los del modelo completo; si no,
+    # los precios de la mejor cota inferior y los duales de cada familia con esos precios
+    if reparado:
+        duales = completo.duales
+    else:
+        duales = {'eq': np.full(int(mascara_eq.sum()), np.nan), 'ub': np.full(int((~mascara_eq).sum()), np.nan),
+                  'reducidos': np.full(n, np.nan)}
+        posicion_eq = np.cumsum(mascara_eq) - 1
+        posicion_ub = np.cumsum(~mascara_eq) - 1
+        duales['ub'][posicion_ub[datos['capacidad']]] = -mejor_precios
+        for k, resultado in enumerate(mejores):
+            if resultado is None:
+                continue
+            filas = datos['filas'][k]
+            eq = mascara_eq[filas]
+            duales['eq'][posicion_eq[filas[eq]]] = resultado.duales['eq']
+            duales['ub'][posicion_ub[filas[~eq]]] = resultado.duales['ub']
+            duales['reducidos'][columnas[k]] = resultado.duales['reducidos']
+
+    total = time.time() - inicio
+    tiempos = {'compilacion': compilacion, 'solucion': total - compilacion, 'total': total}
+    info = {'backend': solver, 'iteraciones': len(historial),
+            'mensaje': f'descomposición por familia, {len(subproblemas)} familias, {procesos} procesos',
+            'historial': historial, 'cota_inferior': cota_inferior, 'reparado': reparado}
+    x = mejor_x if mejor_x is not None else np.full(n, np.nan)
+
+    return ResultadoSolver(estado, x, cota_superior if mejor_x is not None else np.nan, duales, tiempos, info)
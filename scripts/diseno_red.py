@@ -0,0 +1,268 @@
+"""
+En este script se encuentra el diseño de red: decidir qué ubicaciones operar (abrir o cerrar) junto con la
+distribución. Las candidatas son las ubicaciones del master de ubicaciones con valor en 'abre/cierra', y cada una tiene
+una variable binaria de apertura, para todo el horizonte o por mes (`por_mes`). Una ubicación abierta paga su
+'Costo Fijo Mensual Operación'. Una ubicación cerrada no recibe, no almacena ni produce: el lado derecho de sus filas de
+'capacidad_din', 'capacidad_est' y 'produccion' se multiplica por la variable de apertura. Si una candidata no tiene
+capacidad dinámica en el master, se le agrega una fila de flujo entrante con una cota igual a la demanda total, para
+que cerrarla también corte su flujo.
+
+Se resuelve con descomposición de Benders:
+    - subproblema: el modelo lineal de la red (modelo.ModeloRed), con los lados derechos de las filas de las candidatas
+      según la apertura. Con el backend 'highspy' cada subproblema arranca desde la base del anterior. Se permite
+      demanda no atendida con una penalización por tonelada, así que todo subproblema es factible
+    - maestro: MIP pequeño con las binarias de apertura y el costo estimado de distribución θ, resuelto con HiGHS
+      (highspy). Cada subproblema agrega el corte θ >= z_k + g_k (y - y_k), donde g_k sale de los duales de las filas
+      de las candidatas (d costo / d lado derecho) por su capacidad
+En cada iteración la cota superior es el mejor costo fijo + distribución encontrado, y la cota inferior la cota dual
+del maestro, que se resuelve con una brecha 100 veces menor que `tolerancia`. Para la cota superior, las aperturas
+con costo fijo que quedan sin uso en la solución del subproblema se cierran sin resolver de nuevo, ya que la misma
+distribución sigue siendo factible. Con apertura por mes hay muchas más variables y los cortes de Benders cierran la
+brecha lentamente: si se llega a `max_iteraciones`, se retorna la mejor apertura encontrada con estado 'limite' y la
+brecha en info['historial'].
+
+Uso:
+    resultado = optimizacion_diseno(items, actividades, matriz, DATASETS['master_ubicaciones'], por_mes=True)
+    resultado.info['apertura']  # ubicación, mes, abierta y costo fijo
+"""
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from modelo import ModeloRed
+from solvers import ResultadoSolver
+
+COLUMNA_CANDIDATAS = 'abre/cierra'
+COLUMNA_COSTO_FIJO = 'Costo Fijo Mensual Operación'
+NODO_NO_ATENDIDA = 'NO_ATENDIDA'
+
+
+def modelo_diseno(items_df, actividades_df, coef_mat, master_ubicaciones, por_mes=False, candidatas=None,
+                  penalizacion=None):
+    """
+    Arma el modelo lineal del subproblema y las filas que controla cada variable de apertura.
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param master_ubicaciones: master de ubicaciones limpio
+    :param por_mes: si es True, una variable de apertura por ubicación y mes; si no, una por ubicación
+    :param candidatas: lista de ubicaciones que se pueden abrir o cerrar. Por defecto las que tienen 'abre/cierra'
+    :param penalizacion: costo por tonelada de demanda no atendida. Por defecto, 100 veces el mayor costo por tonelada
+    de las actividades de transporte
+    :return: diccionario con 'items', 'actividades', 'matriz' (modelo aumentado), 'aperturas' (pd.DataFrame con
+    'nodo', 'tiempo' y 'costo_fijo' por variable), 'filas' y 'grupo' (filas controladas y su variable de apertura) y
+    'no_atendida' (columnas de demanda no atendida)
+    """
+    faltantes = [columna for columna in [COLUMNA_CANDIDATAS, COLUMNA_COSTO_FIJO] if columna not in master_ubicaciones]
+    if faltantes:
+        raise ValueError(f"El diseño de red necesita las columnas {faltantes} en master_ubicaciones")
+    if candidatas is None:
+        candidatas = master_ubicaciones.loc[master_ubicaciones[COLUMNA_CANDIDATAS].notna(), 'id_locacion'].tolist()
+    costo_fijo = master_ubicaciones.set_index('id_locacion')[COLUMNA_COSTO_FIJO].fillna(0).astype(float)
+    n, m = actividades_df.shape[0], items_df.shape[0]
+    coef_mat = sp.csr_matrix(coef_mat)
+
+    items = items_df.loc[:, ['tiempo', 'producto', 'nodo', 'tipo', 'valor']].astype({'nodo': object, 'tipo': object,
+                                                                                    'producto': object})
+    actividades = actividades_df.loc[:, ['tiempo', 'producto', 'transporte', 'origen', 'destino', 'almacenamiento',
+                                         'costo']].astype({'origen': object, 'destino': object, 'producto': object})
+    meses = np.sort(items['tiempo'].unique())
+    demanda_total = float(items.loc[items['tipo'] == 'demanda', 'valor'].sum())
+
+    # Filas de flujo entrante para las candidatas sin capacidad dinámica: transporte de los arcos que llegan al nodo
+    con_dinamica = set(items.loc[items['tipo'] == 'capacidad_din', 'nodo'])
+    sin_dinamica = [nodo for nodo in candidatas if nodo not in con_dinamica]
+    nuevas = pd.DataFrame([(t, np.nan, nodo, 'capacidad_din', demanda_total) for nodo in sin_dinamica for t in meses],
+                          columns=items.columns)
+    movimiento = ~actividades['almacenamiento'].values.astype(bool)
+    llegadas = pd.DataFrame({'tiempo': actividades['tiempo'].values[movimiento],
+                             'nodo': actividades['destino'].values[movimiento],
+                             'transporte': actividades['transporte'].values[movimiento].astype(float),
+                             'idy': np.where(movimiento)[0]})
+    llegadas = llegadas.merge(nuevas.loc[:, ['tiempo', 'nodo']].assign(idx=np.arange(nuevas.shape[0])),
+                              on=['tiempo', 'nodo'], how='inner')
+    filas_nuevas = sp.csr_matrix((llegadas['transporte'].values, (llegadas['idx'].values, llegadas['idy'].values)),
+                                 shape=(nuevas.shape[0], n))
+
+    # Demanda no atendida: una columna por item de demanda, con -1 por tonelada en su fila
+    filas_demanda = np.where(items['tipo'].values == 'demanda')[0]
+    if penalizacion is None:
+        por_tonelada = actividades.loc[movimiento, 'costo'].values / actividades.loc[movimiento, 'transporte'].values
+        penalizacion = 100 * float(np.nanmax(por_tonelada[np.isfinite(por_tonelada)]))
+    no_atendida = pd.DataFrame({'tiempo': items['tiempo'].values[filas_demanda],
+                                'producto': items['producto'].values[filas_demanda], 'transporte': 1.0,
+                                'origen': NODO_NO_ATENDIDA, 'destino': items['nodo'].values[filas_demanda],
+                                'almacenamiento': False, 'costo': penalizacion})
+    columnas_no_atendida = sp.csr_matrix((-np.ones(filas_demanda.shape[0]),
+                                          (filas_demanda, np.arange(filas_demanda.shape[0]))),
+                                         shape=(m + nuevas.shape[0], filas_demanda.shape[0]))
+
+    items_aumentado = pd.concat([items, nuevas], ignore_index=True)
+    actividades_aumentado = pd.concat([actividades, no_atendida], ignore_index=True)
+    matriz = sp.hstack([sp.vstack([coef_mat, filas_nuevas]), columnas_no_atendida]).tocsr()
+
+    # Variables de apertura y filas que controla cada una
+    aperturas = pd.DataFrame([(nodo, t if por_mes else None) for nodo in candidatas
+                              for t in (meses if por_mes else [None])], columns=['nodo', 'tiempo'])
+    aperturas['costo_fijo'] = aperturas['nodo'].map(costo_fijo).fillna(0).values * (1 if por_mes else len(meses))
+    tipos = items_aumentado['tipo'].values
+    controladas = np.isin(tipos, ['capacidad_din', 'capacidad_est', 'produccion']) & \
+        items_aumentado['nodo'].isin(candidatas).values
+    filas = np.where(controladas)[0]
+    llaves = aperturas.assign(grupo=np.arange(aperturas.shape[0]))
+    filas_df = pd.DataFrame({'nodo': items_aumentado['nodo'].values[filas], 'fila': filas})
+    if por_mes:
+        filas_df['tiempo'] = items_aumentado['tiempo'].values[filas]
+        filas_df = filas_df.merge(llaves, on=['nodo', 'tiempo'], how='inner')
+    else:
+        filas_df = filas_df.merge(llaves.drop(columns=['tiempo']), on='nodo', how='inner')
+
+    return {'items': items_aumentado, 'actividades': actividades_aumentado, 'matriz': matriz, 'aperturas': aperturas,
+            'filas': filas_df['fila'].values, 'grupo': filas_df['grupo'].values,
+            'no_atendida': np.arange(n, n + filas_demanda.shape[0]), 'penalizacion': penalizacion}
+
+
+def _maestro(costo_fijo, brecha):
+    """
+    Maestro de Benders en highspy: binarias de apertura y θ (costo de distribución estimado), sin cortes. Los costos
+    vienen escalados (ver optimizacion_diseno), ya que HiGHS rechaza coeficientes mayores a 1e15. `brecha` es la
+    brecha relativa del MIP, que debe ser mucho menor que la tolerancia de Benders para que la cota inferior sirva.
+    """
+    import highspy
+
+    k = costo_fijo.shape[0]
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    h.setOptionValue('mip_rel_gap', float(brecha))
+    h.addVars(k + 1, np.zeros(k + 1), np.concatenate([np.ones(k), [highspy.kHighsInf]]))
+    h.changeColBounds(k, -highspy.kHighsInf, highspy.kHighsInf)
+    h.changeColsCost(k + 1, np.arange(k + 1, dtype=np.int32), np.concatenate([costo_fijo, [1.0]]))
+    h.changeColsIntegrality(k, np.arange(k, dtype=np.int32), np.array([highspy.HighsVarType.kInteger] * k))
+    return h
+
+
+def optimizacion_diseno(items_df, actividades_df, coef_mat, master_ubicaciones, por_mes=False, candidatas=None,
+                        solver='highspy', max_iteraciones=50, tolerancia=1e-4, penalizacion=None, **opciones):
+    """
+    Decide qué candidatas abrir y la distribución de costo mínimo, por descomposición de Benders.
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param master_ubicaciones: master de ubicaciones limpio, con 'abre/cierra' y 'Costo Fijo Mensual Operación'
+    :param por_mes: si es True, la apertura se decide por ubicación y mes; si no, para todo el horizonte
+    :param candidatas: lista de ubicaciones que se pueden abrir o cerrar. Por defecto las que tienen 'abre/cierra'
+    :param solver: backend de los subproblemas (ver solvers.BACKENDS). Con 'highspy' se reusa la base entre iteraciones
+    :param max_iteraciones: máximo de iteraciones de Benders
+    :param tolerancia: brecha relativa (cota superior - cota inferior) / cota superior para terminar
+    :param penalizacion: costo por tonelada de demanda no atendida (ver modelo_diseno)
+    :param opciones: opciones adicionales que se pasan al backend
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info). `x` y los duales son los de la red con la
+    mejor apertura, y el objetivo incluye los costos fijos. En info quedan 'apertura' (pd.DataFrame con 'nodo',
+    'tiempo', 'abierta' y 'costo_fijo'), 'historial', 'costo_fijo', 'costo_distribucion' y 'no_atendida' (toneladas)
+    """
+    import highspy
+
+    inicio = time.time()
+    n, m_eq = actividades_df.shape[0], int(items_df['tipo'].isin(['demanda', 'flujo']).sum())
+    m_ub = items_df.shape[0] - m_eq
+    diseno = modelo_diseno(items_df, actividades_df, coef_mat, master_ubicaciones, por_mes, candidatas, penalizacion)
+    aperturas, filas, grupo = diseno['aperturas'], diseno['filas'], diseno['grupo']
+    costo_fijo = aperturas['costo_fijo'].values
+    k = aperturas.shape[0]
+    subproblema = ModeloRed(diseno['items'], diseno['actividades'], diseno['matriz'], solver=solver, **opciones)
+    base = subproblema.items['valor'].values.astype(float).copy()
+    capacidad = base[filas]
+    matriz_filas = sp.csr_matrix(diseno['matriz'])[filas]
+    maestro, escala = None, 1.0
+    compilacion = time.time() - inicio
+
+    def evaluar(apertura):
+        # Subproblema con la apertura dada y su corte: costo y gradiente respecto a la apertura
+        valores = base.copy()
+        valores[filas] = capacidad * apertura[grupo]
+        subproblema.actualizar_vectores(valores=valores)
+        resultado = subproblema.resolver()
+        if resultado.estado != 'optimo':
+            return resultado, None
+        duales = np.empty(base.shape[0])
+        duales[subproblema.mascara_eq], duales[~subproblema.mascara_eq] = resultado.duales['eq'], resultado.duales['ub']
+        return resultado, np.bincount(grupo, weights=duales[filas] * capacidad, minlength=k)
+
+    def agregar_corte(resultado, gradiente, apertura):
+        # Corte de Benders θ >= z + g (y - apertura), escalado
+        estado_corte = maestro.addRow((resultado.objetivo - gradiente @ apertura) / escala, np.inf, k + 1,
+                                      np.arange(k + 1, dtype=np.int32), np.concatenate([-gradiente / escala, [1.0]]))
+        if estado_corte != highspy.HighsStatus.kOk:
+            raise ValueError(f"HiGHS no aceptó el corte de la iteración {iteracion}: {estado_corte}")
+
+    print(f"Diseño de red ha comenzado con {solver}: {k} variables de apertura, {filas.shape[0]} filas controladas")
+    y = np.ones(k)
+    mejor, cota_superior, cota_inferior = None, np.inf, -np.inf
+    historial, estado = [], 'limite'
+    for iteracion in range(1, max_iteraciones + 1):
+        inicio_iteracion = time.time()
+        resultado, gradiente = evaluar(y)
+        if gradiente is None:
+            estado = resultado.estado
+            print(f"Subproblema de la iteración {iteracion}: {resultado.estado}")
+            break
+
+        # Las aperturas con costo fijo cuyas filas no tienen actividad positiva se pueden cerrar sin cambiar la solución:
+        # la misma distribución sigue siendo factible y se ahorra su costo fijo
+        actividad = matriz_filas @ resultado.x
+        usadas = np.bincount(grupo, weights=(actividad > 1e-6 * (1 + capacidad)).astype(float), minlength=k) > 0
+        y_usadas = y * (usadas | (costo_fijo <= 0))
+        total = float(costo_fijo @ y_usadas) + resultado.objetivo
+        if total < cota_superior:
+            cota_superior, mejor = total, (y_usadas, resultado)
+
+        # El maestro se escala por el costo de la primera iteración (todas abiertas), para que los cortes con demanda no
+        # atendida no tengan coeficientes demasiado grandes
+        if maestro is None:
+            escala = max(abs(total), 1.0)
+            maestro = _maestro(costo_fijo / escala, tolerancia / 100)
+        agregar_corte(resultado, gradiente, y)
+
+        maestro.run()
+        estado_maestro = maestro.getModelStatus()
+        if estado_maestro != highspy.HighsModelStatus.kOptimal:
+            estado = 'error'
+            print(f"Maestro de la iteración {iteracion}: {maestro.modelStatusToString(estado_maestro)}")
+            break
+        # La cota inferior es la cota dual del MIP, no su mejor solución, que solo es exacta hasta mip_rel_gap
+        cota_inferior = max(cota_inferior, maestro.getInfo().mip_dual_bound * escala)
+        y = np.round(np.array(maestro.getSolution().col_value)[:k])
+
+        brecha = (cota_superior - cota_inferior) / abs(cota_superior)
+        historial.append({'iteracion': iteracion, 'cota_inferior': cota_inferior, 'cota_superior': cota_superior,
+                          'brecha': brecha, 'abiertas': int(mejor[0].sum()), 'tiempo': time.time() - inicio_iteracion})
+        print(f"Iteración {iteracion}: cota inferior {cota_inferior}, cota superior {cota_superior}, "
+              f"brecha {brecha:.4%}, {time.time() - inicio_iteracion} segundos")
+        if brecha <= tolerancia:
+            estado = 'optimo'
+            break
+
+    total = time.time() - inicio
+    tiempos = {'compilacion': compilacion, 'solucion': total - compilacion, 'total': total}
+    info = {'backend': solver, 'iteraciones': len(historial), 'mensaje': f'Benders, {k} variables de apertura',
+            'historial': historial, 'cota_inferior': cota_inferior, 'penalizacion': diseno['penalizacion']}
+    if mejor is None:
+        duales = {'eq': np.full(m_eq, np.nan), 'ub': np.full(m_ub, np.nan), 'reducidos': np.full(n, np.nan)}
+        return ResultadoSolver(estado, np.full(n, np.nan), np.nan, duales, tiempos, info)
+
+    # Solución con la mejor apertura, sin las filas y columnas agregadas (las filas nuevas van al final)
+    y, resultado = mejor
+    apertura = aperturas.copy()
+    apertura['abierta'] = y.astype(bool)
+    info.update({'apertura': apertura, 'costo_fijo': float(costo_fijo @ y),
+                 'costo_distribucion': float(resultado.objetivo - diseno['penalizacion'] *
+                                             resultado.x[diseno['no_atendida']].sum()),
+                 'no_atendida': float(resultado.x[diseno['no_atendida']].sum())})
+    duales = {'eq': resultado.duales['eq'], 'ub': resultado.duales['ub'][:m_ub],
+              'reducidos': resultado.duales['reducidos'][:n]}
+    print(f"Diseño de red: {int(y.sum())} de {k} aperturas, costo fijo {info['costo_fijo']} COP, costo de "
+          f"distribución {info['costo_distribucion']} COP, {info['no_atendida']} toneladas no atendidas")
+
+    return ResultadoSolver(estado, resultado.x[:n], cota_superior, duales, tiempos, info)
@@ -0,0 +1,224 @@
+"""
+En este script se encuentra la evaluación del baseline contra el modelo de optimización. Las decisiones del baseline
+(salida de baseline.py, con la misma estructura de decision_consolidado.csv) se llevan a las columnas del modelo, es
+decir, a las actividades de build_activities para los mismos masters. Con eso:
+    - el costo del baseline es c @ x_baseline, con las tarifas del modelo
+    - el cumplimiento de cada restricción es una sola multiplicación matriz-vector con la matriz de matriz_coef, de
+      donde salen la holgura y la violación de cada item
+    - el ahorro por mes, familia y nodo es la diferencia de costo por actividad entre el baseline y el óptimo
+
+No se resuelve ningún modelo adicional: la decisión óptima se lee de un archivo de decisión, o se resuelve una sola vez
+si no se entrega.
+
+Uso:
+    python scripts/evaluacion_baseline.py input/datamaster_base_opt.xlsx output/baseline_decision_consolidado.csv
+        output/base_opt_decision_consolidado.csv
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from creacion_items_actividades import build_items, build_activities, matriz_coef
+from optimization import optimizacion
+from output import guardar_outputs
+
+SUFIJO_ALMACENAMIENTO = '_ALMACENAMIENTO'
+LLAVES_ARCO = ['tiempo', 'producto', 'origen', 'destino', 'almacenamiento']
+SHEET_NAMES = ['master_producto', 'master_ubicaciones', 'master_demanda',
+               'master_tarifario', 'master_red_infraestructura']
+
+
+def _mes(tiempo, anio=None):
+    """
+    Lleva la columna de tiempo al mes entero de los masters. El baseline puede venir con fechas 'AAAA-MM'. El tiempo del
+    modelo es solo el mes, así que las fechas deben ser de un solo año (y del año `anio` de los masters, si se entrega);
+    si no, los meses de años distintos quedarían sumados en el mismo tiempo.
+    """
+    if tiempo.dtype != object:
+        return tiempo.values.astype(int)
+
+    fechas = tiempo.astype(str).str.extract(r'^\s*(?:(\d{4})-)?(\d{1,2})\s*$')
+    if fechas[1].isna().any():
+        raise ValueError(f"Fechas de la decisión sin formato 'AAAA-MM' ni mes: "
+                         f"{tiempo.loc[fechas[1].isna()].unique()[:5].tolist()}")
+    anios = sorted(fechas[0].dropna().astype(int).unique())
+    if len(anios) > 1:
+        raise ValueError(f"La decisión tiene fechas de los años {anios}, pero el tiempo del modelo es solo el mes. "
+                         f"Evalúe un año a la vez")
+    if anio is not None and anios and anios[0] != anio:
+        raise ValueError(f"La decisión es del año {anios[0]} y los masters del año {anio}")
+    return fechas[1].astype(int).values
+
+
+def mapear_decision(df_decision, actividades_df, anio=None):
+    """
+    Lleva una tabla de decisión (baseline u óptimo) a las columnas del modelo. Cada fila se cruza con la actividad del
+    mismo mes, familia, origen, destino y vehículo. Si el vehículo no existe en el modelo para ese arco, se usa el
+    vehículo de capacidad más cercana, conservando las toneladas (la decisión se multiplica por la razón de capacidades).
+
+    El almacenamiento en formato de decisión tiene origen y destino '<nodo>_ALMACENAMIENTO'. Las filas del baseline
+    que solo tienen el destino con sufijo son costos de almacenamiento por tonelada recibida, que no son actividades del
+    modelo, y quedan como no mapeadas.
+
+    :param df_decision: pd.DataFrame con columnas 'tiempo', 'producto', 'transporte', 'origen', 'destino', 'costo' y
+    'valor_decision'
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param anio: año de los masters. Si se entrega, las fechas 'AAAA-MM' de la decisión deben ser de ese año
+    :return: x (np.array con la decisión por actividad) y pd.DataFrame con las filas no mapeadas y su motivo
+    """
+    decision = df_decision.loc[df_decision['valor_decision'] != 0].copy()
+    decision['tiempo'] = _mes(decision['tiempo'], anio)
+    decision['fila'] = np.arange(decision.shape[0])
+    origen, destino = decision['origen'].astype(str), decision['destino'].astype(str)
+    alm_origen, alm_destino = origen.str.endswith(SUFIJO_ALMACENAMIENTO), destino.str.endswith(SUFIJO_ALMACENAMIENTO)
+    decision['almacenamiento'] = (alm_origen & alm_destino).values
+    decision['origen'] = origen.str.replace(SUFIJO_ALMACENAMIENTO + '$', '', regex=True).values
+    decision['destino'] = destino.str.replace(SUFIJO_ALMACENAMIENTO + '$', '', regex=True).values
+    decision['producto'] = decision['producto'].astype(str)
+    solo_destino = (alm_destino & ~alm_origen).values
+
+    actividades = actividades_df.loc[:, LLAVES_ARCO + ['transporte']].astype({'origen': str, 'destino': str,
+                                                                                'producto': str})
+    actividades['idy'] = np.arange(actividades.shape[0])
+
+    # Cruce por arco, y por cada fila la actividad de capacidad más cercana (la misma, si existe)
+    cruce = decision.loc[~solo_destino, LLAVES_ARCO + ['transporte', 'valor_decision', 'fila']].merge(
+        actividades, on=LLAVES_ARCO, how='inner', suffixes=('', '_modelo'))
+    cruce['distancia'] = (cruce['transporte'] - cruce['transporte_modelo']).abs().fillna(0)
+    cruce = cruce.sort_values(['fila', 'distancia'], kind='mergesort').drop_duplicates('fila')
+    razon = np.where(cruce['almacenamiento'].values, 1.0,
+                     cruce['transporte'].values / cruce['transporte_modelo'].values)
+
+    x = np.zeros(actividades_df.shape[0])
+    np.add.at(x, cruce['idy'].values, cruce['valor_decision'].values * razon)
+
+    faltantes = np.setdiff1d(decision['fila'].values, cruce['fila'].values)
+    no_mapeadas = df_decision.loc[df_decision['valor_decision'] != 0].iloc[faltantes].copy()
+    no_mapeadas['motivo'] = np.where(solo_destino[faltantes], 'almacenamiento_sin_actividad', 'sin_arco_en_modelo')
+    no_mapeadas['costo_total'] = no_mapeadas['costo'] * no_mapeadas['valor_decision']
+
+    return x, no_mapeadas
+
+
+def evaluar_restricciones(items_df, coef_mat, x):
+    """
+    Cumplimiento, holgura y violación de cada restricción para una decisión `x`, con una sola multiplicación
+    matriz-vector. La holgura es lado_derecho - cumplimiento (con la demanda en negativo, como en matrices_modelo). En
+    restricciones de igualdad (demanda, flujo) la violación es |holgura|, y en las de desigualdad es max(-holgura, 0).
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param x: np.array con la decisión por actividad
+    :return: pd.DataFrame de items con columnas 'cumplimiento_restriccion', 'lado_derecho', 'holgura' y 'violacion'
+    """
+    tipo = items_df['tipo'].values
+    lado_derecho = items_df['valor'].values.astype(float)
+    lado_derecho = np.where(tipo == 'demanda', -lado_derecho, lado_derecho)
+    igualdad = np.isin(np.asarray(tipo, dtype=object), ['demanda', 'flujo'])
+
+    restricciones = items_df.copy()
+    restricciones['cumplimiento_restriccion'] = coef_mat @ x
+    restricciones['lado_derecho'] = lado_derecho
+    restricciones['holgura'] = lado_derecho - restricciones['cumplimiento_restriccion'].values
+    restricciones['violacion'] = np.where(igualdad, np.abs(restricciones['holgura'].values),
+                                          np.maximum(-restricciones['holgura'].values, 0))
+
+    return restricciones
+
+
+def ahorro_por(actividades_df, x_baseline, x_optimo, llaves):
+    """
+    Costo del baseline, costo óptimo y ahorro agrupados por `llaves` (columnas de las actividades).
+    :return: pd.DataFrame con las llaves y columnas 'costo_baseline', 'costo_optimo', 'ahorro' y 'ahorro_pct'
+    """
+    costo = actividades_df['costo'].values.astype(float)
+    costos = actividades_df.loc[:, llaves].astype(object)
+    costos['costo_baseline'] = costo * x_baseline
+    costos['costo_optimo'] = costo * x_optimo
+    costos = costos.loc[(costos['costo_baseline'] != 0) | (costos['costo_optimo'] != 0)]
+
+    ahorro = costos.groupby(llaves)[['costo_baseline', 'costo_optimo']].sum().reset_index()
+    ahorro['ahorro'] = ahorro['costo_baseline'] - ahorro['costo_optimo']
+    ahorro['ahorro_pct'] = ahorro['ahorro'] / ahorro['costo_baseline'].where(ahorro['costo_baseline'] != 0)
+
+    return ahorro.sort_values('ahorro', ascending=False).reset_index(drop=True)
+
+
+def evaluar_baseline(DATASETS, decision_baseline, decision_optima=None, solver='highs', tolerancia=1e-6):
+    """
+    Evalúa el baseline en el modelo construido con los masters `DATASETS`.
+
+    :param DATASETS: diccionario con los masters limpios
+    :param decision_baseline: pd.DataFrame de decisión del baseline (baseline_decision_consolidado.csv)
+    :param decision_optima: pd.DataFrame de decisión óptima para los mismos masters. Si es None, se resuelve el modelo
+    una vez con `solver`
+    :param tolerancia: violación mínima para contar una restricción como incumplida
+    :return: diccionario con 'resumen' (pd.Series), 'restricciones', 'no_mapeadas', 'ahorro_mes', 'ahorro_familia'
+    y 'ahorro_nodo'
+    """
+    inicio = time.time()
+    items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
+                        DATASETS['master_demanda'], DATASETS['master_producto'])
+    actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
+                                   DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
+    matriz = matriz_coef(items, actividades)
+
+    # Año de los masters, para revisar que las decisiones con fechas 'AAAA-MM' sean del mismo año
+    anios = DATASETS['master_demanda']['año'].unique() if 'año' in DATASETS['master_demanda'] else []
+    anio = int(anios[0]) if len(anios) == 1 else None
+
+    x_baseline, no_mapeadas = mapear_decision(decision_baseline, actividades, anio)
+    if decision_optima is None:
+        x_optimo = optimizacion(items, actividades, matriz, solver=solver).x
+    else:
+        x_optimo, _ = mapear_decision(decision_optima, actividades, anio)
+
+    restricciones = evaluar_restricciones(items, matriz, x_baseline)
+    incumplidas = restricciones['violacion'].values > tolerancia
+    c = actividades['costo'].values.astype(float)
+
+    resumen = pd.Series({
+        'costo_baseline': c @ x_baseline,
+        'costo_baseline_no_mapeado': no_mapeadas['costo_total'].sum(),
+        'costo_optimo': c @ x_optimo,
+        'ahorro': c @ x_baseline - c @ x_optimo,
+        'filas_baseline': int((decision_baseline['valor_decision'] != 0).sum()),
+        'filas_no_mapeadas': no_mapeadas.shape[0],
+        'restricciones_incumplidas': int(incumplidas.sum()),
+        'violacion_total': restricciones['violacion'].sum(),
+        'tiempo': time.time() - inicio})
+    for tipo in ['demanda', 'flujo', 'produccion', 'capacidad_din', 'capacidad_est']:
+        resumen[f'incumplidas_{tipo}'] = int((incumplidas & (restricciones['tipo'].values == tipo)).sum())
+
+    return {'resumen': resumen, 'restricciones': restricciones, 'no_mapeadas': no_mapeadas,
+            'ahorro_mes': ahorro_por(actividades, x_baseline, x_optimo, ['tiempo']),
+            'ahorro_familia': ahorro_por(actividades, x_baseline, x_optimo, ['producto']),
+            'ahorro_nodo': ahorro_por(actividades, x_baseline, x_optimo, ['origen'])}
+
+
+if __name__ == '__main__':
+    from limpieza_masters import limpieza_data
+
+    parser = argparse.ArgumentParser(description='Evalúa el baseline contra el modelo de optimización')
+    parser.add_argument('masters', nargs='?', default='input/datamaster_base_opt.xlsx',
+                        help='datamaster (.xlsx) o carpeta con los masters limpios en .csv')
+    parser.add_argument('baseline', nargs='?', default='output/baseline_decision_consolidado.csv')
+    parser.add_argument('optimo', nargs='?', default='output/base_opt_decision_consolidado.csv',
+                        help='decisión óptima de los mismos masters. Si no existe, se resuelve el modelo una vez')
+    parser.add_argument('--solver', default='highs', help='backend de solución (ver solvers.BACKENDS)')
+    parser.add_argument('--salida', default='output/', help='carpeta de resultados')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.masters):
+        data = {nombre: pd.read_csv(os.path.join(args.masters, nombre + '.csv')) for nombre in SHEET_NAMES}
+    else:
+        data = limpieza_data(args.masters, SHEET_NAMES)
+    optimo = pd.read_csv(args.optimo, index_col=0) if os.path.isfile(args.optimo) else None
+
+    evaluacion = evaluar_baseline(data, pd.read_csv(args.baseline, index_col=0), optimo, solver=args.solver)
+    os.makedirs(args.salida, exist_ok=True)
+    nombres = ['restricciones', 'no_mapeadas', 'ahorro_mes', 'ahorro_familia', 'ahorro_nodo']
+    guardar_outputs([evaluacion[nombre] for nombre in nombres],
+                    [f'evaluacion_baseline_{nombre}.csv' for nombre in nombres], args.salida)
+    print(f"Evaluación del baseline:\n{evaluacion['resumen'].to_string()}")
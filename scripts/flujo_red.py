@@ -0,0 +1,255 @@
+"""
+En este script se encuentra el motor de flujo a costo mínimo. Sin las filas de capacidad de nodos, el modelo de
+matriz_coef es un problema de flujo en red por familia:
+    - cada item de demanda, flujo o producción es un nodo (tiempo, producto, nodo)
+    - cada actividad es un arco con +capacidad en su origen y -capacidad en su destino (el almacenamiento es un arco de
+      (t, nodo) a (t + 1, nodo) con coeficiente 1). El flujo del arco en toneladas es capacidad * x, y su costo por
+      tonelada es costo / capacidad
+    - la producción es una oferta de hasta `valor` toneladas, y la demanda un consumo de `valor` toneladas
+
+Se resuelve con caminos mínimos sucesivos desde una fuente ficticia conectada a los nodos de producción, con potenciales
+para mantener costos reducidos no negativos (Dijkstra de scipy.sparse.csgraph). En cada iteración se envía flujo por el
+árbol de caminos mínimos a todos los nodos con demanda pendiente a la vez, hasta donde lo permitan las capacidades
+residuales. Los potenciales finales son los duales de las filas.
+
+Las filas de capacidad ('capacidad_din', 'capacidad_est') se revisan con la solución del flujo. Si alguna se viola, o
+si la matriz no tiene estructura de red, se resuelve el modelo completo con el backend de respaldo.
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra, breadth_first_order
+from optimization import matrices_modelo, optimizacion
+from solvers import ResultadoSolver
+
+
+def red_desde_modelo(items_df, actividades_df, coef_mat, tolerancia=1e-9):
+    """
+    Construye la red a partir de los items, actividades y matriz de coeficientes.
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param tolerancia: tolerancia para comparar coeficientes
+    :return: (red, motivo). `red` es un diccionario con los nodos, arcos, ofertas y demandas, o None si el modelo no
+    tiene estructura de red; en ese caso `motivo` explica por qué
+    """
+    c, _, b_eq, _, b_ub, mascara_eq = matrices_modelo(items_df, actividades_df, coef_mat)
+    b = np.empty(items_df.shape[0])
+    b[mascara_eq], b[~mascara_eq] = b_eq, b_ub
+
+    tipo = items_df['tipo'].values
+    filas_red = np.where(np.isin(tipo, ['demanda', 'flujo', 'produccion']))[0]
+    filas_laterales = np.where(np.isin(tipo, ['capacidad_din', 'capacidad_est']))[0]
+    if filas_red.shape[0] + filas_laterales.shape[0] != items_df.shape[0]:
+        return None, 'hay items de un tipo desconocido'
+
+    coef_mat = sp.csr_matrix(coef_mat)
+    A = coef_mat[filas_red].tocsc()
+    A.sort_indices()
+    n = A.shape[1]
+
+    # Cada columna debe tener a lo más una entrada positiva (origen) y una negativa (destino) de igual magnitud
+    nnz = np.diff(A.indptr)
+    columna_de = np.repeat(np.arange(n), nnz)
+    positivos = np.bincount(columna_de[A.data > 0], minlength=n)
+    negativos = np.bincount(columna_de[A.data < 0], minlength=n)
+    if np.any(positivos > 1) or np.any(negativos > 1):
+        return None, 'hay actividades con más de un origen o destino'
+    origen = np.full(n, -1)
+    destino = np.full(n, -1)
+    escala_origen = np.zeros(n)
+    escala_destino = np.zeros(n)
+    origen[columna_de[A.data > 0]] = A.indices[A.data > 0]
+    escala_origen[columna_de[A.data > 0]] = A.data[A.data > 0]
+    destino[columna_de[A.data < 0]] = A.indices[A.data < 0]
+    escala_destino[columna_de[A.data < 0]] = -A.data[A.data < 0]
+    ambos = (origen >= 0) & (destino >= 0)
+    if np.any(np.abs(escala_origen[ambos] - escala_destino[ambos]) > tolerancia * escala_origen[ambos]):
+        return None, 'hay actividades con ganancia o pérdida de flujo'
+    escala = np.where(origen >= 0, escala_origen, escala_destino)
+    if np.any(c < 0):
+        return None, 'hay actividades con costo negativo'
+
+    # Ofertas y demandas. Las igualdades son balances con oferta 0 o demanda (lado derecho negativo), y las
+    # desigualdades de producción son ofertas acotadas
+    b_red, eq_red = b[filas_red], mascara_eq[filas_red]
+    if np.any(eq_red & (b_red > tolerancia)):
+        return None, 'hay balances con oferta fija'
+    if np.any(~eq_red & (b_red < -tolerancia)):
+        return None, 'hay producciones con lado derecho negativo'
+    demanda = np.where(eq_red, np.maximum(-b_red, 0), 0)
+    oferta = np.where(eq_red, 0, np.maximum(b_red, 0))
+
+    # Arcos de la red: actividades con origen y destino. Las actividades solo con destino son ofertas sin límite desde
+    # la fuente. Las actividades solo con origen (p. ej. almacenamiento del último mes) o sin entradas quedan en 0
+    arcos = np.where(ambos | ((origen < 0) & (destino >= 0)))[0]
+    fuente = filas_red.shape[0]
+    arco_origen = np.where(origen[arcos] >= 0, origen[arcos], fuente)
+    arco_destino = destino[arcos]
+    arco_costo = c[arcos] / escala[arcos]
+
+    # Arcos paralelos: se conserva el de menor costo por tonelada
+    orden = np.lexsort((arco_costo, arco_destino, arco_origen))
+    arcos, arco_origen, arco_destino, arco_costo = arcos[orden], arco_origen[orden], arco_destino[orden], \
+        arco_costo[orden]
+    primero = np.ones(arcos.shape[0], dtype=bool)
+    primero[1:] = (arco_origen[1:] != arco_origen[:-1]) | (arco_destino[1:] != arco_destino[:-1])
+
+    red = {'c': c, 'escala': escala, 'arcos': arcos[primero], 'origen': arco_origen[primero],
+           'destino': arco_destino[primero], 'costo': arco_costo[primero], 'demanda': demanda, 'oferta': oferta,
+           'filas_red': filas_red, 'filas_laterales': filas_laterales, 'mascara_eq': mascara_eq, 'b': b,
+           'matriz': coef_mat, 'fuente': fuente}
+    return red, None
+
+
+def _grafo_residual(red, flujo, usado, potencial, umbral):
+    """
+    Arma el grafo residual con costos reducidos. Tipos de arco: 0 arco de la red, 1 arco de la red en reversa,
+    2 fuente a producción, 3 producción a fuente (reversa). Capacidades residuales menores a `umbral` (restos de
+    redondeo) no generan arco.
+    :return: csr_matrix con costos reducidos, y arreglos con el tipo y la posición del arco de cada entrada del csr
+    """
+    fuente, total = red['fuente'], red['fuente'] + 1
+    produccion = np.where(red['oferta'] > 0)[0]
+    con_flujo = np.where(flujo > umbral)[0]
+    con_capacidad = produccion[usado[produccion] < red['oferta'][produccion] - umbral]
+    con_uso = produccion[usado[produccion] > umbral]
+
+    u = np.concatenate([red['origen'], red['destino'][con_flujo], np.full(con_capacidad.shape[0], fuente), con_uso])
+    v = np.concatenate([red['destino'], red['origen'][con_flujo], con_capacidad, np.full(con_uso.shape[0], fuente)])
+    costo = np.concatenate([red['costo'], -red['costo'][con_flujo], np.zeros(con_capacidad.shape[0]),
+                            np.zeros(con_uso.shape[0])])
+    tipo = np.concatenate([np.zeros(red['origen'].shape[0], dtype=int), np.ones(con_flujo.shape[0], dtype=int),
+                           np.full(con_capacidad.shape[0], 2), np.full(con_uso.shape[0], 3)])
+    posicion = np.concatenate([np.arange(red['origen'].shape[0]), con_flujo, con_capacidad, con_uso])
+    costo = np.maximum(costo + potencial[u] - potencial[v], 0)
+
+    # Entre dos nodos se deja solo el arco residual de menor costo reducido
+    orden = np.lexsort((costo, v, u))
+    u, v, costo, tipo, posicion = u[orden], v[orden], costo[orden], tipo[orden], posicion[orden]
+    primero = np.ones(u.shape[0], dtype=bool)
+    primero[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    u, v, costo, tipo, posicion = u[primero], v[primero], costo[primero], tipo[primero], posicion[primero]
+
+    indptr = np.zeros(total + 1, dtype=np.int64)
+    np.add.at(indptr, u + 1, 1)
+    grafo = sp.csr_matrix((costo, v, np.cumsum(indptr)), shape=(total, total))
+    return grafo, u, v, tipo, posicion
+
+
+def flujo_costo_minimo(red, tolerancia=1e-9, max_iteraciones=10000):
+    """
+    Caminos mínimos sucesivos con potenciales. En cada iteración se envía flujo a todos los nodos con demanda pendiente
+    por el árbol de caminos mínimos, escalado para no superar ninguna capacidad residual del árbol.
+    :param red: diccionario de red_desde_modelo()
+    :return: estado, flujo por arco (toneladas), potenciales de los nodos, iteraciones
+    """
+    fuente, total = red['fuente'], red['fuente'] + 1
+    flujo = np.zeros(red['arcos'].shape[0])
+    usado = np.zeros(fuente)
+    potencial = np.zeros(total)
+    pendiente = red['demanda'].copy()
+    umbral = tolerancia * (1 + red['demanda'].max(initial=0))
+
+    for iteracion in range(1, max_iteraciones + 1):
+        grafo, u, v, tipo, posicion = _grafo_residual(red, flujo, usado, potencial, umbral)
+        distancia, predecesor = dijkstra(grafo, indices=fuente, return_predecessors=True)
+        alcanzable = np.isfinite(distancia)
+        if np.any((pendiente > umbral) & ~alcanzable[:fuente]):
+            return 'infactible', flujo, potencial, iteracion
+        distancia[~alcanzable] = distancia[alcanzable].max()
+        potencial += distancia
+
+        if pendiente.sum() <= umbral:
+            return 'optimo', flujo, potencial, iteracion
+
+        # Árbol de caminos mínimos: arco residual de cada nodo desde su predecesor
+        nodos = np.where(alcanzable & (np.arange(total) != fuente))[0]
+        padres = predecesor[nodos]
+        llaves = u.astype(np.int64) * total + v
+        arco_arbol = np.searchsorted(llaves, padres.astype(np.int64) * total + nodos)
+
+        # Carga de cada arco del árbol: demanda pendiente de su subárbol
+        arbol = sp.csr_matrix((np.ones(nodos.shape[0]), (padres, nodos)), shape=(total, total))
+        orden_bfs = breadth_first_order(arbol, fuente, directed=True, return_predecessors=False)
+        carga = np.zeros(total)
+        carga[:fuente] = pendiente
+        padre_de = np.full(total, -1)
+        padre_de[nodos] = padres
+        for nodo in orden_bfs[::-1]:
+            if nodo != fuente:
+                carga[padre_de[nodo]] += carga[nodo]
+
+        # Capacidad residual de los arcos del árbol
+        tipo_arbol, posicion_arbol = tipo[arco_arbol], posicion[arco_arbol]
+        capacidad = np.full(nodos.shape[0], np.inf)
+        capacidad[tipo_arbol == 1] = flujo[posicion_arbol[tipo_arbol == 1]]
+        capacidad[tipo_arbol == 2] = red['oferta'][posicion_arbol[tipo_arbol == 2]] - \
+            usado[posicion_arbol[tipo_arbol == 2]]
+        capacidad[tipo_arbol == 3] = usado[posicion_arbol[tipo_arbol == 3]]
+        carga_arbol = carga[nodos]
+        con_carga = carga_arbol > 0
+        fraccion = min(1.0, np.min(capacidad[con_carga] / carga_arbol[con_carga], initial=np.inf))
+        if fraccion <= 0:
+            return 'error', flujo, potencial, iteracion
+
+        envio = carga_arbol * fraccion
+        np.add.at(flujo, posicion_arbol[tipo_arbol == 0], envio[tipo_arbol == 0])
+        np.add.at(flujo, posicion_arbol[tipo_arbol == 1], -envio[tipo_arbol == 1])
+        np.add.at(usado, posicion_arbol[tipo_arbol == 2], envio[tipo_arbol == 2])
+        np.add.at(usado, posicion_arbol[tipo_arbol == 3], -envio[tipo_arbol == 3])
+        pendiente = pendiente * (1 - fraccion)
+        if fraccion >= 1:
+            pendiente[:] = 0
+
+    return 'limite', flujo, potencial, max_iteraciones
+
+
+def optimizacion_flujo(items_df, actividades_df, coef_mat, solver='highs', tolerancia=1e-9, **opciones):
+    """
+    Resuelve el modelo con el motor de flujo a costo mínimo. Si el modelo no tiene estructura de red o la solución viola
+    alguna capacidad de nodo, se resuelve con optimization.optimizacion() y el backend `solver`.
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param solver: backend de respaldo (ver solvers.BACKENDS)
+    :param tolerancia: tolerancia numérica
+    :param opciones: opciones adicionales que se pasan al backend de respaldo
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info). info['respaldo'] indica si se usó el
+    backend de respaldo y por qué
+    """
+    print("Proceso de optimización ha comenzado con el motor de flujo")
+    inicio = time.time()
+    red, motivo = red_desde_modelo(items_df, actividades_df, coef_mat, tolerancia)
+    compilacion = time.time() - inicio
+
+    if red is not None:
+        estado, flujo, potencial, iteraciones = flujo_costo_minimo(red, tolerancia)
+        x = np.zeros(red['c'].shape[0])
+        x[red['arcos']] = np.maximum(flujo, 0) / red['escala'][red['arcos']]
+
+        # Revisar capacidades de nodos
+        laterales = red['filas_laterales']
+        holgura = red['matriz'][laterales] @ x - red['b'][laterales]
+        if estado == 'optimo' and np.any(holgura > tolerancia * (1 + np.abs(red['b'][laterales]))):
+            motivo = f"{int((holgura > 0).sum())} capacidades de nodos violadas"
+        elif estado == 'optimo':
+            # Duales: d objetivo / d lado derecho = -potencial del nodo. Las capacidades de nodos no están activas
+            y = np.zeros(items_df.shape[0])
+            y[red['filas_red']] = -potencial[:red['fuente']]
+            mascara_eq = red['mascara_eq']
+            duales = {'eq': y[mascara_eq], 'ub': y[~mascara_eq], 'reducidos': red['c'] - red['matriz'].T @ y}
+            total = time.time() - inicio
+            tiempos = {'compilacion': compilacion, 'solucion': total - compilacion, 'total': total}
+            info = {'backend': 'flujo', 'iteraciones': iteraciones, 'mensaje': 'caminos mínimos sucesivos',
+                    'respaldo': None}
+            print(f"Estado de la solución: {estado}. Tiempo de compilación {compilacion}, tiempo de solución "
+                  f"{tiempos['solucion']}, {iteraciones} iteraciones")
+            return ResultadoSolver(estado, x, float(red['c'] @ x), duales, tiempos, info)
+        else:
+            motivo = f"el flujo terminó con estado {estado}"
+
+    print(f"Motor de flujo no aplica ({motivo}), se resuelve con {solver}")
+    resultado = optimizacion(items_df, actividades_df, coef_mat, solver=solver, **opciones)
+    resultado.info['respaldo'] = motivo
+    return resultado
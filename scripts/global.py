@@ -1,13 +1,15 @@
-from output import *
-import time
+"""
+Código para ejecutar la herramienta sobre los masters limpios en .csv de la carpeta input/. Equivale a
+`python scripts/herramienta.py optimize input/` (ver herramienta.py para todas las opciones).
+"""
+import sys
+from herramienta import main
 
-start_time = time.time()
-data = carga_datos()
-output_list = [i for i in ejecucion(data)]
-output_names = ['decision_consolidado.csv', 'restriccion_consolidado.csv', 'costo_mensual.csv']
-output_path = 'output/'
+# Backend de solución (ver solvers.BACKENDS). Se puede indicar como argumento: python scripts/global.py highs
+solver = sys.argv[1] if len(sys.argv) > 1 else 'glpk'
+# Modo de solución (ver output.ejecucion): monolitico, horizonte_rodante, descomposicion, flujo, entero o diseno
+modo = sys.argv[2] if len(sys.argv) > 2 else 'monolitico'
 
-
-guardar_outputs([output_list[0]], [output_names[0]], output_path)
-print(f"Tiempo total de ejecucion: {time.time() - start_time} segundos\n",
-      f"Costo total operacion {output_list[2]} COP")
+# Con el modo 'descomposicion' se usa un pool de procesos, que en Windows importa de nuevo este script
+if __name__ == '__main__':
+    main(['optimize', 'input/', '--nombre', 'global', '--solver', solver, '--modo', modo])
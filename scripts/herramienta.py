@@ -0,0 +1,195 @@
+"""
+Punto de entrada único de la herramienta de distribución. Reemplaza la lógica repetida de global.py, escenario.py,
+baseline_opt.py y baseline.py (carga, optimización y guardado con rutas fijas) por subcomandos con las rutas de entrada
+y salida y las opciones del solver como argumentos:
+    - clean: limpia los datamaster y deja los masters limpios en la caché (ver limpieza_masters.limpieza_data)
+    - baseline: genera las variables de decisión del baseline (ver baseline.generar_baseline)
+    - optimize: corre el modelo sobre un datamaster (.xlsx) o una carpeta de masters limpios en .csv
+    - scenario: igual que optimize, con el datamaster de escenario y el prefijo 'escenario_' por defecto
+
+Los módulos pesados (pandas, scipy, los backends de solución y el lector de Excel) se importan dentro de cada
+subcomando, de modo que `--help` y los errores de argumentos responden sin cargarlos, y la limpieza no importa el
+modelo de optimización.
+
+Uso:
+    python scripts/herramienta.py clean input/datamaster_escenario.xlsx
+    python scripts/herramienta.py baseline --salida output/
+    python scripts/herramienta.py optimize input/datamaster_base_opt.xlsx --prefijo base_opt_ --solver highs
+    python scripts/herramienta.py optimize input/ --modo horizonte_rodante --opcion-modo ventana=3
+    python scripts/herramienta.py scenario --solver highspy --opcion-solver time_limit=600 --formato parquet
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+SHEET_NAMES = ['master_producto', 'master_ubicaciones', 'master_demanda',
+               'master_tarifario', 'master_red_infraestructura']
+DATAMASTERS = ['input/datamaster_baseline.xlsx', 'input/datamaster_base_opt.xlsx', 'input/datamaster_escenario.xlsx']
+
+
+def _opciones(pares):
+    """
+    Lleva una lista de 'clave=valor' a un diccionario. El valor se lee como JSON (números, true/false, listas,
+    cadenas entre comillas) y, si no es JSON válido, queda como texto.
+    """
+    opciones = {}
+    for par in pares or []:
+        clave, separador, valor = par.partition('=')
+        if not separador or not clave:
+            raise argparse.ArgumentTypeError(f"Opción {par} no tiene la forma clave=valor")
+        try:
+            opciones[clave] = json.loads(valor)
+        except ValueError:
+            opciones[clave] = valor
+    return opciones
+
+
+def cargar_masters(ruta, usar_cache=True, procesos=1):
+    """
+    Carga los masters limpios desde un datamaster (.xlsx o .xls, que se limpia) o desde una carpeta con un .csv por
+    master.
+    :return: diccionario con los DFs de cada master
+    """
+    if os.path.isdir(ruta):
+        from output import carga_datos
+        return carga_datos(ruta)
+
+    from limpieza_masters import limpieza_data
+    return limpieza_data(ruta, SHEET_NAMES, usar_cache=usar_cache, procesos=procesos)
+
+
+def comando_clean(args):
+    """
+    Limpia cada datamaster y guarda la demanda omitida junto al archivo. Los archivos que no existen se reportan y no
+    detienen la limpieza de los demás.
+    """
+    from limpieza_masters import limpieza_data
+
+    for ruta in args.datamasters:
+        inicio = time.time()
+        try:
+            if os.path.basename(ruta).startswith('datamaster_baseline'):
+                limpieza_data(ruta, [], is_baseline=True, usar_cache=not args.sin_cache, procesos=args.procesos)
+            else:
+                data = limpieza_data(ruta, SHEET_NAMES, usar_cache=not args.sin_cache, procesos=args.procesos)
+                if not args.sin_omitida and 'demanda_omitida' in data:
+                    data['demanda_omitida'].to_excel(os.path.splitext(ruta)[0] + '_demanda_omitida.xlsx')
+        except FileNotFoundError:
+            print(f'El archivo {ruta} no fue encontrado\n')
+            continue
+        print(f'{ruta} limpio en {time.time() - inicio} segundos\n')
+
+    return 0
+
+
+def comando_baseline(args):
+    """
+    Genera las variables de decisión del baseline.
+    """
+    from baseline import generar_baseline
+
+    generar_baseline(args.datamaster, output_path=args.salida, omitidos_path=args.omitidos,
+                     factor_eficiencia=args.factor_eficiencia, usar_cache=not args.sin_cache)
+    return 0
+
+
+def comando_optimize(args):
+    """
+    Carga los masters, corre el modelo con el solver y modo indicados, y guarda decisión, restricciones y costo mensual
+    con el prefijo `args.prefijo` en la carpeta de salida.
+    """
+    from output import ejecucion, df_costo_mensual, guardar_outputs
+    from perfilado import RegistroEjecucion
+
+    start_time = time.time()
+    registro = RegistroEjecucion(args.nombre or args.comando, solver=args.solver, modo=args.modo,
+                                 masters=args.masters)
+    with registro.etapa('carga'):
+        data = cargar_masters(args.masters, usar_cache=not args.sin_cache, procesos=args.procesos)
+
+    decision, restriccion, costo = ejecucion(data, solver=args.solver, opciones_solver=args.opcion_solver,
+                                             modo=args.modo, opciones_modo=args.opcion_modo, registro=registro)[:3]
+    output_names = [args.prefijo + nombre for nombre in
+                    ['decision_consolidado.csv', 'restriccion_consolidado.csv', 'costo_mensual.csv']]
+
+    os.makedirs(args.salida, exist_ok=True)
+    with registro.etapa('guardar_outputs'):
+        guardar_outputs([decision, restriccion, df_costo_mensual(decision)], output_names,
+                        os.path.join(args.salida, ''), formato=args.formato, solo_no_cero=args.solo_no_cero)
+    if not args.sin_registro:
+        registro.guardar()
+    print(f"Tiempo total de ejecucion: {time.time() - start_time} segundos\n",
+          f"Costo total operacion {costo} COP")
+    return 0
+
+
+def _argumentos_optimizacion(parser, masters, prefijo):
+    """
+    Argumentos comunes de los subcomandos que corren el modelo.
+    """
+    parser.add_argument('masters', nargs='?', default=masters,
+                        help='datamaster (.xlsx) o carpeta con los masters limpios en .csv')
+    parser.add_argument('--salida', default='output/', help='carpeta de resultados')
+    parser.add_argument('--prefijo', default=prefijo, help='prefijo de los archivos de resultados')
+    parser.add_argument('--solver', default='glpk', help='backend de solución (ver solvers.BACKENDS)')
+    parser.add_argument('--modo', default='monolitico', help='modo de solución (ver output.ejecucion)')
+    parser.add_argument('--opcion-solver', action='append', metavar='CLAVE=VALOR',
+                        help='opción del backend, se puede repetir. El valor se lee como JSON')
+    parser.add_argument('--opcion-modo', action='append', metavar='CLAVE=VALOR',
+                        help='opción del modo de solución, se puede repetir. El valor se lee como JSON')
+    parser.add_argument('--formato', choices=['csv', 'csv.gz', 'parquet'], default=None,
+                        help='formato de los resultados (por defecto, csv)')
+    parser.add_argument('--solo-no-cero', action='store_true', help='guardar solo las decisiones diferentes de cero')
+    parser.add_argument('--procesos', type=int, default=1, help='hojas del Excel a leer a la vez')
+    parser.add_argument('--sin-cache', action='store_true', help='no usar la caché de masters limpios')
+    parser.add_argument('--sin-registro', action='store_true', help='no guardar el registro de la ejecución')
+    parser.add_argument('--nombre', default=None, help='nombre de la ejecución en el registro')
+    parser.set_defaults(funcion=comando_optimize)
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog='herramienta', description='Herramienta de distribución')
+    subparsers = parser.add_subparsers(dest='comando', metavar='comando')
+    subparsers.required = True
+
+    clean = subparsers.add_parser('clean', help='limpia los datamaster y guarda los masters limpios en la caché')
+    clean.add_argument('datamasters', nargs='*', default=DATAMASTERS, help='archivos datamaster (.xlsx o .xls)')
+    clean.add_argument('--procesos', type=int, default=1, help='hojas del Excel a leer a la vez')
+    clean.add_argument('--sin-cache', action='store_true', help='limpiar de nuevo aunque exista la caché')
+    clean.add_argument('--sin-omitida', action='store_true', help='no guardar el Excel de demanda omitida')
+    clean.set_defaults(funcion=comando_clean)
+
+    baseline = subparsers.add_parser('baseline', help='genera las variables de decisión del baseline')
+    baseline.add_argument('datamaster', nargs='?', default='input/datamaster_baseline.xlsx')
+    baseline.add_argument('--salida', default='output/', help='carpeta de la decisión del baseline')
+    baseline.add_argument('--omitidos', default='input/', help='carpeta de la demanda omitida')
+    baseline.add_argument('--factor-eficiencia', type=float, default=0.78,
+                          help='factor de eficiencia de los vehículos de exportación')
+    baseline.add_argument('--sin-cache', action='store_true', help='no usar la caché de masters limpios')
+    baseline.set_defaults(funcion=comando_baseline)
+
+    _argumentos_optimizacion(subparsers.add_parser('optimize', help='corre el modelo de optimización'),
+                             'input/', '')
+    _argumentos_optimizacion(subparsers.add_parser('scenario', help='corre el modelo sobre el datamaster de escenario'),
+                             'input/datamaster_escenario.xlsx', 'escenario_')
+
+    return parser
+
+
+def main(argv=None):
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    if args.comando in ['optimize', 'scenario']:
+        try:
+            args.opcion_solver = _opciones(args.opcion_solver)
+            args.opcion_modo = _opciones(args.opcion_modo)
+        except argparse.ArgumentTypeError as error:
+            parser.error(str(error))
+    return args.funcion(args)
+
+
+# Con el modo 'descomposicion' se usa un pool de procesos, que en Windows importa de nuevo este script
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,67 @@
 import pandas as pd
-from output import guardar_outputs
+import hashlib
+import json
+import os
+import re
+import shutil
+import html
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+from functools import lru_cache
+import numpy as np
+
+# Carpeta (relativa a la carpeta del archivo .xlsx) donde se guardan los masters limpios en formato Feather
+CARPETA_CACHE = '.cache_masters'
+
+# Columnas que usa la herramienta de cada master, con su tipo. Solo se leen estas columnas del Excel (y las de
+# COLUMNAS_OPCIONALES), y si falta alguna la lectura falla. Las hojas que no están aquí, y todas las del baseline, se leen
+# completas y con los tipos que infiere pandas
+ESQUEMAS = {
+    'master_producto': {'familia': str, 'ubicacion_producto': str, 'produccion_max': int},
+    'master_ubicaciones': {'id_locacion': str, 'capacidad_din': float, 'capacidad_est': float,
+                           'costo_almacenamiento': float},
+    'master_demanda': {'fecha': int, 'familia': str, 'id_ciudad': str, 'cantidad': float},
+    'master_tarifario': {'id_ciudad_origen': str, 'id_ciudad_destino': str, 'capacidad': float, 'costo': float},
+    'master_red_infraestructura': {'id_locacion_origen': str, 'id_locacion_destino': str},
+}
+
+# Columnas que se leen y se convierten a su tipo si están en la hoja, pero que pueden faltar. Las de apertura y costo
+# fijo solo las usa el diseño de red, que las exige (ver diseno_red.modelo_diseno)
+COLUMNAS_OPCIONALES = {
+    'master_ubicaciones': {'locacion': str, 'id_ciudad': str, 'Costo Fijo Mensual Operación': float,
+                           'abre/cierra': float},
+    'master_demanda': {'año': int},
+    'master_red_infraestructura': {'id_red_infraestructura': int},
+}
+
+
+@lru_cache(maxsize=1 << 16)
+def _normalizar_texto(texto):
+    """
+    Pone mayúsculas, remueve tildes y espacios al inicio y al final de un string. Se guarda en memoria para todo el
+    proceso, ya que los masters y el RFI repiten los mismos nombres de ciudades, nodos y familias.
+    """
+    return unicodedata.normalize('NFKD', texto.upper()).encode('ascii', errors='ignore').decode('utf-8').strip()
 
 
 def remover_tildes_espacios(series):
     """
-    Pone mayúsculas, remueve tildes y espacios al inicio y al final de los strings en una pd.Series
+    Pone mayúsculas, remueve tildes y espacios al inicio y al final de los strings en una pd.Series. Solo se normalizan
+    los valores únicos de la serie (con pd.factorize), y el resultado se lleva de vuelta a cada fila. Los valores que
+    no son strings quedan como NaN, igual que con el accesor .str
     :param series: pd.Series
     :return:
     """
-    series = series.str.upper()
-    series = series.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-    series = series.str.strip()
-    return series
+    # Igual que antes, lanza AttributeError si la columna no es de texto
+    series.str
+    codigos, unicos = pd.factorize(series)
+    normalizados = [_normalizar_texto(x) if isinstance(x, str) else np.nan for x in unicos]
+
+    # El código -1 (NaN) toma el último elemento, que es NaN
+    normalizados = np.array(normalizados + [np.nan], dtype=object)
+    return pd.Series(normalizados[codigos], index=series.index, name=series.name)
 
 
 def ajustar_producto(df_producto, file_path):
@@ -86,19 +136,318 @@ def ajustar_demanda(df_demanda, df_producto, df_tarifario):
     return df_demanda_filtered, df_demanda_omitida
 
 
-def limpieza_data(data_path, sheet_names, is_baseline=False):
+def _hash_archivo(file_path, tamano_bloque=1 << 20):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo, leyéndolo por bloques
+    :param file_path: dirección del archivo
+    :return: str con el hash en hexadecimal
+    """
+    hash_archivo = hashlib.sha256()
+    with open(file_path, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+            hash_archivo.update(bloque)
+    return hash_archivo.hexdigest()
+
+
+def _ruta_cache(data_path, sheet_names, is_baseline):
+    """
+    Retorna la carpeta de caché de un archivo de masters. La llave combina el contenido del archivo, el código de
+    limpieza (este script) y los parámetros de limpieza, así que la caché se invalida sola si cualquiera cambia.
+    :return: (carpeta del archivo en la caché, carpeta de la llave)
+    """
+    llave = hashlib.sha256()
+    llave.update(_hash_archivo(data_path).encode())
+    llave.update(_hash_archivo(os.path.abspath(__file__)).encode())
+    llave.update(json.dumps([list(sheet_names), bool(is_baseline)]).encode())
+
+    carpeta_archivo = os.path.join(os.path.dirname(data_path), CARPETA_CACHE, os.path.basename(data_path))
+    return carpeta_archivo, os.path.join(carpeta_archivo, llave.hexdigest()[:24])
+
+
+def _leer_cache(carpeta_llave):
+    """
+    Lee los masters limpios desde la caché. Retorna None si no existe la entrada o no se puede leer
+    :param carpeta_llave: carpeta de la llave en la caché
+    :return: diccionario de DFs o None
+    """
+    indice = os.path.join(carpeta_llave, 'indice.json')
+    if not os.path.isfile(indice):
+        return None
+    try:
+        with open(indice) as archivo:
+            nombres = json.load(archivo)
+        return {nombre: pd.read_feather(os.path.join(carpeta_llave, f'{i}.feather')) for i, nombre in enumerate(nombres)}
+    except Exception as error:
+        print(f'No se pudo leer la caché {carpeta_llave}: {error}\n')
+        return None
+
+
+def _guardar_cache(carpeta_archivo, carpeta_llave, datasets):
+    """
+    Guarda los masters limpios en la caché en formato Feather, y borra las entradas anteriores del mismo archivo. Si
+    algún DF no se puede guardar (por ejemplo, columnas con tipos mezclados), no se guarda la caché
+    :param carpeta_archivo: carpeta del archivo en la caché
+    :param carpeta_llave: carpeta de la llave en la caché
+    :param datasets: diccionario de DFs limpios
+    """
+    try:
+        if os.path.isdir(carpeta_archivo):
+            shutil.rmtree(carpeta_archivo)
+        os.makedirs(carpeta_llave)
+        for i, df in enumerate(datasets.values()):
+            df.reset_index(drop=True).to_feather(os.path.join(carpeta_llave, f'{i}.feather'))
+        with open(os.path.join(carpeta_llave, 'indice.json'), 'w') as archivo:
+            json.dump(list(datasets.keys()), archivo)
+    except Exception as error:
+        print(f'No se pudo guardar la caché {carpeta_llave}: {error}\n')
+        shutil.rmtree(carpeta_llave, ignore_errors=True)
+
+
+def _aplicar_esquema(df, esquema, hoja, opcionales=None):
+    """
+    Convierte las columnas de `df` a los tipos de `esquema` y de `opcionales`. Si falta alguna columna de `esquema` se
+    lanza ValueError; las de `opcionales` solo se convierten si están. Las columnas enteras con vacíos quedan como
+    float, igual que con pd.read_excel.
+    """
+    faltantes = [columna for columna in esquema if columna not in df.columns]
+    if faltantes:
+        raise ValueError(f"A la hoja {hoja} le faltan las columnas {faltantes}")
+
+    tipos = dict(esquema)
+    tipos.update({columna: tipo for columna, tipo in (opcionales or {}).items() if columna in df.columns})
+    for columna, tipo in tipos.items():
+        if tipo is str:
+            df[columna] = df[columna].where(df[columna].isna(), df[columna].astype(str))
+            continue
+        try:
+            df[columna] = pd.to_numeric(df[columna])
+        except (ValueError, TypeError) as error:
+            raise ValueError(f"La columna '{columna}' de la hoja {hoja} debe ser numérica: {error}")
+        if tipo is int:
+            # astype('int64') trunca los decimales sin avisar
+            fraccionarios = df[columna].notna() & (df[columna] % 1 != 0)
+            if fraccionarios.any():
+                raise ValueError(f"La columna '{columna}' de la hoja {hoja} debe ser entera. Valores con decimales "
+                                 f"en las filas {list(df.index[fraccionarios][:5] + 2)}: "
+                                 f"{df.loc[fraccionarios, columna].head().tolist()}")
+        if tipo is int and not df[columna].isna().any():
+            df[columna] = df[columna].astype('int64')
+        else:
+            df[columna] = df[columna].astype(float)
+    return df
+
+
+# Celdas con contenido de una hoja .xlsx: atributos, en cualquier orden, y contenido. Las celdas vacías (<c .../>), que
+# en los datamaster son decenas de miles de filas con formato, no se recorren. El (?=(...))\1 toma los atributos sin
+# retroceder carácter por carácter cuando la celda resulta vacía
+_CELDA = re.compile(r'<c(?=[\s>])(?=([^>/]*))\1>(.*?)</c>', re.S)
+# Filas y todas sus celdas (también las vacías), para las hojas con celdas sin referencia r. Sin ella, la fila o celda
+# es la siguiente a la anterior
+_FILA = re.compile(r'<row(?=[\s>/])([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELDA_FILA = re.compile(r'<c(?=[\s>/])([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_REFERENCIA_FILA = re.compile(r'(?:^|\s)r="(\d+)"')
+_REFERENCIA_CELDA = re.compile(r'(?:^|\s)r="([A-Z]+)(\d+)"')
+_VALOR = re.compile(r'<v>(.*?)</v>', re.S)
+_TEXTO = re.compile(r'<t[^>]*>(.*?)</t>', re.S)
+_TIPO = re.compile(r'(?:^|\s)t="(\w+)"')
+_NS = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+       'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+       'p': 'http://schemas.openxmlformats.org/package/2006/relationships'}
+
+
+def _indice_columna(letras):
+    """
+    Convierte la letra de columna de Excel ('A', 'AB') en su posición desde 0.
+    """
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - 64
+    return indice - 1
+
+
+def _rutas_hojas(archivo_zip):
     """
-    Llama las funciones especializadas de arriba para limpiar los masters.
+    Ruta dentro del .xlsx del XML de cada hoja, a partir de workbook.xml y sus relaciones.
+    """
+    libro = ElementTree.fromstring(archivo_zip.read('xl/workbook.xml'))
+    relaciones = ElementTree.fromstring(archivo_zip.read('xl/_rels/workbook.xml.rels'))
+    destinos = {rel.get('Id'): rel.get('Target') for rel in relaciones.findall('p:Relationship', _NS)}
+    rutas = {}
+    for hoja in libro.find('m:sheets', _NS):
+        destino = destinos[hoja.get(f"{{{_NS['r']}}}id")]
+        rutas[hoja.get('name')] = destino.lstrip('/') if destino.startswith('/') else 'xl/' + destino
+    return rutas
+
+
+def _textos_compartidos(archivo_zip):
+    """
+    Tabla de textos compartidos (sharedStrings.xml) del .xlsx.
+    """
+    if 'xl/sharedStrings.xml' not in archivo_zip.namelist():
+        return []
+    raiz = ElementTree.fromstring(archivo_zip.read('xl/sharedStrings.xml'))
+    # Cada texto es un <t> o varios <r><t> (texto con formato)
+    return [''.join(t.text or '' for t in si.findall('m:t', _NS) + si.findall('m:r/m:t', _NS))
+            for si in raiz.findall('m:si', _NS)]
+
+
+def _valor_celda(atributos, contenido, textos):
+    """
+    Valor de una celda según su tipo: texto compartido, texto en línea, booleano, error o número. Los números sin
+    decimales quedan como int, igual que en openpyxl.
+    """
+    tipo = _TIPO.search(atributos)
+    tipo = tipo.group(1) if tipo else 'n'
+    if tipo == 'inlineStr':
+        return html.unescape(''.join(_TEXTO.findall(contenido)))
+    valor = _VALOR.search(contenido)
+    if valor is None:
+        return None
+    valor = valor.group(1)
+    if tipo == 's':
+        return textos[int(valor)]
+    if tipo == 'str':
+        return html.unescape(valor)
+    if tipo == 'b':
+        return valor == '1'
+    if tipo == 'e':
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        return float(valor)
+
+
+def _celdas_por_fila(xml):
+    """
+    Celdas con contenido de una hoja en la que alguna celda no tiene referencia r. Se recorren las filas y todas sus
+    celdas para ubicarlas por posición, pero las filas sin valores no se recorren celda por celda.
+    :return: diccionario {columna: {fila: (atributos, contenido)}}
+    """
+    columnas = {}
+    fila = 0
+    for atributos_fila, contenido_fila in _FILA.findall(xml):
+        referencia = _REFERENCIA_FILA.search(atributos_fila)
+        fila = int(referencia.group(1)) if referencia else fila + 1
+        if '<v' not in contenido_fila and '<is' not in contenido_fila:
+            continue
+        posicion = -1
+        for atributos, contenido in _CELDA_FILA.findall(contenido_fila):
+            referencia = _REFERENCIA_CELDA.search(atributos)
+            posicion = _indice_columna(referencia.group(1)) if referencia else posicion + 1
+            if contenido:
+                columnas.setdefault(posicion, {})[fila] = (atributos, contenido)
+    return columnas
+
+
+def _leer_hoja(data_path, ruta, textos, hoja, esquema, opcionales=None):
+    """
+    Lee una hoja con esquema de un .xlsx en una sola pasada sobre su XML. Solo se guardan las columnas del esquema y
+    las opcionales, y las filas vacías del final no se recorren. La primera fila es el encabezado.
+    :param data_path: dirección del archivo .xlsx
+    :param ruta: ruta del XML de la hoja dentro del .xlsx (ver _rutas_hojas)
+    :param textos: tabla de textos compartidos del .xlsx (ver _textos_compartidos)
+    :param hoja: nombre de la hoja
+    :param esquema: columnas obligatorias de la hoja con su tipo (ver ESQUEMAS)
+    :param opcionales: columnas opcionales de la hoja con su tipo (ver COLUMNAS_OPCIONALES)
+    :return: pd.DataFrame
+    """
+    with zipfile.ZipFile(data_path) as archivo_zip:
+        xml = archivo_zip.read(ruta).decode('utf-8')
+
+    # Valores por columna y fila. Solo las celdas con contenido
+    columnas = {}
+    for atributos, contenido in _CELDA.findall(xml):
+        referencia = _REFERENCIA_CELDA.search(atributos)
+        if referencia is None:
+            columnas = _celdas_por_fila(xml)
+            break
+        letras, fila = referencia.groups()
+        columnas.setdefault(_indice_columna(letras), {})[int(fila)] = (atributos, contenido)
+
+    encabezado = {posicion: _valor_celda(*celdas[1], textos) for posicion, celdas in columnas.items() if 1 in celdas}
+    posiciones = sorted(posicion for posicion, nombre in encabezado.items()
+                        if nombre is not None and str(nombre).strip() in {**esquema, **(opcionales or {})})
+    ultima_fila = max([fila for posicion in posiciones for fila in columnas[posicion] if fila > 1], default=1)
+
+    datos = {}
+    for posicion in posiciones:
+        valores = [None] * (ultima_fila - 1)
+        for fila, celda in columnas[posicion].items():
+            if fila > 1:
+                valores[fila - 2] = _valor_celda(*celda, textos)
+        datos[str(encabezado[posicion]).strip()] = valores
+
+    return _aplicar_esquema(pd.DataFrame(datos), esquema, hoja, opcionales)
+
+
+def leer_excel(data_path, sheet_names, procesos=1, esquemas=None):
+    """
+    Lee las hojas de un archivo datamaster. Las rutas de las hojas y los textos compartidos del .xlsx se leen una sola
+    vez, y cada hoja de ESQUEMAS se lee en una sola pasada sobre su XML, guardando solo las columnas del esquema y las
+    opcionales, con sus tipos (ver _leer_hoja). Con procesos > 1, las hojas se leen en paralelo y cada proceso recibe
+    los textos compartidos ya leídos. Como casi todo el tiempo está en master_demanda, el paralelo solo ayuda cuando hay
+    varias hojas grandes.
+
+    Las hojas sin esquema (p. ej. las del baseline) y los archivos .xls se leen con pd.read_excel, con todas las hojas
+    en una sola lectura.
+    :param data_path: dirección del archivo .xlsx o .xls
+    :param sheet_names: lista con los nombres de las hojas
+    :param procesos: hojas a leer a la vez
+    :param esquemas: esquema de cada hoja. Por defecto ESQUEMAS, con las columnas opcionales de COLUMNAS_OPCIONALES;
+    con {} todas las hojas se leen completas
+    :return: diccionario de DFs con el nombre de cada hoja
+    """
+    opcionales = COLUMNAS_OPCIONALES if esquemas is None else {}
+    esquemas = ESQUEMAS if esquemas is None else esquemas
+    rapidas = [] if data_path.lower().endswith('.xls') else [hoja for hoja in sheet_names if hoja in esquemas]
+    otras = [hoja for hoja in sheet_names if hoja not in rapidas]
+
+    datasets = {}
+    if otras:
+        leidas = pd.read_excel(data_path, sheet_name=otras)
+        datasets.update({hoja: _aplicar_esquema(leidas[hoja], esquemas.get(hoja, {}), hoja, opcionales.get(hoja))
+                         for hoja in otras})
+    if rapidas:
+        with zipfile.ZipFile(data_path) as archivo_zip:
+            rutas, textos = _rutas_hojas(archivo_zip), _textos_compartidos(archivo_zip)
+    if procesos is not None and procesos > 1 and len(rapidas) > 1:
+        with ProcessPoolExecutor(max_workers=min(procesos, len(rapidas))) as pool:
+            datasets.update(zip(rapidas, pool.map(_leer_hoja, [data_path] * len(rapidas),
+                                                  [rutas[hoja] for hoja in rapidas], [textos] * len(rapidas), rapidas,
+                                                  [esquemas[hoja] for hoja in rapidas],
+                                                  [opcionales.get(hoja) for hoja in rapidas])))
+    else:
+        datasets.update({hoja: _leer_hoja(data_path, rutas[hoja], textos, hoja, esquemas[hoja], opcionales.get(hoja))
+                         for hoja in rapidas})
+
+    return {hoja: datasets[hoja] for hoja in sheet_names}
+
+
+def limpieza_data(data_path, sheet_names, is_baseline=False, usar_cache=True, procesos=1):
+    """
+    Llama las funciones especializadas de arriba para limpiar los masters. Los masters limpios se guardan en una caché
+    en formato Feather (carpeta CARPETA_CACHE junto al archivo), con llave según el contenido del archivo y la versión
+    del código de limpieza. Si ninguno de los dos cambió, los masters se cargan de la caché sin leer el Excel.
     :param data_path: dirección relativa de archivo .xlsx o .xls que contiene la información a limpiar
     :param sheet_names: lista con los nombres de las hojas relevantes
     :param is_baseline: Boolean para determinar si el input es el baseline (que tiene un tratamiento especial)
+    :param usar_cache: Boolean para leer y guardar los masters limpios en la caché
+    :param procesos: hojas del Excel a leer a la vez (ver leer_excel)
 
     :return: datasets: diccionario que contiene todos los masters de datos
     """
-
-    # Los guardaremos en un dicccionario con los nombres de cada hoja
-    datasets = [pd.read_excel(data_path, sheet_name=i) for i in sheet_names]
-    datasets = dict(zip(sheet_names, datasets))
+    # Revisar si los masters limpios ya están en caché
+    if usar_cache:
+        carpeta_archivo, carpeta_llave = _ruta_cache(data_path, sheet_names, is_baseline)
+        datasets = _leer_cache(carpeta_llave)
+        if datasets is not None:
+            print(f'{data_path}\nMasters limpios cargados desde la caché\n')
+            return datasets
+
+    # Los guardaremos en un dicccionario con los nombres de cada hoja. El libro se abre una sola vez. Las hojas del
+    # baseline tienen los mismos nombres que las del modelo pero otras columnas, así que se leen completas
+    datasets = leer_excel(data_path, sheet_names, procesos=procesos, esquemas={} if is_baseline else None)
 
     # Limpiar tarifario
     datasets['mater_tarifario'] = ajustar_tarifario(datasets['master_tarifario'])
@@ -120,6 +469,11 @@ def limpieza_data(data_path, sheet_names, is_baseline=False):
         datasets['master_demanda'], datasets['demanda_omitida'] = ajustar_demanda(datasets['master_demanda'],
                                                                       datasets['master_producto'],
                                                                       datasets['master_tarifario'])
+
+    # Guardar masters limpios en caché
+    if usar_cache:
+        _guardar_cache(carpeta_archivo, carpeta_llave, datasets)
+
     return datasets
 
 
@@ -127,24 +481,8 @@ if __name__ == '__main__':
 
     """
     Aquí está el código que se usa al ejecutarse directamente esta función para limpiar las 3 bases de datos a la vez.
+    Equivale a `python scripts/herramienta.py clean` (ver herramienta.py para todas las opciones).
     """
+    from herramienta import main
 
-    # Al existir la posibilidad de que alguno de los 3 archivos posibles no esté, atrapamos el error
-    DATAPATH = ['datamaster_baseline.xlsx', 'datamaster_base_opt.xlsx', 'datamaster_escenario.xlsx']
-    sheet_names = ['master_producto', 'master_ubicaciones', 'master_demanda',
-                   'master_tarifario', 'master_red_infraestructura']
-    baseline_sheet_names = []
-    datasets = {}
-
-    for path in DATAPATH:
-        try:
-            if path == 'datamaster_baseline.xlsx':
-                datasets[path] = limpieza_data('input/' + path, baseline_sheet_names, is_baseline=True)
-            else:
-                datasets[path] = limpieza_data('input/' + path, sheet_names)
-                datasets[path]['demanda_omitida'].to_excel('input/' + path[:-5] + '_demanda_omitida.xlsx')
-        except FileNotFoundError:
-            print(f'El archivo {path} no fue encontrado\n')
-            pass
-
-    # No hay necesidad de guardar los archivos para limpieza, de hecho. Con solo ejecutarlos ya es suficiente.
+    main(['clean'])
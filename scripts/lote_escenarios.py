@@ -0,0 +1,158 @@
+"""
+Código para ejecutar un lote de escenarios. Recibe una carpeta con archivos datamaster (.xlsx o .xls) o un manifiesto
+(.txt con una ruta por línea, o .csv con columna 'archivo' y opcionalmente 'escenario'), y corre cada escenario en un
+proceso aparte: limpieza de masters, construcción del modelo y optimización.
+
+Por cada escenario se guarda su decision_consolidado.csv en una carpeta con el nombre del escenario, y al final se
+guarda comparacion_escenarios.csv con el estado, costo y tiempos de todos. Un escenario que falla queda registrado con
+su error y no detiene el lote.
+
+Uso:
+    python scripts/lote_escenarios.py input/escenarios/ --procesos 4 --solver highs
+    python scripts/lote_escenarios.py input/manifiesto.csv --salida output/lote/
+"""
+import argparse
+import os
+import time
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from output import ejecucion, guardar_outputs
+from limpieza_masters import limpieza_data
+from perfilado import RegistroEjecucion, consolidar_etapas
+
+SHEET_NAMES = ['master_producto', 'master_ubicaciones', 'master_demanda',
+               'master_tarifario', 'master_red_infraestructura']
+EXTENSIONES = ('.xlsx', '.xls')
+
+
+def leer_escenarios(ruta):
+    """
+    Lista los escenarios a correr desde una carpeta o un manifiesto.
+    :param ruta: carpeta con archivos datamaster, o manifiesto .txt o .csv
+    :return: pd.DataFrame con columnas 'escenario' y 'archivo'
+    """
+    if os.path.isdir(ruta):
+        archivos = sorted(os.path.join(ruta, nombre) for nombre in os.listdir(ruta)
+                          if nombre.lower().endswith(EXTENSIONES) and not nombre.startswith('~$'))
+        escenarios = pd.DataFrame({'archivo': archivos})
+    elif ruta.lower().endswith('.csv'):
+        escenarios = pd.read_csv(ruta)
+        if 'archivo' not in escenarios.columns:
+            raise ValueError(f"El manifiesto {ruta} debe tener una columna 'archivo'")
+    else:
+        with open(ruta, encoding='utf-8') as archivo:
+            lineas = [linea.strip() for linea in archivo]
+        escenarios = pd.DataFrame({'archivo': [linea for linea in lineas if linea and not linea.startswith('#')]})
+
+    # Las rutas del manifiesto son relativas a su carpeta
+    if not os.path.isdir(ruta):
+        carpeta = os.path.dirname(ruta)
+        escenarios['archivo'] = [archivo if os.path.isabs(archivo) else os.path.join(carpeta, archivo)
+                                 for archivo in escenarios['archivo']]
+
+    if 'escenario' not in escenarios.columns:
+        escenarios['escenario'] = [os.path.splitext(os.path.basename(archivo))[0] for archivo in escenarios['archivo']]
+    if escenarios['escenario'].duplicated().any():
+        repetidos = escenarios.loc[escenarios['escenario'].duplicated(), 'escenario'].tolist()
+        raise ValueError(f"Hay nombres de escenario repetidos: {repetidos}")
+
+    return escenarios.loc[:, ['escenario', 'archivo']].reset_index(drop=True)
+
+
+def correr_escenario(escenario, archivo, carpeta_salida, solver='glpk', modo='monolitico'):
+    """
+    Corre un escenario completo y guarda su decision_consolidado.csv. Los errores se capturan y se retornan en el
+    registro, para no detener el lote. Las etapas quedan en carpeta_salida/registros/ (ver perfilado.py).
+    :param escenario: nombre del escenario
+    :param archivo: ruta del archivo datamaster
+    :param carpeta_salida: carpeta del lote. El escenario se guarda en carpeta_salida/escenario/
+    :param solver: backend de solución (ver solvers.BACKENDS)
+    :param modo: modo de solución (ver output.ejecucion)
+    :return: diccionario con el registro del escenario
+    """
+    registro = {'escenario': escenario, 'archivo': archivo, 'estado': None, 'costo': None, 'tiempo_limpieza': None,
+                'tiempo_optimizacion': None, 'tiempo_total': None, 'error': None}
+    perfil = RegistroEjecucion('lote_escenarios', escenario=escenario, archivo=archivo, solver=solver, modo=modo)
+    registro['id_registro'] = perfil.id
+    inicio = time.time()
+    try:
+        with perfil.etapa('limpieza'):
+            data = limpieza_data(archivo, SHEET_NAMES)
+        registro['tiempo_limpieza'] = time.time() - inicio
+
+        inicio_optimizacion = time.time()
+        decision, _, costo, _, _, _, resultado = ejecucion(data, solver=solver, modo=modo, registro=perfil)
+        registro['tiempo_optimizacion'] = time.time() - inicio_optimizacion
+        registro['estado'], registro['costo'] = resultado.estado, costo
+
+        carpeta_escenario = os.path.join(carpeta_salida, escenario, '')
+        os.makedirs(carpeta_escenario, exist_ok=True)
+        with perfil.etapa('guardar_outputs'):
+            guardar_outputs([decision], ['decision_consolidado.csv'], carpeta_escenario)
+    except Exception as error:
+        registro['estado'] = 'error'
+        registro['error'] = f"{type(error).__name__}: {error}"
+        print(f"Escenario {escenario} falló:\n{traceback.format_exc()}")
+    registro['tiempo_total'] = time.time() - inicio
+    perfil.metadatos['estado'] = registro['estado']
+    # Los demás escenarios del lote guardan en la misma carpeta, así que las etapas se consolidan en correr_lote
+    perfil.guardar(os.path.join(carpeta_salida, 'registros'), consolidar=False)
+
+    return registro
+
+
+def correr_lote(escenarios, carpeta_salida='output/escenarios/', procesos=None, solver='glpk', modo='monolitico'):
+    """
+    Corre todos los escenarios en un pool de procesos y guarda la comparación consolidada.
+    :param escenarios: pd.DataFrame con columnas 'escenario' y 'archivo' (ver leer_escenarios)
+    :param carpeta_salida: carpeta donde se guardan los resultados del lote
+    :param procesos: máximo de escenarios corriendo a la vez. Por defecto todos los núcleos
+    :param solver: backend de solución (ver solvers.BACKENDS)
+    :param modo: modo de solución (ver output.ejecucion)
+    :return: pd.DataFrame con la comparación de escenarios
+    """
+    os.makedirs(carpeta_salida, exist_ok=True)
+    inicio = time.time()
+    registros = []
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        tareas = {pool.submit(correr_escenario, fila.escenario, fila.archivo, carpeta_salida, solver, modo):
+                  fila.escenario for fila in escenarios.itertuples()}
+        for tarea in as_completed(tareas):
+            try:
+                registro = tarea.result()
+            except Exception as error:
+                # Falla del proceso mismo (por ejemplo, falta de memoria)
+                registro = {'escenario': tareas[tarea], 'estado': 'error', 'error': f"{type(error).__name__}: {error}"}
+            registros.append(registro)
+            print(f"Escenario {registro['escenario']} terminado: {registro['estado']}, costo {registro.get('costo')} "
+                  f"COP ({len(registros)} de {escenarios.shape[0]})")
+
+    consolidar_etapas(os.path.join(carpeta_salida, 'registros'),
+                      [registro['id_registro'] for registro in registros if registro.get('id_registro')])
+
+    # Mismo orden del manifiesto, y diferencia contra el escenario de menor costo
+    comparacion = escenarios.loc[:, ['escenario']].merge(pd.DataFrame(registros), on='escenario', how='left')
+    comparacion['diferencia_menor_costo'] = comparacion['costo'] - comparacion['costo'].min()
+    comparacion.to_csv(os.path.join(carpeta_salida, 'comparacion_escenarios.csv'), index=False)
+
+    fallidos = (comparacion['estado'] == 'error').sum()
+    print(f"Lote terminado en {time.time() - inicio} segundos: {escenarios.shape[0] - fallidos} escenarios corridos, "
+          f"{fallidos} con error")
+
+    return comparacion
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Corre un lote de escenarios de la herramienta de distribución')
+    parser.add_argument('ruta', nargs='?', default='input/escenarios/',
+                        help='carpeta con archivos datamaster, o manifiesto .txt o .csv')
+    parser.add_argument('--salida', default='output/escenarios/', help='carpeta de resultados del lote')
+    parser.add_argument('--procesos', type=int, default=None, help='escenarios a la vez (por defecto, los núcleos)')
+    parser.add_argument('--solver', default='glpk', help='backend de solución (ver solvers.BACKENDS)')
+    parser.add_argument('--modo', default='monolitico', help='modo de solución (ver output.ejecucion)')
+    args = parser.parse_args()
+
+    correr_lote(leer_escenarios(args.ruta), carpeta_salida=args.salida, procesos=args.procesos, solver=args.solver,
+                modo=args.modo)
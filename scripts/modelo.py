@@ -0,0 +1,188 @@
+"""
+En este script se encuentra el modelo compilado de la red, pensado para resolver escenarios sin reconstruir el modelo.
+Se construye una sola vez a partir de los items, actividades y matriz que entrega output.ejecucion(), y expone como
+vectores actualizables la demanda, las capacidades (lado derecho de los items) y los costos de las actividades. Un
+escenario que solo cambia esos valores (demanda, tarifas, capacidades de nodos) se resuelve reusando la estructura ya
+compilada y arrancando desde la solución anterior cuando el backend lo permite.
+
+No se usan cp.Parameter de CVXPY: con decenas de miles de parámetros la compilación DPP de CVXPY consume más memoria y
+tiempo que declarar el modelo de nuevo en bloques.
+"""
+import time
+import numpy as np
+import pandas as pd
+from creacion_items_actividades import build_items, build_activities
+from optimization import matrices_modelo
+from solvers import resolver, modelo_highspy, resolver_modelo_highspy
+
+# Columnas que identifican un item y una actividad. Si dos modelos tienen las mismas llaves en el mismo orden, tienen
+# la misma estructura y solo cambian sus valores
+LLAVES_ITEMS = ['tiempo', 'producto', 'nodo', 'tipo']
+LLAVES_ACTIVIDADES = ['tiempo', 'producto', 'transporte', 'origen', 'destino', 'almacenamiento']
+
+
+class ModeloRed:
+    """
+    Modelo lineal compilado una sola vez. Según el backend, se reusa de forma diferente:
+        - 'highspy': objeto highspy.Highs persistente. Al cambiar costos o lados derechos HiGHS arranca desde la base
+          óptima anterior, así que un cambio de tarifa se resuelve en pocas iteraciones
+        - demás backends de solvers.BACKENDS: se actualizan los arreglos (matriz ya separada en bloques) y se llama
+          solvers.resolver(), sin reconstruir items, actividades ni matriz
+    """
+
+    def __init__(self, items_df, actividades_df, coef_mat, solver='glpk', **opciones):
+        """
+        :param items_df: pd.DataFrame con los items del problema
+        :param actividades_df: pd.DataFrame con las actividades del problema
+        :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+        :param solver: backend de solución
+        :param opciones: opciones adicionales que se pasan al backend
+        """
+        inicio = time.time()
+        self.items = items_df.loc[:, LLAVES_ITEMS + ['valor']].reset_index(drop=True)
+        self.actividades = actividades_df.loc[:, LLAVES_ACTIVIDADES + ['costo']].reset_index(drop=True)
+        self.solver = solver
+        self.opciones = opciones
+        self.resultado = None
+
+        self.c, self.A_eq, b_eq, self.A_ub, b_ub, self.mascara_eq = matrices_modelo(self.items, self.actividades,
+                                                                                   coef_mat)
+        self.b_eq, self.b_ub = b_eq.copy(), b_ub.copy()
+
+        # Compilar el modelo según el backend
+        self._highs = None
+        if solver == 'highspy':
+            self._highs = modelo_highspy(self.c, self.A_eq, self.b_eq, self.A_ub, self.b_ub, **opciones)
+        self.tiempo_compilacion = time.time() - inicio
+
+    @classmethod
+    def desde_datasets(cls, DATASETS, solver='glpk', **opciones):
+        """
+        Construye items, actividades y matriz desde los masters limpios y compila el modelo.
+        :param DATASETS: diccionario con los masters limpios
+        :return: ModeloRed
+        """
+        from creacion_items_actividades import matriz_coef
+
+        items, actividades = _items_actividades(DATASETS)
+        return cls(items, actividades, matriz_coef(items, actividades), solver=solver, **opciones)
+
+    def actualizar_vectores(self, valores=None, costos=None):
+        """
+        Reemplaza los lados derechos y/o costos completos del modelo.
+        :param valores: arreglo alineado con los items, con la misma convención de items_df['valor'] (demanda positiva)
+        :param costos: arreglo alineado con las actividades
+        """
+        if valores is not None:
+            valores = np.asarray(valores, dtype=float)
+            if valores.shape[0] != self.items.shape[0]:
+                raise ValueError(f"Se esperaban {self.items.shape[0]} valores de items y llegaron {valores.shape[0]}")
+            self.items['valor'] = valores
+            valores = np.where(self.items['tipo'].values == 'demanda', -valores, valores)
+            self.b_eq, self.b_ub = valores[self.mascara_eq], valores[~self.mascara_eq]
+        if costos is not None:
+            costos = np.asarray(costos, dtype=float)
+            if costos.shape[0] != self.actividades.shape[0]:
+                raise ValueError(f"Se esperaban {self.actividades.shape[0]} costos y llegaron {costos.shape[0]}")
+            self.actividades['costo'] = costos
+            self.c = costos
+
+        # Pasar valores al modelo compilado
+        if self._highs is not None:
+            import highspy
+
+            n, m_eq, m_ub = self.c.shape[0], self.b_eq.shape[0], self.b_ub.shape[0]
+            self._highs.changeColsCost(n, np.arange(n, dtype=np.int32), self.c)
+            self._highs.changeRowsBounds(m_eq + m_ub, np.arange(m_eq + m_ub, dtype=np.int32),
+                                         np.concatenate([self.b_eq, np.full(m_ub, -highspy.kHighsInf)]),
+                                         np.concatenate([self.b_eq, self.b_ub]))
+
+    def actualizar_items(self, cambios: pd.DataFrame):
+        """
+        Cambia el valor de algunos items (demanda, producción máxima o capacidades de nodos).
+        :param cambios: pd.DataFrame con columnas 'tiempo', 'producto', 'nodo', 'tipo' y 'valor'. Para capacidades,
+        'producto' es NaN
+        """
+        posiciones = _posiciones(self.items, cambios, LLAVES_ITEMS, 'items')
+        valores = self.items['valor'].values.astype(float).copy()
+        valores[posiciones] = cambios['valor'].values.astype(float)
+        self.actualizar_vectores(valores=valores)
+
+    def actualizar_tarifas(self, cambios: pd.DataFrame):
+        """
+        Cambia el costo de algunas actividades. Se cruzan por las columnas de `LLAVES_ACTIVIDADES` que traiga `cambios`,
+        por ejemplo solo ('origen', 'destino', 'transporte') para cambiar una tarifa en todos los meses y familias.
+        :param cambios: pd.DataFrame con columnas de llave de actividades y 'costo'
+        """
+        llaves = [col for col in LLAVES_ACTIVIDADES if col in cambios.columns]
+        actividades = self.actividades.loc[:, llaves].copy()
+        actividades['idy'] = np.arange(actividades.shape[0])
+        cruce = actividades.merge(cambios.loc[:, llaves + ['costo']], on=llaves, how='inner')
+        if cruce.shape[0] == 0:
+            raise ValueError('Ninguna tarifa de `cambios` coincide con las actividades del modelo')
+        costos = self.c.copy()
+        costos[cruce['idy'].values] = cruce['costo'].values.astype(float)
+        self.actualizar_vectores(costos=costos)
+
+    def actualizar_desde_datasets(self, DATASETS):
+        """
+        Actualiza el modelo con los masters limpios de un escenario. Solo es posible si el escenario tiene la misma
+        estructura (mismos items y actividades) que el modelo compilado; de lo contrario se debe compilar de nuevo.
+        :param DATASETS: diccionario con los masters limpios del escenario
+        :return: True si se actualizó, False si la estructura es diferente
+        """
+        items, actividades = _items_actividades(DATASETS)
+        if not (_mismas_llaves(items, self.items, LLAVES_ITEMS) and
+                _mismas_llaves(actividades, self.actividades, LLAVES_ACTIVIDADES)):
+            return False
+        self.actualizar_vectores(valores=items['valor'].values, costos=actividades['costo'].values)
+        return True
+
+    def resolver(self):
+        """
+        Resuelve el modelo con los valores actuales, arrancando desde la solución anterior cuando el backend lo permite.
+        :return: ResultadoSolver
+        """
+        if self._highs is not None:
+            self.resultado = resolver_modelo_highspy(self._highs, self.b_eq.shape[0], self.b_ub.shape[0])
+        else:
+            self.resultado = resolver(self.c, self.A_eq, self.b_eq, self.A_ub, self.b_ub, backend=self.solver,
+                                      **self.opciones)
+        return self.resultado
+
+
+def _items_actividades(DATASETS):
+    """
+    Construye las tablas de items y actividades desde los masters limpios.
+    """
+    items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
+                        DATASETS['master_demanda'], DATASETS['master_producto'])
+    actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
+                                   DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
+    return items, actividades
+
+
+def _mismas_llaves(df_a, df_b, llaves):
+    """
+    Revisa si dos tablas tienen las mismas llaves en el mismo orden. Las categorías se comparan por valor, ya que dos
+    escenarios pueden tener diccionarios de nodos distintos con la misma estructura.
+    """
+    if df_a.shape[0] != df_b.shape[0]:
+        return False
+    return df_a.loc[:, llaves].astype(object).reset_index(drop=True).equals(
+        df_b.loc[:, llaves].astype(object).reset_index(drop=True))
+
+
+def _posiciones(tabla, cambios, llaves, nombre):
+    """
+    Retorna la posición en `tabla` de cada fila de `cambios`, cruzando por `llaves`. Si alguna fila no existe en la
+    tabla, se lanza ValueError, ya que agregar filas cambia la estructura del modelo.
+    """
+    tabla = tabla.loc[:, llaves].copy()
+    tabla['posicion'] = np.arange(tabla.shape[0])
+    cruce = cambios.loc[:, llaves].merge(tabla, on=llaves, how='left')
+    if cruce['posicion'].isna().any():
+        faltantes = cruce.loc[cruce['posicion'].isna(), llaves]
+        raise ValueError(f"Hay {faltantes.shape[0]} filas de `cambios` que no existen en los {nombre} del modelo:\n"
+                         f"{faltantes.head()}")
+    return cruce['posicion'].values.astype(int)
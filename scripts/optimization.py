@@ -1,87 +1,326 @@
-import cvxpy as cp
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+import time
+from solvers import resolver, ResultadoSolver
+from presolve import reducir_modelo, recuperar_solucion
 
 
-def optimizacion(items_df, actividades_df, coef_mat):
+def matrices_modelo(items_df, actividades_df, coef_mat):
     """
-    v2. Se construye el modelo a partir de la API de CVXPY
-    Desarrolla la optimización de un problema de transporte a partir de una matriz de coeficientes, un vector de
-    restricciones, y un vector de costos. Se usa un constructor de modelo más veloz para reducir el tiempo de procesa-
-    miento.
+    Separa el modelo en sus bloques matriciales: vector de costos `c`, restricciones de igualdad (demanda y flujo)
+    `A_eq @ X == b_eq` y restricciones de desigualdad (producción y capacidades) `A_ub @ X <= b_ub`. Las filas se
+    separan con máscaras booleanas sobre items_df['tipo']. La demanda se pasa a negativo sobre una copia de los valores,
+    sin modificar `items_df`.
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades (flujos) del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array) de dimensión len(items) x len(actividades)
+    :return: c, A_eq, b_eq, A_ub, b_ub, mascara_eq. `mascara_eq` es el np.array booleano que indica cuáles items son
+    restricciones de igualdad
+    """
+    coef_mat = sp.csr_matrix(coef_mat)
+
+    # INPUT: Ajustar valores de items para que la demanda sea negativa
+    valores = items_df['valor'].values.astype(float)
+    valores = np.where(items_df['tipo'].values == 'demanda', -valores, valores)
+
+    # Máscaras de restricciones de igualdad (demanda, flujo) y desigualdad (produccion, capacidad_din, capacidad_est)
+    mascara_eq = items_df['tipo'].isin(['demanda', 'flujo']).values
+
+    c = actividades_df['costo'].values.astype(float)
+    A_eq, b_eq = coef_mat[mascara_eq], valores[mascara_eq]
+    A_ub, b_ub = coef_mat[~mascara_eq], valores[~mascara_eq]
+
+    return c, A_eq, b_eq, A_ub, b_ub, mascara_eq
+
+
+def optimizacion(items_df, actividades_df, coef_mat, solver='glpk', presolve=False, **opciones):
+    """
+    v4. Desarrolla la optimización de un problema de transporte a partir de una matriz de coeficientes, un vector de
+    restricciones, y un vector de costos. El modelo se entrega en forma matricial al backend escogido (ver solvers.py),
+    de modo que se pueda cambiar de motor de solución sin cambiar la construcción del modelo.
 
     :param items_df:
     :param actividades_df:
-    :param coef_mat:
-    :return:
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array) de dimensión len(items) x len(actividades)
+    :param solver: backend de solución. Uno de solvers.BACKENDS
+    :param presolve: si es True, se eliminan filas y columnas redundantes antes de resolver (ver presolve.py), y la
+    solución se lleva de vuelta a todos los items y actividades
+    :param opciones: opciones adicionales que se pasan al backend
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info)
     """
 
-    print("Proceso de optimización ha comenzado")
+    print(f"Proceso de optimización ha comenzado con {solver}")
 
-    # INPUT: Ajustar items_df para que la demanda sea negativa
-    items_df.loc[items_df['tipo'] == 'demanda', 'valor'] *= -1
+    # INPUT: construir bloques del modelo. No se modifica `items_df`
+    c, A_eq, b_eq, A_ub, b_ub, _ = matrices_modelo(items_df, actividades_df, coef_mat)
 
-    # VARIABLES:
-    X = cp.Variable(actividades_df['costo'].T.shape)
+    if presolve:
+        reducido = reducir_modelo(c, A_eq, b_eq, A_ub, b_ub)
+        if reducido['estado'] is None:
+            resultado = resolver(reducido['c'], reducido['A_eq'], reducido['b_eq'], reducido['A_ub'],
+                                 reducido['b_ub'], backend=solver, **opciones)
+        else:
+            resultado = ResultadoSolver(reducido['estado'], None, np.nan, None,
+                                        {'compilacion': 0.0, 'solucion': 0.0, 'total': 0.0},
+                                        {'backend': solver, 'iteraciones': 0, 'mensaje': 'detectado en el presolve'})
+        resultado = recuperar_solucion(reducido, resultado)
+    else:
+        resultado = resolver(c, A_eq, b_eq, A_ub, b_ub, backend=solver, **opciones)
+    print(f"Estado de la solución: {resultado.estado}. Tiempo de compilación {resultado.tiempos['compilacion']}, "
+          f"tiempo de solución {resultado.tiempos['solucion']}")
 
-    # FUNCION OBJETIVO
-    obj = cp.Minimize(actividades_df['costo'].values @ X)
+    return resultado
 
-    # RESTRICCIONES
-    restricciones = [X >= 0]  # Restriccion de no-negatividad de las variables
-    for i in range(items_df.shape[0]):
-        if items_df['tipo'][i] in ['demanda', 'flujo']:
-            restricciones.append(coef_mat[i].T @ X == items_df['valor'][i])
-        else:
-            restricciones.append(coef_mat[i].T @ X <= items_df['valor'][i])
-    # DECLARAR PROBLEMA
-    prob = cp.Problem(obj, restricciones)
 
-    # Crear objetos para el resultado y las variables de resultado
-    obj_val = prob.solve(solver=cp.GLPK, verbose=True)
-    variables = X.value
+def optimizacion_horizonte_rodante(items_df, actividades_df, coef_mat, ventana=1, paso=None, solver='glpk',
+                                   respaldo=True, **opciones):
+    """
+    Resuelve el modelo por ventanas de `ventana` meses en vez de resolver todos los meses a la vez. De cada ventana se
+    fijan las decisiones de los primeros `paso` meses, y la ventana avanza. Los meses solo se acoplan por las
+    actividades de almacenamiento, así que el inventario que queda al final de los meses fijados entra como dato
+    (lado derecho) en la siguiente ventana. Con esto, la memoria y el tiempo de cada solución dependen del tamaño de la
+    ventana y no del horizonte completo.
 
-    return prob, variables, obj_val
+    Una ventana puede no tener solución aunque el modelo completo sí la tenga: si un mes posterior necesita inventario
+    que se debía acumular en meses ya fijados, las decisiones fijadas no lo dejaron. En ese caso el estado es
+    'infactible_ventana' (info['ventana_fallida'] indica los meses de la ventana) o, con `respaldo`, se resuelve el
+    modelo monolítico y info['respaldo'] queda en 'monolitico'.
 
+    Los duales de las filas son los de la ventana en la que se fijó cada mes. Como no son los duales óptimos del modelo
+    completo, los costos reducidos se calculan a partir de ellos (c - A'y), y pueden quedar negativos.
 
-def df_variables(variables, df_actividades):
+    :param items_df:
+    :param actividades_df:
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array) de dimensión len(items) x len(actividades)
+    :param ventana: cantidad de meses que se resuelven juntos
+    :param paso: cantidad de meses que se fijan de cada ventana. Por defecto es igual a `ventana`
+    :param solver: backend de solución. Uno de solvers.BACKENDS
+    :param respaldo: si una ventana no tiene solución, resolver el modelo monolítico
+    :param opciones: opciones adicionales que se pasan al backend
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info). En info['ventanas'] queda el detalle de
+    cada ventana
     """
-    v2, usa output de CVXPY como insumo, lo cual reduce 30x el tiempo de ejecución.
+    if paso is None:
+        paso = ventana
+    if not 1 <= paso <= ventana:
+        raise ValueError(f"El paso ({paso}) debe estar entre 1 y la ventana ({ventana})")
+
+    print(f"Proceso de optimización por horizonte rodante ha comenzado con {solver}. Ventana {ventana}, paso {paso}")
+    inicio = time.time()
+
+    # Lado derecho de todos los items, en el orden de `items_df` y con la demanda negativa
+    c, A_eq, b_eq, A_ub, b_ub, mascara_eq = matrices_modelo(items_df, actividades_df, coef_mat)
+    coef_mat = sp.csr_matrix(coef_mat)
+    b = np.empty(items_df.shape[0])
+    b[mascara_eq], b[~mascara_eq] = b_eq, b_ub
+
+    tiempo_items = items_df['tiempo'].values
+    tiempo_actividades = actividades_df['tiempo'].values
+    meses = sorted(set(tiempo_items) | set(tiempo_actividades))
+
+    x = np.zeros(c.shape[0])
+    fijas = np.zeros(c.shape[0], dtype=bool)
+    duales = {'eq': np.full(b_eq.shape[0], np.nan), 'ub': np.full(b_ub.shape[0], np.nan),
+              'reducidos': np.full(c.shape[0], np.nan)}
+    posicion_eq = np.cumsum(mascara_eq) - 1
+    posicion_ub = np.cumsum(~mascara_eq) - 1
+    ventanas = []
+    estado, ventana_fallida = 'optimo', None
+
+    for i in range(0, len(meses), paso):
+        meses_ventana = meses[i:i + ventana]
+        # En la última ventana se fijan todos sus meses
+        meses_fijar = meses_ventana if i + ventana >= len(meses) else meses[i:i + paso]
+
+        filas = np.isin(tiempo_items, meses_ventana)
+        columnas = np.isin(tiempo_actividades, meses_ventana)
+
+        # El inventario de los meses ya fijados pasa al lado derecho de las filas de esta ventana
+        A_filas = coef_mat[filas]
+        b_ventana = b[filas] - A_filas[:, fijas] @ x[fijas]
+        A_ventana = A_filas[:, columnas]
+        eq = mascara_eq[filas]
+
+        resultado = resolver(c[columnas], A_ventana[eq], b_ventana[eq], A_ventana[~eq], b_ventana[~eq],
+                             backend=solver, **opciones)
+        ventanas.append({'meses': list(meses_ventana), 'estado': resultado.estado, 'filas': int(filas.sum()),
+                         'columnas': int(columnas.sum()), 'objetivo': resultado.objetivo,
+                         'compilacion': resultado.tiempos['compilacion'] or 0.0,
+                         'tiempo': resultado.tiempos['total']})
+        print(f"Ventana {meses_ventana[0]} a {meses_ventana[-1]}: {resultado.estado}, {int(filas.sum())} filas, "
+              f"{int(columnas.sum())} columnas, {resultado.tiempos['total']} segundos")
+        if resultado.estado != 'optimo':
+            # Con el primer mes de la ventana ya resuelto sin problema, la ventana falla por las decisiones fijadas
+            estado = 'infactible_ventana' if resultado.estado == 'infactible' and i > 0 else resultado.estado
+            ventana_fallida = list(meses_ventana)
+            x[:] = np.nan
+            break
+
+        # Fijar actividades de los meses a fijar, y guardar duales de sus filas
+        idx_columnas = np.where(columnas)[0]
+        mascara_fijar = np.isin(tiempo_actividades[idx_columnas], meses_fijar)
+        x[idx_columnas[mascara_fijar]] = resultado.x[mascara_fijar]
+        fijas[idx_columnas[mascara_fijar]] = True
+
+        idx_filas = np.where(filas)[0]
+        filas_fijar = np.isin(tiempo_items[idx_filas], meses_fijar)
+        filas_eq, filas_ub = idx_filas[eq & filas_fijar], idx_filas[~eq & filas_fijar]
+        duales['eq'][posicion_eq[filas_eq]] = resultado.duales['eq'][filas_fijar[eq]]
+        duales['ub'][posicion_ub[filas_ub]] = resultado.duales['ub'][filas_fijar[~eq]]
+
+        if i + ventana >= len(meses):
+            break
+
+    if estado == 'optimo':
+        duales['reducidos'] = c - A_eq.T @ duales['eq'] - A_ub.T @ duales['ub']
+
+    compilacion = sum(v['compilacion'] for v in ventanas)
+    info = {'backend': solver, 'iteraciones': None, 'mensaje': f'horizonte rodante, {len(ventanas)} ventanas',
+            'ventanas': ventanas, 'ventana_fallida': ventana_fallida, 'respaldo': None}
+
+    if estado == 'infactible_ventana' and respaldo:
+        print(f"La ventana {ventana_fallida[0]} a {ventana_fallida[-1]} no tiene solución con los meses fijados, se "
+              f"resuelve el modelo monolítico")
+        monolitico = optimizacion(items_df, actividades_df, coef_mat, solver=solver, **opciones)
+        info.update({'respaldo': 'monolitico', 'mensaje': info['mensaje'] + ', respaldo monolítico'})
+        total = time.time() - inicio
+        tiempos = {'compilacion': compilacion + (monolitico.tiempos['compilacion'] or 0.0),
+                   'solucion': total - compilacion - (monolitico.tiempos['compilacion'] or 0.0), 'total': total}
+        return ResultadoSolver(monolitico.estado, monolitico.x, monolitico.objetivo, monolitico.duales, tiempos,
+                               dict(monolitico.info, **info))
+
+    total = time.time() - inicio
+    tiempos = {'compilacion': compilacion, 'solucion': sum(v['tiempo'] for v in ventanas) - compilacion,
+               'total': total}
+
+    return ResultadoSolver(estado, x, float(c @ x) if estado == 'optimo' else np.nan, duales, tiempos, info)
+
+
+def _nombres_almacenamiento(columna, almacenamiento):
+    """
+    Agrega el sufijo '_ALMACENAMIENTO' a los nodos de las actividades de almacenamiento, sobre los códigos de la
+    categoría (sin recorrer los textos fila a fila).
+
+    :param columna: pd.Series categórica con los nodos ('origen' o 'destino')
+    :param almacenamiento: np.array booleano con las actividades de almacenamiento
+    :return: pd.Categorical con los nombres de salida
+    """
+    columna = columna.astype('category')
+    categorias = columna.cat.categories
+    codigos = np.where(almacenamiento, columna.cat.codes.values + len(categorias), columna.cat.codes.values)
+    return pd.Categorical.from_codes(codigos, categories=categorias.append(categorias.astype(str) + '_ALMACENAMIENTO'))
+
+
+def df_variables(variables, df_actividades, resultado=None):
+    """
+    v3, usa output de CVXPY como insumo, lo cual reduce 30x el tiempo de ejecución.
 
     Esta función construye un DataFrame de decisión donde se adjuntan las variables encontradas por el procedimiento
     de optimización. Dicho DataFrame se construye a partir de las actividades usadas y las variables encontradas. Al
-    venir en una lista ordenada por variable, solo se concatena al df_variables
+    venir en una lista ordenada por variable, solo se concatena al df_variables.
+
+    El almacenamiento se reporta como en las versiones anteriores, con origen y destino '<nodo>_ALMACENAMIENTO', en vez
+    de la columna 'almacenamiento' de las actividades. No se modifica `df_actividades`
+
+    Si se entrega el `resultado` del solver, se agrega el costo reducido de cada actividad ('costo_reducido': cuánto
+    tendría que bajar su tarifa para que convenga usarla) y, si el solver entregó análisis de sensibilidad
+    (info['rangos']), el intervalo de tarifa en el que la solución se mantiene óptima ('costo_minimo', 'costo_maximo').
+    Con vehículos enteros (info['vehiculos'], ver vehiculos_enteros.py) se agrega la columna 'vehiculos' con los
+    vehículos despachados, y 'valor_decision' queda como la carga en vehículos llenos equivalentes.
 
     :param variables: np.array con los valores encontrados por el solver
     :param df_actividades:
+    :param resultado: ResultadoSolver (opcional)
     :return:
     """
+    df_decision = df_actividades.copy()
+    if 'almacenamiento' in df_decision.columns:
+        almacenamiento = df_decision.pop('almacenamiento').values.astype(bool)
+        df_decision['origen'] = _nombres_almacenamiento(df_decision['origen'], almacenamiento)
+        df_decision['destino'] = _nombres_almacenamiento(df_decision['destino'], almacenamiento)
+
+    # Añadir valores a df_decision
+    df_decision['valor_decision'] = variables
 
-    # Añadir valores a df_actividades
-    df_actividades['valor_decision'] = variables
+    if resultado is not None:
+        if resultado.info.get('vehiculos') is not None:
+            df_decision['vehiculos'] = resultado.info['vehiculos']
+        df_decision['costo_reducido'] = resultado.duales['reducidos']
+        rangos = resultado.info.get('rangos')
+        if rangos is not None and len(rangos['costo_inferior']) == df_decision.shape[0]:
+            df_decision['costo_minimo'] = rangos['costo_inferior']
+            df_decision['costo_maximo'] = rangos['costo_superior']
 
-    return df_actividades
+    return df_decision
 
 
-def df_restricciones(df_decision:pd.DataFrame, df_items, matriz_coef:np.array):
+def df_restricciones(df_decision:pd.DataFrame, df_items, matriz_coef, resultado=None, tolerancia=1e-6):
     """
     Calcula el valor de las restricciones de acuerdo a la solución propuesta por el optimizador. Este resultado es
-    obtenido por multiplicación matricial entre la matriz coeficientes (i, a) y variables de decisión (a, 1), lo que
-    resulta en un vector (i, 1)
+    obtenido por multiplicación matricial entre la matriz coeficientes (i, a) y variables de decisión (a,), lo que
+    resulta en un vector (i,). La matriz puede ser dispersa (scipy.sparse), por lo que no se convierte a densa
+
+    Además se agrega la holgura de cada restricción (lado derecho - cumplimiento, con la demanda en negativo como en
+    matrices_modelo) y si está activa. Las de igualdad (demanda, flujo) siempre están activas, y las de desigualdad
+    (produccion, capacidades) cuando su holgura es cero, con tolerancia relativa a su valor.
+
+    Si se entrega el `resultado` del solver, se agrega el precio sombra de cada item en la columna 'dual': cuánto cambia
+    el costo total por cada unidad adicional de su 'valor' (toneladas de demanda, capacidad o producción). En
+    capacidades y producción es negativo o cero: una tonelada más de capacidad activa ahorra ese costo. Si el solver
+    entregó análisis de sensibilidad (info['rangos']), se agrega el intervalo de 'valor' en el que el dual se mantiene
+    ('rango_inferior', 'rango_superior'). En las filas con holgura el intervalo es [cumplimiento, +inf) (en la demanda,
+    con el signo contrario). Los intervalos que no contienen el 'valor' del item se dejan en NaN.
 
     :param df_items:
     :param df_decision: pd.DataFrame que resulta de df_variables(), que contiene en orden las variables de decisión
-    :param matriz_coef: Matriz de coeficientes con número de filas len(items) y columnas len(actividades)
+    :param matriz_coef: Matriz de coeficientes (scipy.sparse o np.array) con número de filas len(items) y columnas
+    len(actividades)
+    :param resultado: ResultadoSolver (opcional)
+    :param tolerancia: holgura relativa bajo la cual una restricción de desigualdad se considera activa
     :return: df_items: pd.DataFrame que contiene los items del modelo. Dado que los items imponen las restricciones,
     se agrega el valor de las restricciones cumplidas a este DF
     """
-    variables = df_decision['valor_decision'].values
-
-    # Reshape arreglos a 2D
-    variables = np.reshape(variables, (-1, 1))
+    variables = df_decision['valor_decision'].values.astype(float)
 
-    # Producto de matrices y agregar valor a df_items
+    # Producto matriz-vector y agregar valor a df_items
     restricciones = matriz_coef @ variables
     df_items['cumplimiento_restriccion'] = restricciones
 
+    # Holgura con la convención de matrices_modelo: la demanda entra en negativo
+    demanda = df_items['tipo'].values == 'demanda'
+    mascara_eq = df_items['tipo'].isin(['demanda', 'flujo']).values
+    lado_derecho = df_items['valor'].values.astype(float)
+    lado_derecho = np.where(demanda, -lado_derecho, lado_derecho)
+    holgura = lado_derecho - restricciones
+    df_items['holgura'] = holgura
+    df_items['activa'] = mascara_eq | (holgura <= tolerancia * np.maximum(1, np.abs(lado_derecho)))
+
+    if resultado is not None:
+        # Duales del solver (d costo / d lado derecho) en el orden de items. La demanda entra negativa al modelo, por lo
+        # que su dual por tonelada de demanda tiene el signo contrario
+        duales = np.empty(df_items.shape[0])
+        duales[mascara_eq], duales[~mascara_eq] = resultado.duales['eq'], resultado.duales['ub']
+        df_items['dual'] = np.where(demanda, -duales, duales)
+
+        rangos = resultado.info.get('rangos')
+        if rangos is not None and len(rangos['fila_inferior']) == df_items.shape[0]:
+            # El solver entrega las filas como [igualdades, desigualdades]
+            inferior, superior = np.empty(df_items.shape[0]), np.empty(df_items.shape[0])
+            m_eq = int(mascara_eq.sum())
+            inferior[mascara_eq], inferior[~mascara_eq] = rangos['fila_inferior'][:m_eq], rangos['fila_inferior'][m_eq:]
+            superior[mascara_eq], superior[~mascara_eq] = rangos['fila_superior'][:m_eq], rangos['fila_superior'][m_eq:]
+            inferior, superior = np.where(demanda, -superior, inferior), np.where(demanda, -inferior, superior)
+
+            # El intervalo debe contener el 'valor' de cada item. Si no, no es un rango del lado derecho y se descarta
+            valor = df_items['valor'].values.astype(float)
+            margen = tolerancia * np.maximum(1, np.abs(valor))
+            fuera = (valor < inferior - margen) | (valor > superior + margen)
+            if fuera.any():
+                print(f"{int(fuera.sum())} items con rango que no contiene su valor, se dejan sin rango")
+                inferior[fuera], superior[fuera] = np.nan, np.nan
+            df_items['rango_inferior'] = inferior
+            df_items['rango_superior'] = superior
+
     return df_items
@@ -1,6 +1,9 @@
 import pandas as pd
+import numpy as np
 from creacion_items_actividades import *
 from optimization import *
+from perfilado import RegistroEjecucion
+import os
 import time
 
 """
@@ -13,72 +16,221 @@ También se desarrollarán funciones que entreguen un output que tenga más sent
 
 def carga_datos(folder_path='input/'):
     """
-    Esta función no la usaremos ya que no volveremos a guardar los datos en la carpeta input por separado.
-    :param folder_path:
-    :return: DATASETS: lista que contiene los DFs a usar
+    Carga los masters limpios guardados por separado en .csv, uno por master.
+    :param folder_path: carpeta con los archivos <master>.csv
+    :return: DATASETS: diccionario con los DFs de cada master, con la misma llave que entrega limpieza_data
     """
 
     # Abrir bases de datos
-    DATASET_NAMES = ['master_red_infraestructura.csv', 'master_ubicaciones.csv', 'master_demanda.csv',
-                     'master_producto.csv',
-                     'master_tarifario.csv']
-    DATASETS = [pd.read_csv(folder_path + x) for x in DATASET_NAMES]
+    DATASET_NAMES = ['master_red_infraestructura', 'master_ubicaciones', 'master_demanda', 'master_producto',
+                     'master_tarifario']
+    DATASETS = {x: pd.read_csv(os.path.join(folder_path, x + '.csv')) for x in DATASET_NAMES}
 
     return DATASETS
 
 
-def ejecucion(DATASETS: dict):
+def ejecucion(DATASETS: dict, solver='glpk', opciones_solver=None, modo='monolitico', opciones_modo=None,
+              registro=None):
     """
     Función que corre el optimizador. Construye el escenario desde la carga de datos hata la construccion de inputs de
     la herramienta.
 
+    Modos de solución:
+        - 'monolitico': todos los meses en un solo modelo
+        - 'horizonte_rodante': por ventanas de meses (ver optimization.optimizacion_horizonte_rodante). `opciones_modo`
+          acepta 'ventana', 'paso' y 'calcular_brecha', que resuelve también el modelo monolítico para reportar la
+          brecha de optimalidad
+        - 'descomposicion': un subproblema por familia coordinado por precios de capacidad, en un pool de procesos (ver
+          descomposicion.optimizacion_descomposicion). `opciones_modo` acepta 'procesos', 'max_iteraciones',
+          'tolerancia', 'theta' y 'reparar'
+        - 'flujo': motor de flujo a costo mínimo (ver flujo_red.optimizacion_flujo). Si alguna capacidad de nodo queda
+          activa, se resuelve con `solver`
+        - 'entero': vehículos enteros en las actividades de transporte, con el MIP de HiGHS (ver
+          vehiculos_enteros.optimizacion_entera). `solver` resuelve la relajación lineal cuyo redondeo es la solución
+          inicial, con `opciones_solver`. `opciones_modo` acepta 'tiempo_limite', 'brecha', 'redondeo', 'hilos' y
+          'opciones_mip' (diccionario con opciones de HiGHS para el MIP)
+        - 'diseno': decide qué ubicaciones con 'abre/cierra' operar, con su costo fijo mensual, por descomposición de
+          Benders (ver diseno_red.optimizacion_diseno). `opciones_modo` acepta 'por_mes', 'candidatas',
+          'max_iteraciones', 'tolerancia' y 'penalizacion'
+
     :param DATASETS: diccionario con los DFs a analizar
-    :return:
+    :param solver: backend de solución (ver solvers.BACKENDS)
+    :param opciones_solver: diccionario con opciones adicionales para el backend
+    :param modo: modo de solución
+    :param opciones_modo: diccionario con opciones del modo de solución
+    :param registro: perfilado.RegistroEjecucion donde se registran las etapas y estadísticas del modelo. Si es None se
+    crea uno nuevo, que queda en resultado.info['registro']
+    :return: decision, restriccion, costo, items, actividades, matriz, resultado (ResultadoSolver)
     """
+    if opciones_solver is None:
+        opciones_solver = {}
+    if opciones_modo is None:
+        opciones_modo = {}
+
+    if registro is None:
+        registro = RegistroEjecucion('ejecucion', solver=solver, modo=modo)
 
     # Función para medir tiempo de rendimiento
     start_time = time.time()
 
     # ejecutamos build_items() para construir tabla de items
-    items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
-                        DATASETS['master_demanda'], DATASETS['master_producto'])
+    with registro.etapa('build_items'):
+        items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
+                            DATASETS['master_demanda'], DATASETS['master_producto'])
 
     # Ejecutamos build_activities() construir tabla de actividades
-    actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
-                                   DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
+    with registro.etapa('build_activities'):
+        actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
+                                       DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
 
     # Ejecutamos matriz_coef() para construir matriz de coeficientes
     func_time = time.time()
     print("Inicio de construcción de matriz")
-    matriz = matriz_coef(items, actividades)
+    with registro.etapa('matriz_coef'):
+        matriz = matriz_coef(items, actividades)
     print(f"Tiempo construccion matriz: {time.time() - func_time}")
 
     # Correr optimizador
-    modelo = [x for x in optimizacion(items_df=items, actividades_df=actividades, coef_mat=matriz)]
+    with registro.etapa('optimizacion'):
+        if modo == 'monolitico':
+            resultado = optimizacion(items_df=items, actividades_df=actividades, coef_mat=matriz, solver=solver,
+                                     **opciones_solver)
+        elif modo == 'horizonte_rodante':
+            opciones_modo = dict(opciones_modo)
+            calcular_brecha = opciones_modo.pop('calcular_brecha', False)
+            resultado = optimizacion_horizonte_rodante(items_df=items, actividades_df=actividades, coef_mat=matriz,
+                                                       solver=solver, **opciones_modo, **opciones_solver)
+            if calcular_brecha:
+                monolitico = optimizacion(items_df=items, actividades_df=actividades, coef_mat=matriz, solver=solver,
+                                          **opciones_solver)
+                brecha = (resultado.objetivo - monolitico.objetivo) / abs(monolitico.objetivo)
+                resultado.info['brecha'] = brecha
+                print(f"Costo monolítico {monolitico.objetivo} COP, costo horizonte rodante {resultado.objetivo} COP. "
+                      f"Brecha de optimalidad: {brecha:.4%}")
+        elif modo == 'descomposicion':
+            from descomposicion import optimizacion_descomposicion
+            resultado = optimizacion_descomposicion(items_df=items, actividades_df=actividades, coef_mat=matriz,
+                                                    solver=solver, **opciones_modo, **opciones_solver)
+        elif modo == 'flujo':
+            from flujo_red import optimizacion_flujo
+            resultado = optimizacion_flujo(items_df=items, actividades_df=actividades, coef_mat=matriz, solver=solver,
+                                           **opciones_modo, **opciones_solver)
+        elif modo == 'entero':
+            from vehiculos_enteros import optimizacion_entera
+            resultado = optimizacion_entera(items_df=items, actividades_df=actividades, coef_mat=matriz, solver=solver,
+                                            **opciones_modo, **opciones_solver)
+        elif modo == 'diseno':
+            from diseno_red import optimizacion_diseno
+            resultado = optimizacion_diseno(items_df=items, actividades_df=actividades, coef_mat=matriz,
+                                            master_ubicaciones=DATASETS['master_ubicaciones'], solver=solver,
+                                            **opciones_modo, **opciones_solver)
+        else:
+            raise ValueError(f"Modo {modo} no reconocido")
 
     # Mostar valor óptimo y tiempo total
     print("--- Tiempo optimización: %s segundos ---" % (time.time() - start_time))
 
-    costo = modelo[2]
+    costo = resultado.objetivo
     print(f"El costo total óptimo es {costo} COP\n")
 
     # Creamos las tablas de output del modelo
-    decision = df_variables(modelo[1], actividades)
-    restriccion = df_restricciones(decision, items, matriz)
+    with registro.etapa('tablas_output'):
+        decision = df_variables(resultado.x, actividades, resultado)
+        restriccion = df_restricciones(decision, items, matriz, resultado)
+    registro.registrar_modelo(items, actividades, matriz, resultado)
+    resultado.info['registro'] = registro
 
-    return decision, restriccion, costo, items, actividades, matriz
+    return decision, restriccion, costo, items, actividades, matriz, resultado
 
 
-def guardar_outputs(df_list, df_names, output_path='output/'):
+def df_costo_mensual(df_decision):
+    """
+    Tabla de costos por mes, separada en distribución a clientes, movimiento entre nodos de la red (costo de movimiento
+    dinámico) y almacenamiento. El costo de cada actividad es su tarifa por vehículo multiplicada por la decisión, o por
+    los vehículos despachados si la tabla tiene la columna 'vehiculos' (modo 'entero'). Solo se recorren las filas con
+    decisión diferente de cero.
+
+    :param df_decision: pd.DataFrame que resulta de df_variables()
+    :return: pd.DataFrame con una fila por mes y columnas 'tiempo', 'distribucion', 'entre_nodos', 'almacenamiento'
+    y 'total'
+    """
+    columna = 'vehiculos' if 'vehiculos' in df_decision.columns else 'valor_decision'
+    decision = df_decision.loc[df_decision[columna] != 0]
+    destino = decision['destino'].astype(str).values
+
+    # Almacenamiento tiene el sufijo en el nombre, y los clientes son los destinos que nunca son origen
+    tipo_costo = np.where(pd.Series(destino).str.endswith('_ALMACENAMIENTO').values, 'almacenamiento',
+                          np.where(np.isin(destino, df_decision['origen'].astype(str).unique()), 'entre_nodos',
+                                   'distribucion'))
+    costos = pd.DataFrame({'tiempo': decision['tiempo'].values, 'tipo_costo': tipo_costo,
+                           'costo': decision['costo'].values * decision[columna].values})
+
+    costo_mensual = costos.pivot_table(index='tiempo', columns='tipo_costo', values='costo', aggfunc='sum')
+    costo_mensual = costo_mensual.reindex(index=np.sort(df_decision['tiempo'].unique()),
+                                          columns=['distribucion', 'entre_nodos', 'almacenamiento']).fillna(0)
+    costo_mensual['total'] = costo_mensual.sum(axis=1)
+    costo_mensual.columns.name = None
+
+    return costo_mensual.reset_index()
+
+
+def _guardar_parquet(df, ruta, filas_por_bloque=None):
+    """
+    Guarda un DF en Parquet por bloques de filas (un row group por bloque), sin armar una tabla de Arrow con todo el DF.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    filas_por_bloque = filas_por_bloque or max(df.shape[0], 1)
+    escritor = None
+    try:
+        for inicio in range(0, max(df.shape[0], 1), filas_por_bloque):
+            tabla = pa.Table.from_pandas(df.iloc[inicio:inicio + filas_por_bloque], preserve_index=True)
+            if escritor is None:
+                escritor = pq.ParquetWriter(ruta, tabla.schema, compression='snappy')
+            escritor.write_table(tabla)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def guardar_outputs(df_list, df_names, output_path='output/', formato=None, solo_no_cero=False,
+                    filas_por_bloque=None):
     """
     Retorna los outputs de la herramienta en formato .csv y los almacena en la carpeta output/ . Estos outputs son
     las variables de decision con sus actividades, los items con sus el valor de las cantidades restringidas, y una tabla
     de costos donde se encuentre separado Distribución (inicialmente sin distinguir T1 y T2), Exportación, Almacenamiento,
     y costo de movimiento dinámico.
 
+    El formato sale de la extensión de cada nombre: '.csv', '.csv.gz' (CSV comprimido) o '.parquet'. Se escriben por
+    bloques de `filas_por_bloque` filas, para no armar todo el archivo en memoria. Se conserva el índice, que en la
+    tabla de decisión es la posición de la actividad.
+
+    :param df_list: lista de DFs a guardar
+    :param df_names: nombres de los archivos
+    :param output_path: carpeta de salida
+    :param formato: si se indica ('csv', 'csv.gz' o 'parquet'), reemplaza la extensión de todos los nombres
+    :param solo_no_cero: si es True, en las tablas con 'valor_decision' solo se guardan las decisiones diferentes de cero
+    :param filas_por_bloque: filas por bloque de escritura. Por defecto, todo el DF en un bloque
     :return:
     """
     for df, name in zip(df_list, df_names):
-        df.to_csv(output_path + name, index=True)
+        if formato is not None:
+            # Solo se quita la extensión conocida, para no cortar prefijos con puntos ('v1.2_decision.csv')
+            extension = next((ext for ext in ('.csv.gz', '.csv', '.parquet') if name.endswith(ext)), '')
+            name = name[:len(name) - len(extension)] + '.' + formato
+        if solo_no_cero and 'valor_decision' in df.columns:
+            no_cero = df['valor_decision'] != 0
+            if 'vehiculos' in df.columns:
+                no_cero |= df['vehiculos'] != 0
+            df = df.loc[no_cero]
+
+        if name.endswith('.parquet'):
+            _guardar_parquet(df, output_path + name, filas_por_bloque)
+        elif name.endswith('.csv') or name.endswith('.csv.gz'):
+            # pandas infiere la compresión de la extensión
+            df.to_csv(output_path + name, index=True, chunksize=filas_por_bloque)
+        else:
+            raise ValueError(f"Formato de {name} no reconocido. Use .csv, .csv.gz o .parquet")
 
     return 0
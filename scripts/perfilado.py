@@ -0,0 +1,212 @@
+"""
+En este script se encuentra el registro de rendimiento de una ejecución. Por cada etapa (carga, limpieza, build_items,
+build_activities, matriz_coef, optimización, output) se mide tiempo de reloj, tiempo de CPU y memoria pico del proceso,
+y se guardan las estadísticas del modelo (filas, columnas, valores no nulos, iteraciones del solver).
+
+Cada ejecución se guarda como un JSON en la carpeta de registros, y sus etapas se agregan a registro_etapas.csv, de modo
+que se puedan comparar ejecuciones entre versiones y escenarios. Cuando varios procesos guardan en la misma carpeta (por
+ejemplo un lote de escenarios), cada uno deja sus etapas en <id>_etapas.csv y el proceso principal las agrega al final
+con consolidar_etapas, para que las escrituras no se mezclen.
+
+Uso:
+    registro = RegistroEjecucion('global', solver='highs')
+    with registro.etapa('carga'):
+        data = carga_datos()
+    registro.guardar()
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+CARPETA_REGISTROS = 'output/registros/'
+
+
+def _memoria_pico_windows():
+    """
+    Memoria pico (PeakWorkingSetSize) del proceso en bytes con GetProcessMemoryInfo de la API de Windows.
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    class ContadoresMemoria(ctypes.Structure):
+        # PROCESS_MEMORY_COUNTERS de psapi.h
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    kernel32 = ctypes.WinDLL('kernel32')
+    psapi = ctypes.WinDLL('psapi')
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ContadoresMemoria), wintypes.DWORD]
+    psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+    contadores = ContadoresMemoria()
+    contadores.cb = ctypes.sizeof(ContadoresMemoria)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(contadores), contadores.cb):
+        return None
+    return contadores.PeakWorkingSetSize
+
+
+def memoria_pico_mb():
+    """
+    Memoria pico (RSS) del proceso en MB. En Linux y macOS se usa `resource`, en Windows GetProcessMemoryInfo por
+    ctypes, sin dependencias adicionales.
+    :return: float o None si no se puede medir
+    """
+    if sys.platform == 'win32':
+        try:
+            pico = _memoria_pico_windows()
+        except (OSError, AttributeError):
+            return None
+        return pico / 1024 ** 2 if pico is not None else None
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux entrega KB, macOS entrega bytes
+    return pico / 1024 ** 2 if sys.platform == 'darwin' else pico / 1024
+
+
+class RegistroEjecucion:
+    """
+    Registro de etapas y estadísticas de una ejecución.
+    """
+
+    def __init__(self, nombre, **metadatos):
+        """
+        :param nombre: nombre de la ejecución, por ejemplo el script ('global', 'escenario')
+        :param metadatos: datos adicionales de la ejecución (solver, modo, archivo de entrada, ...)
+        """
+        self.id = datetime.now().strftime('%Y%m%d_%H%M%S_') + uuid.uuid4().hex[:6]
+        self.nombre = nombre
+        self.metadatos = metadatos
+        self.fecha = datetime.now().isoformat(timespec='seconds')
+        self.etapas = []
+        self.modelo = {}
+        self._inicio = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nombre):
+        """
+        Mide una etapa: tiempo de reloj, tiempo de CPU y memoria pico al terminar.
+        :param nombre: nombre de la etapa
+        """
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        memoria_inicio = memoria_pico_mb()
+        try:
+            yield
+        finally:
+            memoria = memoria_pico_mb()
+            self.etapas.append({'etapa': nombre, 'tiempo': time.perf_counter() - inicio,
+                                'cpu': time.process_time() - inicio_cpu, 'memoria_pico_mb': memoria,
+                                'aumento_memoria_pico_mb': None if memoria is None else memoria - memoria_inicio})
+
+    def agregar_etapa(self, nombre, tiempo, cpu=None):
+        """
+        Agrega una etapa medida por fuera del registro, por ejemplo la compilación y solución que reporta el solver.
+        """
+        self.etapas.append({'etapa': nombre, 'tiempo': tiempo, 'cpu': cpu, 'memoria_pico_mb': None,
+                            'aumento_memoria_pico_mb': None})
+
+    def registrar_modelo(self, items_df=None, actividades_df=None, coef_mat=None, resultado=None):
+        """
+        Guarda las estadísticas del modelo y del resultado del solver.
+        :param items_df: pd.DataFrame con los items del problema
+        :param actividades_df: pd.DataFrame con las actividades del problema
+        :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+        :param resultado: ResultadoSolver
+        """
+        if items_df is not None:
+            self.modelo['filas'] = int(items_df.shape[0])
+            self.modelo['filas_por_tipo'] = {tipo: int(n) for tipo, n in items_df['tipo'].value_counts().items()}
+        if actividades_df is not None:
+            self.modelo['columnas'] = int(actividades_df.shape[0])
+        if coef_mat is not None:
+            self.modelo['no_nulos'] = int(coef_mat.nnz if hasattr(coef_mat, 'nnz') else (coef_mat != 0).sum())
+        if resultado is not None:
+            self.modelo['estado'] = resultado.estado
+            self.modelo['objetivo'] = None if resultado.objetivo is None else float(resultado.objetivo)
+            self.modelo['backend'] = resultado.info.get('backend')
+            self.modelo['iteraciones'] = resultado.info.get('iteraciones')
+            self.agregar_etapa('compilacion', resultado.tiempos['compilacion'])
+            self.agregar_etapa('solucion', resultado.tiempos['solucion'])
+
+    def como_dict(self):
+        """
+        :return: diccionario con todo el registro
+        """
+        return {'id': self.id, 'nombre': self.nombre, 'fecha': self.fecha, 'metadatos': self.metadatos,
+                'tiempo_total': time.perf_counter() - self._inicio, 'memoria_pico_mb': memoria_pico_mb(),
+                'modelo': self.modelo, 'etapas': self.etapas}
+
+    def resumen(self):
+        """
+        :return: pd.DataFrame con una fila por etapa
+        """
+        return pd.DataFrame(self.etapas, columns=['etapa', 'tiempo', 'cpu', 'memoria_pico_mb',
+                                                  'aumento_memoria_pico_mb'])
+
+    def guardar(self, carpeta=CARPETA_REGISTROS, consolidar=True):
+        """
+        Guarda el registro como <carpeta>/<id>.json y agrega sus etapas a <carpeta>/registro_etapas.csv.
+        :param carpeta: carpeta de registros
+        :param consolidar: False para dejar las etapas en <carpeta>/<id>_etapas.csv en lugar de agregarlas a
+            registro_etapas.csv, cuando otros procesos guardan a la vez en la misma carpeta (ver consolidar_etapas)
+        :return: ruta del JSON
+        """
+        os.makedirs(carpeta, exist_ok=True)
+        registro = self.como_dict()
+        ruta = os.path.join(carpeta, f'{self.id}.json')
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(registro, archivo, ensure_ascii=False, indent=2, default=str)
+
+        etapas = self.resumen()
+        etapas.insert(0, 'id', self.id)
+        etapas.insert(1, 'nombre', self.nombre)
+        etapas.insert(2, 'fecha', self.fecha)
+        for llave in ['filas', 'columnas', 'no_nulos', 'iteraciones', 'estado', 'backend']:
+            etapas[llave] = self.modelo.get(llave)
+        if consolidar:
+            _agregar_etapas(etapas, carpeta)
+        else:
+            etapas.to_csv(os.path.join(carpeta, f'{self.id}_etapas.csv'), index=False)
+
+        print(f"Registro de ejecución guardado en {ruta}\n{self.resumen().to_string(index=False)}")
+        return ruta
+
+
+def _agregar_etapas(etapas, carpeta):
+    """
+    Agrega las etapas a <carpeta>/registro_etapas.csv, con encabezado solo si el archivo es nuevo.
+    """
+    ruta_csv = os.path.join(carpeta, 'registro_etapas.csv')
+    etapas.to_csv(ruta_csv, mode='a', header=not os.path.exists(ruta_csv), index=False)
+
+
+def consolidar_etapas(carpeta, ids):
+    """
+    Agrega a <carpeta>/registro_etapas.csv las etapas que cada ejecución dejó en <carpeta>/<id>_etapas.csv (ver
+    RegistroEjecucion.guardar con consolidar=False) y borra esos archivos. Se llama desde un solo proceso, después de que
+    terminan todas las ejecuciones. Los ids sin archivo (una ejecución que no alcanzó a guardar) se ignoran.
+    :param carpeta: carpeta de registros
+    :param ids: ids de las ejecuciones a consolidar
+    :return: pd.DataFrame con las etapas agregadas
+    """
+    rutas = [os.path.join(carpeta, f'{id_registro}_etapas.csv') for id_registro in ids]
+    rutas = [ruta for ruta in rutas if os.path.exists(ruta)]
+    if not rutas:
+        return pd.DataFrame()
+
+    etapas = pd.concat([pd.read_csv(ruta) for ruta in rutas], ignore_index=True)
+    _agregar_etapas(etapas, carpeta)
+    for ruta in rutas:
+        os.remove(ruta)
+    return etapas
@@ -0,0 +1,242 @@
+"""
+En este script se encuentra el presolve del modelo lineal: reducciones exactas que se aplican entre matriz_coef() y el
+backend de solución, y la recuperación de la solución del modelo completo (postsolve).
+
+El modelo es min c'x s.a. A_eq x = b_eq, A_ub x <= b_ub, x >= 0. Reducciones, repetidas hasta que no haya cambios:
+    - filas vacías: flujos de nodos que ninguna actividad toca. Se eliminan (o se detecta que el modelo es infactible)
+    - filas forzadas: lado derecho 0 y todos los coeficientes del mismo signo, por ejemplo un nodo sin actividades de
+      entrada. Todas sus actividades quedan fijas en 0
+    - filas de una sola actividad (igualdad): la actividad queda fija en b / a, por ejemplo un cliente atendido por un
+      solo arco
+    - columnas vacías o fijas: se eliminan y su aporte pasa al lado derecho
+    - columnas dominadas: dos vehículos en el mismo arco tienen columnas proporcionales (coeficientes ±capacidad), así
+      que se conserva solo el de menor costo por tonelada
+    - filas redundantes: desigualdades que no pueden estar activas dadas las cotas implícitas de las actividades
+
+Todas las reducciones son exactas: el óptimo del modelo reducido, junto con los valores fijados, es óptimo del completo.
+Los duales de las filas eliminadas se recuperan en orden inverso, de modo que los costos reducidos cumplan las
+condiciones de optimalidad.
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+from solvers import ResultadoSolver
+
+
+def reducir_modelo(c, A_eq, b_eq, A_ub, b_ub, tolerancia=1e-9, max_pasadas=20):
+    """
+    Aplica las reducciones exactas al modelo.
+    :param c: vector de costos
+    :param A_eq: matriz de restricciones de igualdad
+    :param b_eq: lado derecho de las igualdades
+    :param A_ub: matriz de restricciones de desigualdad (<=)
+    :param b_ub: lado derecho de las desigualdades
+    :param tolerancia: tolerancia numérica para comparar con 0
+    :param max_pasadas: máximo de pasadas sobre el modelo
+    :return: diccionario con el modelo reducido ('c', 'A_eq', 'b_eq', 'A_ub', 'b_ub'), el estado ('infactible' si se
+    detectó en el presolve, None si no) y los datos para recuperar la solución con recuperar_solucion()
+    """
+    inicio = time.time()
+    m_eq, m_ub, n = A_eq.shape[0], A_ub.shape[0], c.shape[0]
+    A = sp.vstack([sp.csr_matrix(A_eq), sp.csr_matrix(A_ub)]).tocsr()
+    A_csc = A.tocsc()
+    es_eq = np.arange(m_eq + m_ub) < m_eq
+    b = np.concatenate([b_eq, b_ub]).astype(float)
+    # Escala para comparar lados derechos con 0 después de pasar columnas fijas al lado derecho
+    escala_b = 1 + np.abs(b).max(initial=0)
+
+    filas = np.ones(m_eq + m_ub, dtype=bool)
+    columnas = np.ones(n, dtype=bool)
+    x_fijo = np.zeros(n)
+    # Filas eliminadas que requieren recuperar su dual: (tipo, fila, columnas), en orden de eliminación
+    pila = []
+    conteo = {'filas_vacias': 0, 'filas_forzadas': 0, 'filas_singleton': 0, 'filas_redundantes': 0,
+              'columnas_vacias': 0, 'columnas_fijas': 0, 'columnas_dominadas': 0}
+    estado = None
+
+    def fijar(cols, valores):
+        # Pasar el aporte de columnas fijas al lado derecho
+        x_fijo[cols] = valores
+        columnas[cols] = False
+        b[:] -= A_csc[:, cols] @ valores
+
+    for pasada in range(max_pasadas):
+        cambios = 0
+        idx_filas, idx_columnas = np.where(filas)[0], np.where(columnas)[0]
+        S = A[idx_filas][:, idx_columnas].tocsr()
+        nnz = np.diff(S.indptr)
+        positivos = np.asarray((S > 0).sum(axis=1)).ravel()
+        negativos = nnz - positivos
+        b_filas, eq_filas = b[idx_filas], es_eq[idx_filas]
+        cero = np.abs(b_filas) <= tolerancia * escala_b
+
+        # Filas vacías
+        vacias = nnz == 0
+        if np.any(vacias & ((eq_filas & ~cero) | (~eq_filas & (b_filas < -tolerancia)))):
+            estado = 'infactible'
+            break
+        filas[idx_filas[vacias]] = False
+        conteo['filas_vacias'] += int(vacias.sum())
+        cambios += int(vacias.sum())
+
+        # Desigualdades con lado derecho 0 y coeficientes <= 0 siempre se cumplen
+        siempre = ~vacias & ~eq_filas & cero & (positivos == 0)
+        filas[idx_filas[siempre]] = False
+        conteo['filas_redundantes'] += int(siempre.sum())
+        cambios += int(siempre.sum())
+
+        # Filas forzadas: lado derecho 0 y todos los coeficientes del mismo signo
+        forzadas = ~vacias & cero & ((negativos == 0) | (eq_filas & (positivos == 0)))
+        cols_forzadas = set()
+        for k in np.where(forzadas)[0]:
+            cols = idx_columnas[S.indices[S.indptr[k]:S.indptr[k + 1]]]
+            pila.append(('forzada', idx_filas[k], cols))
+            cols_forzadas.update(cols.tolist())
+        filas[idx_filas[forzadas]] = False
+        if cols_forzadas:
+            cols_forzadas = np.array(sorted(cols_forzadas))
+            fijar(cols_forzadas, np.zeros(cols_forzadas.shape[0]))
+            conteo['columnas_fijas'] += cols_forzadas.shape[0]
+        conteo['filas_forzadas'] += int(forzadas.sum())
+        cambios += int(forzadas.sum())
+
+        # Igualdades de una sola actividad. Si dos filas fijan la misma columna, la segunda queda vacía en la siguiente
+        # pasada y se revisa su factibilidad
+        singleton = np.where(~forzadas & eq_filas & (nnz == 1))[0]
+        cols_singleton = idx_columnas[S.indices[S.indptr[singleton]]]
+        activas = columnas[cols_singleton]
+        singleton, cols_singleton = singleton[activas], cols_singleton[activas]
+        cols_singleton, primera = np.unique(cols_singleton, return_index=True)
+        singleton = singleton[primera]
+        if singleton.shape[0] > 0:
+            valores = b_filas[singleton] / S.data[S.indptr[singleton]]
+            if np.any(valores < -tolerancia * (1 + np.abs(valores))):
+                estado = 'infactible'
+                break
+            for k, col in zip(singleton, cols_singleton):
+                pila.append(('singleton', idx_filas[k], np.array([col])))
+            filas[idx_filas[singleton]] = False
+            fijar(cols_singleton, np.maximum(valores, 0))
+            conteo['filas_singleton'] += singleton.shape[0]
+            conteo['columnas_fijas'] += singleton.shape[0]
+            cambios += singleton.shape[0]
+
+        # Columnas vacías con costo no negativo quedan en 0
+        idx_columnas = np.where(columnas)[0]
+        sub_csc = A_csc[:, idx_columnas][filas].tocsc()
+        vacias_col = (np.diff(sub_csc.indptr) == 0) & (c[idx_columnas] >= 0)
+        columnas[idx_columnas[vacias_col]] = False
+        conteo['columnas_vacias'] += int(vacias_col.sum())
+        cambios += int(vacias_col.sum())
+
+        # Columnas dominadas: columnas proporcionales (mismo patrón al dividir por su primer coeficiente). Se conserva
+        # la de menor costo por unidad del primer coeficiente
+        idx_columnas = np.where(columnas)[0]
+        sub_csc = A_csc[:, idx_columnas][filas].tocsc()
+        sub_csc.sort_indices()
+        nnz_col = np.diff(sub_csc.indptr)
+        escala = np.ones(idx_columnas.shape[0])
+        escala[nnz_col > 0] = np.abs(sub_csc.data[sub_csc.indptr[:-1][nnz_col > 0]])
+        normalizados = np.round(sub_csc.data / np.repeat(escala, nnz_col), 9)
+        llaves = {}
+        dominadas = []
+        for k in np.where(nnz_col > 0)[0]:
+            inicio_col, fin_col = sub_csc.indptr[k], sub_csc.indptr[k + 1]
+            llave = (sub_csc.indices[inicio_col:fin_col].tobytes(), normalizados[inicio_col:fin_col].tobytes())
+            costo = c[idx_columnas[k]] / escala[k]
+            if llave in llaves:
+                otra, costo_otra = llaves[llave]
+                if costo < costo_otra:
+                    dominadas.append(otra)
+                    llaves[llave] = (k, costo)
+                else:
+                    dominadas.append(k)
+            else:
+                llaves[llave] = (k, costo)
+        if dominadas:
+            columnas[idx_columnas[dominadas]] = False
+            conteo['columnas_dominadas'] += len(dominadas)
+            cambios += len(dominadas)
+
+        # Filas redundantes: cota superior de la fila con las cotas implícitas de las columnas. Las cotas salen de las
+        # igualdades con coeficientes y lado derecho del mismo signo (como la demanda): a_j x_j <= b. Solo se usan
+        # igualdades, que nunca se eliminan por redundantes
+        idx_filas, idx_columnas = np.where(filas)[0], np.where(columnas)[0]
+        S = A[idx_filas][:, idx_columnas].tocsr()
+        nnz = np.diff(S.indptr)
+        positivos = np.asarray((S > 0).sum(axis=1)).ravel()
+        b_filas = b[idx_filas]
+        acotan = es_eq[idx_filas] & (((positivos == nnz) & (b_filas >= 0)) | ((positivos == 0) & (b_filas <= 0)))
+        cotas = np.full(idx_columnas.shape[0], np.inf)
+        S_acotan = S[acotan].tocoo()
+        np.minimum.at(cotas, S_acotan.col, b_filas[acotan][S_acotan.row] / S_acotan.data)
+        S_pos = S.multiply(S > 0).tocsr()
+        maximo = np.asarray(S_pos @ np.where(np.isfinite(cotas), cotas, 0)).ravel()
+        infinitas = np.asarray(S_pos @ (~np.isfinite(cotas)).astype(float)).ravel() > 0
+        redundantes = ~es_eq[idx_filas] & ~infinitas & (maximo <= b_filas + tolerancia)
+        filas[idx_filas[redundantes]] = False
+        conteo['filas_redundantes'] += int(redundantes.sum())
+        cambios += int(redundantes.sum())
+
+        if cambios == 0:
+            break
+
+    filas_eq, filas_ub = filas & es_eq, filas & ~es_eq
+    A_red = A[:, columnas]
+    reducido = {'c': c[columnas], 'A_eq': A_red[filas_eq], 'b_eq': b[filas_eq], 'A_ub': A_red[filas_ub],
+                'b_ub': b[filas_ub], 'estado': estado, 'filas': filas, 'columnas': columnas, 'x_fijo': x_fijo,
+                'pila': pila, 'A': A, 'c_completo': c, 'es_eq': es_eq, 'conteo': conteo,
+                'tiempo': time.time() - inicio}
+
+    print(f"Presolve: {m_eq + m_ub - int(filas.sum())} de {m_eq + m_ub} filas y {n - int(columnas.sum())} de {n} "
+          f"columnas eliminadas en {pasada + 1} pasadas, {reducido['tiempo']} segundos. Detalle: {conteo}")
+
+    return reducido
+
+
+def recuperar_solucion(reducido, resultado):
+    """
+    Lleva la solución del modelo reducido al modelo completo: valores de todas las actividades y duales de todas las
+    filas, con la convención de solvers.py (d objetivo / d lado derecho).
+    :param reducido: diccionario entregado por reducir_modelo()
+    :param resultado: ResultadoSolver del modelo reducido
+    :return: ResultadoSolver del modelo completo
+    """
+    A, c, es_eq = reducido['A'], reducido['c_completo'], reducido['es_eq']
+    filas, columnas = reducido['filas'], reducido['columnas']
+    m_eq, n = int(es_eq.sum()), c.shape[0]
+    info = dict(resultado.info, presolve=reducido['conteo'])
+    # Los rangos del solver son del modelo reducido, no aplican a las filas y columnas originales
+    info.pop('rangos', None)
+    if resultado.estado != 'optimo':
+        duales = {'eq': np.full(m_eq, np.nan), 'ub': np.full(es_eq.shape[0] - m_eq, np.nan),
+                  'reducidos': np.full(n, np.nan)}
+        return ResultadoSolver(resultado.estado, np.full(n, np.nan), np.nan, duales, resultado.tiempos, info)
+
+    x = reducido['x_fijo'].copy()
+    x[columnas] = resultado.x
+
+    # Duales: filas que quedan en el modelo reducido, 0 en filas vacías o redundantes, y las filas forzadas o singleton
+    # en orden inverso para que los costos reducidos de sus columnas queden no negativos (o 0 si la columna es positiva)
+    y = np.zeros(es_eq.shape[0])
+    y[filas & es_eq] = resultado.duales['eq']
+    y[filas & ~es_eq] = resultado.duales['ub']
+    A_csc = A.tocsc()
+    for tipo, fila, cols in reversed(reducido['pila']):
+        a = np.asarray(A[fila, cols].todense()).ravel()
+        reducidos = c[cols] - A_csc[:, cols].T @ y + a * y[fila]
+        if tipo == 'singleton':
+            y[fila] = reducidos[0] / a[0]
+        elif a[0] > 0:
+            y[fila] = np.min(reducidos / a)
+            if not es_eq[fila]:
+                y[fila] = min(y[fila], 0)
+        else:
+            y[fila] = np.max(reducidos / a)
+
+    duales = {'eq': y[es_eq], 'ub': y[~es_eq], 'reducidos': c - A.T @ y}
+    tiempos = dict(resultado.tiempos)
+    tiempos['compilacion'] = (tiempos['compilacion'] or 0.0) + reducido['tiempo']
+    tiempos['total'] = tiempos['total'] + reducido['tiempo']
+
+    return ResultadoSolver(resultado.estado, x, float(c @ x), duales, tiempos, info)
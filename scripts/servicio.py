@@ -0,0 +1,320 @@
+"""
+Servicio local de optimización. Carga los masters limpios y compila el modelo una sola vez, y queda escuchando por HTTP
+trabajos de escenario: cambios de demanda, producción, capacidades de nodos y tarifas sobre el modelo base. Cada
+trabajo se resuelve en un pool de procesos; cada proceso tiene su propio modelo compilado (modelo.ModeloRed) que
+conserva la última solución, de modo que los trabajos no pagan la carga, limpieza ni construcción del modelo, y con el
+backend 'highspy' arrancan desde la base del trabajo anterior.
+
+Los resultados de cada trabajo se guardan en <salida>/<id>/ (decisión, restricciones y costo mensual), y el estado se
+consulta por HTTP mientras el trabajo está en cola o corriendo.
+
+Rutas:
+    GET  /estado               estado del servicio y del modelo base
+    POST /trabajos             crea un trabajo. Cuerpo JSON, todas las llaves opcionales:
+                               {"nombre": "...",
+                                "demanda": [{"tiempo": 1, "producto": "ADITIVOS", "nodo": "BOGOTA", "valor": 10.5}],
+                                "produccion": [{"tiempo": 1, "producto": "ADITIVOS", "nodo": "MB_PLANT", "valor": 500}],
+                                "capacidades": [{"tiempo": 1, "nodo": "ABOD", "tipo": "capacidad_est", "valor": 500}],
+                                "tarifas": [{"origen": "CGNA_PLANT", "destino": "ABOD", "transporte": 1.0, "costo": 1e5}],
+                                "formato": "csv", "solo_no_cero": true}
+                               Responde 202 con el id del trabajo
+    GET  /trabajos             lista de trabajos con su estado
+    GET  /trabajos/<id>        estado y resumen de un trabajo (costo, estado de la solución, tiempos, archivos)
+
+Uso:
+    python scripts/servicio.py input/ --puerto 8050 --solver highspy --procesos 2
+    curl -X POST localhost:8050/trabajos -d '{"nombre": "tarifa_abod", "tarifas": [...]}'
+    curl localhost:8050/trabajos/<id>
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from creacion_items_actividades import build_items, build_activities, matriz_coef
+from modelo import ModeloRed
+from optimization import df_variables, df_restricciones
+from output import df_costo_mensual, guardar_outputs
+
+SHEET_NAMES = ['master_producto', 'master_ubicaciones', 'master_demanda',
+               'master_tarifario', 'master_red_infraestructura']
+TIPOS_CAMBIO = {'demanda': 'demanda', 'produccion': 'produccion', 'capacidades': None}
+
+# Modelo compilado de cada proceso del pool. Se carga una sola vez con _iniciar_trabajador()
+_MODELO = {}
+
+
+def _iniciar_trabajador(items, actividades, matriz, solver, opciones):
+    """
+    Compila el modelo base en el proceso, y guarda sus valores y costos para volver a ellos antes de cada trabajo.
+    """
+    modelo = ModeloRed(items, actividades, matriz, solver=solver, **opciones)
+    _MODELO.update({'modelo': modelo, 'matriz': matriz, 'valores': modelo.items['valor'].values.copy(),
+                    'costos': modelo.c.copy()})
+
+
+def _listo():
+    """
+    Tarea vacía para arrancar los procesos del pool (y compilar su modelo) antes del primer trabajo.
+    """
+    return os.getpid()
+
+
+def cambios_items(trabajo):
+    """
+    Junta los cambios de demanda, producción y capacidades de un trabajo en la tabla que recibe
+    ModeloRed.actualizar_items().
+    :param trabajo: diccionario del trabajo (cuerpo JSON)
+    :return: pd.DataFrame con columnas 'tiempo', 'producto', 'nodo', 'tipo' y 'valor', o None si no hay cambios
+    """
+    tablas = []
+    for llave, tipo in TIPOS_CAMBIO.items():
+        if not trabajo.get(llave):
+            continue
+        tabla = pd.DataFrame(trabajo[llave])
+        if tipo is not None:
+            tabla['tipo'] = tipo
+        if 'producto' not in tabla.columns:
+            tabla['producto'] = np.nan
+        faltantes = {'tiempo', 'nodo', 'tipo', 'valor'} - set(tabla.columns)
+        if faltantes:
+            raise ValueError(f"Los cambios de '{llave}' no tienen las columnas {sorted(faltantes)}")
+        tablas.append(tabla.loc[:, ['tiempo', 'producto', 'nodo', 'tipo', 'valor']])
+    if not tablas:
+        return None
+    return pd.concat(tablas, ignore_index=True)
+
+
+def correr_trabajo(id_trabajo, trabajo, carpeta_salida):
+    """
+    Resuelve un trabajo en el proceso actual: vuelve el modelo a los valores base, aplica los cambios, resuelve y guarda
+    los resultados en carpeta_salida/id_trabajo/.
+    :param id_trabajo: id del trabajo
+    :param trabajo: diccionario del trabajo (cuerpo JSON, ver la documentación del módulo)
+    :param carpeta_salida: carpeta de resultados del servicio
+    :return: diccionario con el resumen del trabajo
+    """
+    modelo, inicio = _MODELO['modelo'], time.time()
+    modelo.actualizar_vectores(valores=_MODELO['valores'], costos=_MODELO['costos'])
+    items = cambios_items(trabajo)
+    if items is not None:
+        modelo.actualizar_items(items)
+    if trabajo.get('tarifas'):
+        modelo.actualizar_tarifas(pd.DataFrame(trabajo['tarifas']))
+    resultado = modelo.resolver()
+    tiempo_solucion = time.time() - inicio
+
+    resumen = {'estado_solucion': resultado.estado, 'costo': None, 'tiempo_solucion': tiempo_solucion,
+               'iteraciones': resultado.info.get('iteraciones'), 'proceso': os.getpid(), 'archivos': []}
+    if resultado.estado != 'optimo':
+        return resumen
+
+    decision = df_variables(resultado.x, modelo.actividades, resultado)
+    restriccion = df_restricciones(decision, modelo.items.copy(), _MODELO['matriz'], resultado)
+    costo_mensual = df_costo_mensual(decision)
+    carpeta = os.path.join(carpeta_salida, id_trabajo, '')
+    os.makedirs(carpeta, exist_ok=True)
+    nombres = ['decision_consolidado.csv', 'restriccion_consolidado.csv', 'costo_mensual.csv']
+    guardar_outputs([decision, restriccion, costo_mensual], nombres, carpeta, formato=trabajo.get('formato'),
+                    solo_no_cero=trabajo.get('solo_no_cero', False))
+
+    resumen.update({'costo': float(resultado.objetivo), 'archivos': sorted(os.listdir(carpeta)), 'carpeta': carpeta,
+                    'costo_mensual': json.loads(costo_mensual.to_json(orient='records'))})
+    return resumen
+
+
+class Servicio:
+    """
+    Masters, modelo base y pool de trabajadores del servicio, con el registro de trabajos.
+    """
+
+    def __init__(self, DATASETS, solver='highspy', procesos=1, carpeta_salida='output/servicio/', **opciones):
+        """
+        :param DATASETS: diccionario con los masters limpios
+        :param solver: backend de solución (ver solvers.BACKENDS). Con 'highspy' cada trabajo arranca desde la base del
+        anterior en el mismo proceso
+        :param procesos: trabajos que se resuelven a la vez, cada uno con su modelo compilado
+        :param carpeta_salida: carpeta donde se guardan los resultados de los trabajos
+        :param opciones: opciones adicionales que se pasan al backend
+        """
+        inicio = time.time()
+        self.data = DATASETS
+        self.items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
+                                 DATASETS['master_demanda'], DATASETS['master_producto'])
+        self.actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
+                                            DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
+        self.matriz = matriz_coef(self.items, self.actividades)
+        self.solver, self.procesos, self.carpeta_salida = solver, procesos, carpeta_salida
+        os.makedirs(carpeta_salida, exist_ok=True)
+
+        # Los procesos compilan el modelo al arrancar. Se envía una tarea vacía por proceso para que queden listos
+        self.pool = ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador,
+                                        initargs=(self.items, self.actividades, self.matriz, solver, opciones))
+        for tarea in [self.pool.submit(_listo) for _ in range(procesos)]:
+            tarea.result()
+        self.trabajos, self._futuros = {}, {}
+        self._candado = threading.Lock()
+        self.tiempo_arranque = time.time() - inicio
+        print(f"Servicio listo en {self.tiempo_arranque} segundos: {self.items.shape[0]} items, "
+              f"{self.actividades.shape[0]} actividades, {procesos} procesos con {solver}")
+
+    def crear_trabajo(self, trabajo):
+        """
+        Registra un trabajo y lo envía al pool.
+        :param trabajo: diccionario del trabajo (cuerpo JSON)
+        :return: id del trabajo
+        """
+        # Validar antes de encolar, para responder el error de inmediato
+        if not isinstance(trabajo, dict):
+            raise TypeError(f"El trabajo debe ser un objeto JSON, no {type(trabajo).__name__}")
+        cambios_items(trabajo)
+        id_trabajo = datetime.now().strftime('%Y%m%d_%H%M%S_') + uuid.uuid4().hex[:6]
+        with self._candado:
+            self.trabajos[id_trabajo] = {'id': id_trabajo, 'nombre': trabajo.get('nombre'), 'estado': 'en_cola',
+                                         'creado': datetime.now().isoformat(timespec='seconds'), 'terminado': None,
+                                         'resumen': None, 'error': None}
+            futuro = self.pool.submit(correr_trabajo, id_trabajo, trabajo, self.carpeta_salida)
+            self._futuros[id_trabajo] = futuro
+        # Fuera del candado: si el trabajo ya terminó, el callback corre en este hilo y toma el candado
+        futuro.add_done_callback(lambda f: self._terminar(id_trabajo, f))
+        return id_trabajo
+
+    def _terminar(self, id_trabajo, futuro):
+        """
+        Guarda el resultado de un trabajo cuando termina.
+        """
+        with self._candado:
+            registro = self.trabajos[id_trabajo]
+            registro['terminado'] = datetime.now().isoformat(timespec='seconds')
+            self._futuros.pop(id_trabajo, None)
+            try:
+                registro['resumen'] = futuro.result()
+                registro['estado'] = 'terminado'
+            except Exception as error:
+                registro['estado'] = 'error'
+                registro['error'] = f"{type(error).__name__}: {error}"
+                print(f"Trabajo {id_trabajo} falló:\n{''.join(traceback.format_exception_only(type(error), error))}")
+
+    def consultar(self, id_trabajo=None):
+        """
+        :param id_trabajo: id del trabajo, o None para todos
+        :return: registro del trabajo, lista de registros (sin el resumen), o None si el id no existe
+        """
+        with self._candado:
+            # El pool no avisa cuándo empieza una tarea: un trabajo en cola que ya pasó a un proceso está corriendo
+            for id_futuro, futuro in self._futuros.items():
+                if futuro.running() and self.trabajos[id_futuro]['estado'] == 'en_cola':
+                    self.trabajos[id_futuro]['estado'] = 'corriendo'
+            if id_trabajo is None:
+                return [{llave: valor for llave, valor in registro.items() if llave != 'resumen'}
+                        for registro in self.trabajos.values()]
+            registro = self.trabajos.get(id_trabajo)
+            return None if registro is None else dict(registro)
+
+    def estado(self):
+        """
+        :return: diccionario con el estado del servicio
+        """
+        with self._candado:
+            conteo = pd.Series([registro['estado'] for registro in self.trabajos.values()], dtype=object)
+        return {'items': int(self.items.shape[0]), 'actividades': int(self.actividades.shape[0]),
+                'no_nulos': int(self.matriz.nnz), 'solver': self.solver, 'procesos': self.procesos,
+                'tiempo_arranque': self.tiempo_arranque, 'trabajos': conteo.value_counts().to_dict()}
+
+    def cerrar(self):
+        self.pool.shutdown(wait=True)
+
+
+def _manejador(servicio):
+    """
+    Crea la clase que atiende las rutas HTTP del servicio.
+    """
+
+    class Manejador(BaseHTTPRequestHandler):
+
+        def _responder(self, codigo, cuerpo):
+            datos = json.dumps(cuerpo, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(codigo)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            partes = [parte for parte in self.path.split('?')[0].split('/') if parte]
+            if partes == ['estado']:
+                self._responder(200, servicio.estado())
+            elif partes == ['trabajos']:
+                self._responder(200, servicio.consultar())
+            elif len(partes) == 2 and partes[0] == 'trabajos':
+                registro = servicio.consultar(partes[1])
+                if registro is None:
+                    self._responder(404, {'error': f'No existe el trabajo {partes[1]}'})
+                else:
+                    self._responder(200, registro)
+            else:
+                self._responder(404, {'error': f'Ruta {self.path} no existe'})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/trabajos':
+                self._responder(404, {'error': f'Ruta {self.path} no existe'})
+                return
+            try:
+                largo = int(self.headers.get('Content-Length', 0))
+                trabajo = json.loads(self.rfile.read(largo) or b'{}')
+                id_trabajo = servicio.crear_trabajo(trabajo)
+            except (ValueError, TypeError) as error:
+                self._responder(400, {'error': f"{type(error).__name__}: {error}"})
+                return
+            self._responder(202, {'id': id_trabajo, 'estado': f'/trabajos/{id_trabajo}'})
+
+        def log_message(self, formato, *args):
+            print(f"{self.address_string()} - {formato % args}")
+
+    return Manejador
+
+
+def servir(servicio, puerto=8050, host='127.0.0.1'):
+    """
+    Atiende HTTP hasta que se interrumpa el proceso (Ctrl+C).
+    :param servicio: Servicio
+    :param puerto: puerto HTTP
+    :param host: dirección en la que escucha. Por defecto solo el mismo computador
+    """
+    servidor = ThreadingHTTPServer((host, puerto), _manejador(servicio))
+    print(f"Servicio escuchando en http://{host}:{puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
+
+
+if __name__ == '__main__':
+    from limpieza_masters import limpieza_data
+
+    parser = argparse.ArgumentParser(description='Servicio local de optimización con el modelo en memoria')
+    parser.add_argument('masters', nargs='?', default='input/',
+                        help='datamaster (.xlsx) o carpeta con los masters limpios en .csv')
+    parser.add_argument('--puerto', type=int, default=8050)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--solver', default='highspy', help='backend de solución (ver solvers.BACKENDS)')
+    parser.add_argument('--procesos', type=int, default=1, help='trabajos que se resuelven a la vez')
+    parser.add_argument('--salida', default='output/servicio/', help='carpeta de resultados de los trabajos')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.masters):
+        data = {nombre: pd.read_csv(os.path.join(args.masters, nombre + '.csv')) for nombre in SHEET_NAMES}
+    else:
+        data = limpieza_data(args.masters, SHEET_NAMES)
+    servir(Servicio(data, solver=args.solver, procesos=args.procesos, carpeta_salida=args.salida),
+           puerto=args.puerto, host=args.host)
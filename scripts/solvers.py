@@ -0,0 +1,362 @@
+"""
+En este script se encuentran los backends que resuelven el modelo lineal de la red de distribución. Todos reciben el
+modelo en forma matricial (c, A_eq, b_eq, A_ub, b_ub), con X >= 0, y retornan el mismo registro `ResultadoSolver`, de
+forma que se pueda escoger el motor más rápido para cada instancia sin cambiar el resto de la herramienta.
+
+Backends disponibles:
+    - 'glpk': GLPK simplex a través de CVXPY (comportamiento original de la herramienta)
+    - 'highs', 'highs-ds', 'highs-ipm': HiGHS (automático, simplex dual, punto interior) vía scipy.optimize.linprog
+    - 'highspy': HiGHS directo con highspy (dependencia opcional), que permite fijar hilos y reusar la base
+    - 'cvxopt': punto interior de CVXOPT, directo sobre las matrices
+    - 'cvxopt-glpk': GLPK simplex llamado directamente desde CVXOPT, sin pasar por CVXPY
+
+Convención de duales: `duales['eq']` y `duales['ub']` son las sensibilidades del costo óptimo al lado derecho de cada
+restricción (d objetivo / d b), y `duales['reducidos']` son los costos reducidos de cada actividad (d objetivo / d cota
+inferior de X).
+
+Con el backend 'highspy' y la opción `rangos=True`, info['rangos'] trae el análisis de sensibilidad de HiGHS: para cada
+fila (primero igualdades y luego desigualdades) el intervalo del lado derecho en el que su dual se mantiene, y para cada
+actividad el intervalo de costo en el que la solución se mantiene óptima.
+
+Para un modelo persistente, que se vuelve a resolver después de cambiar costos o lados derechos (modelo.ModeloRed),
+modelo_highspy carga el modelo en un objeto highspy.Highs y resolver_modelo_highspy lo resuelve y retorna el
+ResultadoSolver.
+"""
+import time
+from collections import namedtuple
+import numpy as np
+import scipy.sparse as sp
+
+ResultadoSolver = namedtuple('ResultadoSolver', ['estado', 'x', 'objetivo', 'duales', 'tiempos', 'info'])
+
+BACKENDS = ['glpk', 'highs', 'highs-ds', 'highs-ipm', 'highspy', 'cvxopt', 'cvxopt-glpk']
+
+
+def _resultado_vacio(estado, n, m_eq, m_ub, tiempos, info):
+    """
+    Construye un ResultadoSolver sin solución, para los casos infactibles, no acotados o con error.
+    """
+    duales = {'eq': np.full(m_eq, np.nan), 'ub': np.full(m_ub, np.nan), 'reducidos': np.full(n, np.nan)}
+    return ResultadoSolver(estado, np.full(n, np.nan), np.nan, duales, tiempos, info)
+
+
+def _resolver_glpk_cvxpy(c, A_eq, b_eq, A_ub, b_ub, verbose=True, **opciones):
+    """
+    Resuelve el modelo con GLPK a través de CVXPY, declarando las restricciones en dos bloques.
+    """
+    import cvxpy as cp
+
+    inicio = time.time()
+    X = cp.Variable(c.shape)
+    restriccion_x = X >= 0
+    restriccion_eq = A_eq @ X == b_eq if A_eq.shape[0] > 0 else None
+    restriccion_ub = A_ub @ X <= b_ub if A_ub.shape[0] > 0 else None
+    restricciones = [r for r in [restriccion_x, restriccion_eq, restriccion_ub] if r is not None]
+    prob = cp.Problem(cp.Minimize(c @ X), restricciones)
+
+    try:
+        prob.solve(solver=cp.GLPK, verbose=verbose, **opciones)
+    except cp.SolverError as error:
+        tiempos = {'compilacion': np.nan, 'solucion': np.nan, 'total': time.time() - inicio}
+        return _resultado_vacio('error', c.shape[0], A_eq.shape[0], A_ub.shape[0], tiempos,
+                                {'backend': 'glpk', 'iteraciones': None, 'mensaje': str(error)})
+
+    total = time.time() - inicio
+    compilacion = getattr(prob, 'compilation_time', None)
+    solucion = prob.solver_stats.solve_time if prob.solver_stats is not None else None
+    if solucion is None and compilacion is not None:
+        solucion = total - compilacion
+    tiempos = {'compilacion': compilacion, 'solucion': solucion, 'total': total}
+    info = {'backend': 'glpk', 'iteraciones': getattr(prob.solver_stats, 'num_iters', None), 'mensaje': prob.status}
+
+    estados = {cp.OPTIMAL: 'optimo', cp.OPTIMAL_INACCURATE: 'optimo', cp.INFEASIBLE: 'infactible',
+               cp.INFEASIBLE_INACCURATE: 'infactible', cp.UNBOUNDED: 'no_acotado',
+               cp.UNBOUNDED_INACCURATE: 'no_acotado'}
+    estado = estados.get(prob.status, 'error')
+    if estado != 'optimo':
+        return _resultado_vacio(estado, c.shape[0], A_eq.shape[0], A_ub.shape[0], tiempos, info)
+
+    # En CVXPY el dual de `A @ X == b` y `A @ X <= b` tiene el signo contrario a d objetivo / d b
+    duales = {'eq': -np.asarray(restriccion_eq.dual_value).ravel() if restriccion_eq is not None else np.array([]),
+              'ub': -np.asarray(restriccion_ub.dual_value).ravel() if restriccion_ub is not None else np.array([]),
+              'reducidos': np.asarray(restriccion_x.dual_value).ravel()}
+
+    return ResultadoSolver(estado, np.asarray(X.value).ravel(), prob.value, duales, tiempos, info)
+
+
+def _resolver_highs(c, A_eq, b_eq, A_ub, b_ub, metodo='highs', verbose=False, tiempo_limite=None, **opciones):
+    """
+    Resuelve el modelo con HiGHS a través de scipy.optimize.linprog. Las matrices dispersas se pasan directamente.
+    """
+    from scipy.optimize import linprog
+
+    inicio = time.time()
+    opciones_highs = {'disp': verbose}
+    if tiempo_limite is not None:
+        opciones_highs['time_limit'] = tiempo_limite
+    opciones_highs.update(opciones)
+
+    res = linprog(c,
+                  A_ub=A_ub if A_ub.shape[0] > 0 else None, b_ub=b_ub if A_ub.shape[0] > 0 else None,
+                  A_eq=A_eq if A_eq.shape[0] > 0 else None, b_eq=b_eq if A_eq.shape[0] > 0 else None,
+                  bounds=(0, None), method=metodo, options=opciones_highs)
+    total = time.time() - inicio
+
+    # linprog no separa compilación de solución, y no hay compilación de modelo como tal
+    tiempos = {'compilacion': 0.0, 'solucion': total, 'total': total}
+    info = {'backend': metodo, 'iteraciones': getattr(res, 'nit', None), 'mensaje': res.message}
+
+    estados = {0: 'optimo', 1: 'limite', 2: 'infactible', 3: 'no_acotado'}
+    estado = estados.get(res.status, 'error')
+    if estado != 'optimo':
+        return _resultado_vacio(estado, c.shape[0], A_eq.shape[0], A_ub.shape[0], tiempos, info)
+
+    duales = {'eq': res.eqlin.marginals if A_eq.shape[0] > 0 else np.array([]),
+              'ub': res.ineqlin.marginals if A_ub.shape[0] > 0 else np.array([]),
+              'reducidos': res.lower.marginals}
+
+    return ResultadoSolver(estado, res.x, res.fun, duales, tiempos, info)
+
+
+def modelo_highspy(c, A_eq, b_eq, A_ub, b_ub, verbose=False, tiempo_limite=None, hilos=None, **opciones):
+    """
+    Carga el modelo en un objeto highspy.Highs. Las filas de igualdad van primero y luego las de desigualdad. El objeto
+    se puede conservar para volver a resolver después de cambiar costos o lados derechos: HiGHS arranca desde la base
+    de la solución anterior.
+
+    :param hilos: número de hilos que puede usar HiGHS
+    :return: highspy.Highs con el modelo cargado
+    """
+    import highspy
+
+    A = sp.vstack([sp.csr_matrix(A_eq), sp.csr_matrix(A_ub)]).tocsc()
+    n = c.shape[0]
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = n
+    lp.num_row_ = A.shape[0]
+    lp.col_cost_ = np.asarray(c, dtype=float)
+    lp.col_lower_ = np.zeros(n)
+    lp.col_upper_ = np.full(n, highspy.kHighsInf)
+    lp.row_lower_ = np.concatenate([b_eq, np.full(b_ub.shape[0], -highspy.kHighsInf)]).astype(float)
+    lp.row_upper_ = np.concatenate([b_eq, b_ub]).astype(float)
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', verbose)
+    if tiempo_limite is not None:
+        h.setOptionValue('time_limit', float(tiempo_limite))
+    if hilos is not None:
+        h.setOptionValue('threads', int(hilos))
+    for opcion, valor in opciones.items():
+        h.setOptionValue(opcion, valor)
+    h.passModel(lp)
+
+    return h
+
+
+def _rangos_highspy(h, m, n):
+    """
+    Análisis de sensibilidad (ranging) de HiGHS sobre la última solución. Solo existe cuando la solución tiene base
+    (simplex), así que retorna None si HiGHS no lo puede calcular.
+
+    Los intervalos de las filas son de su lado derecho. HiGHS solo los entrega así para las filas no básicas (activas);
+    en una fila básica describen su nivel de actividad. Por eso, en las filas básicas de desigualdad (con holgura) el
+    intervalo es [actividad, +inf): el dual se mantiene en cero mientras el lado derecho no baje de la actividad. En una
+    fila básica de igualdad (degenerada) el intervalo queda en el lado derecho.
+    :param m: número de filas del modelo
+    :param n: número de columnas del modelo
+    :return: diccionario con los intervalos del lado derecho de las filas ('fila_inferior', 'fila_superior') y de los
+    costos de las actividades ('costo_inferior', 'costo_superior')
+    """
+    import highspy
+
+    estado, rangos = h.getRanging()
+    if not rangos.valid:
+        return None
+    inferior = np.array(rangos.row_bound_dn.value_)[:m]
+    superior = np.array(rangos.row_bound_up.value_)[:m]
+
+    basicas = np.array([estado_fila == highspy.HighsBasisStatus.kBasic for estado_fila in h.getBasis().row_status])[:m]
+    actividad = np.array(h.getSolution().row_value)[:m]
+    lp = h.getLp()
+    cota_inferior, cota_superior = np.array(lp.row_lower_)[:m], np.array(lp.row_upper_)[:m]
+    igualdad = cota_inferior == cota_superior
+    desigualdad = basicas & ~igualdad
+    inferior[desigualdad], superior[desigualdad] = actividad[desigualdad], np.inf
+    inferior[basicas & igualdad], superior[basicas & igualdad] = cota_superior[basicas & igualdad], \
+        cota_superior[basicas & igualdad]
+
+    # HiGHS entrega los rangos de costo también para las holguras de las filas, que van después de las columnas
+    return {'fila_inferior': inferior, 'fila_superior': superior,
+            'costo_inferior': np.array(rangos.col_cost_dn.value_)[:n],
+            'costo_superior': np.array(rangos.col_cost_up.value_)[:n]}
+
+
+def resolver_modelo_highspy(h, m_eq, m_ub, compilacion=0.0, rangos=False):
+    """
+    Resuelve un modelo cargado con modelo_highspy() y extrae el ResultadoSolver.
+    :param rangos: si es True, agrega el análisis de sensibilidad en info['rangos'] (ver _rangos_highspy)
+    """
+    import highspy
+
+    inicio = time.time()
+    h.run()
+    solucion = time.time() - inicio
+    n = h.getNumCol()
+
+    tiempos = {'compilacion': compilacion, 'solucion': solucion, 'total': compilacion + solucion}
+    info_highs = h.getInfo()
+    info = {'backend': 'highspy', 'iteraciones': info_highs.simplex_iteration_count + info_highs.ipm_iteration_count,
+            'mensaje': h.modelStatusToString(h.getModelStatus())}
+
+    estados = {highspy.HighsModelStatus.kOptimal: 'optimo', highspy.HighsModelStatus.kInfeasible: 'infactible',
+               highspy.HighsModelStatus.kUnbounded: 'no_acotado', highspy.HighsModelStatus.kTimeLimit: 'limite',
+               highspy.HighsModelStatus.kIterationLimit: 'limite'}
+    estado = estados.get(h.getModelStatus(), 'error')
+    if estado != 'optimo':
+        return _resultado_vacio(estado, n, m_eq, m_ub, tiempos, info)
+
+    solucion_highs = h.getSolution()
+    duales_filas = np.array(solucion_highs.row_dual)
+    duales = {'eq': duales_filas[:m_eq], 'ub': duales_filas[m_eq:m_eq + m_ub],
+              'reducidos': np.array(solucion_highs.col_dual)[:n]}
+    if rangos:
+        info['rangos'] = _rangos_highspy(h, m_eq + m_ub, n)
+
+    return ResultadoSolver(estado, np.array(solucion_highs.col_value)[:n], info_highs.objective_function_value,
+                           duales, tiempos, info)
+
+
+def _resolver_highspy(c, A_eq, b_eq, A_ub, b_ub, rangos=False, **opciones):
+    """
+    Resuelve el modelo directamente con highspy, sin pasar por scipy. Permite fijar el número de hilos de HiGHS y pedir
+    el análisis de sensibilidad con `rangos=True`.
+    """
+    inicio = time.time()
+    h = modelo_highspy(c, A_eq, b_eq, A_ub, b_ub, **opciones)
+    return resolver_modelo_highspy(h, A_eq.shape[0], A_ub.shape[0], compilacion=time.time() - inicio, rangos=rangos)
+
+
+def _spmatrix_cvxopt(matriz):
+    """
+    Convierte una matriz scipy.sparse a cvxopt.spmatrix.
+    """
+    from cvxopt import spmatrix
+
+    matriz = sp.coo_matrix(matriz)
+    return spmatrix(matriz.data.tolist(), matriz.row.tolist(), matriz.col.tolist(), size=matriz.shape)
+
+
+def _escala(valores):
+    """
+    Factor de escala de una magnitud máxima (o de un arreglo de ellas): las magnitudes nulas o no finitas, como las de
+    las filas vacías, quedan con factor 1.
+    """
+    valores = np.where(np.isfinite(valores) & (valores > 0), valores, 1.0)
+    return valores if np.ndim(valores) else float(valores)
+
+
+def _resolver_cvxopt(c, A_eq, b_eq, A_ub, b_ub, solver=None, verbose=False, **opciones):
+    """
+    Resuelve el modelo directamente con cvxopt.solvers.lp. Con `solver=None` usa el punto interior de CVXOPT, y con
+    `solver='glpk'` llama GLPK desde CVXOPT. La no negatividad de X se agrega como bloque -I en G.
+    """
+    from cvxopt import matrix, solvers
+
+    inicio = time.time()
+    n, m_eq, m_ub = c.shape[0], A_eq.shape[0], A_ub.shape[0]
+    backend = 'cvxopt-glpk' if solver == 'glpk' else 'cvxopt'
+
+    # El punto interior de CVXOPT exige que A tenga rango completo, así que se quitan las filas vacías de A_eq. Si una
+    # fila vacía tiene lado derecho diferente a cero, el problema es infactible
+    A_eq = sp.csr_matrix(A_eq)
+    filas_eq = np.diff(A_eq.indptr) > 0
+    if np.any(np.abs(b_eq[~filas_eq]) > 1e-9):
+        tiempos = {'compilacion': 0.0, 'solucion': 0.0, 'total': time.time() - inicio}
+        return _resultado_vacio('infactible', n, m_eq, m_ub, tiempos,
+                                {'backend': backend, 'iteraciones': None, 'mensaje': 'fila de igualdad vacía'})
+
+    # El punto interior no escala el problema, y con costos del orden de 1e6 y coeficientes entre 1e-3 y 1e4 termina
+    # reportando infactibilidad dual. Se divide c por su mayor magnitud y cada fila por su mayor coeficiente; X no
+    # cambia y los duales se devuelven a la escala original al final. GLPK escala por su cuenta
+    A_ub = sp.csr_matrix(A_ub)
+    escala_c, escala_eq, escala_ub = 1.0, np.ones(m_eq), np.ones(m_ub)
+    if solver != 'glpk':
+        escala_c = _escala(np.abs(c).max()) if n else 1.0
+        escala_eq = 1 / _escala(abs(A_eq).max(axis=1).toarray().ravel())
+        escala_ub = 1 / _escala(abs(A_ub).max(axis=1).toarray().ravel())
+
+    G = sp.vstack([sp.diags(escala_ub) @ A_ub, -sp.identity(n, format='csr')]).tocsr()
+    h = np.concatenate([b_ub * escala_ub, np.zeros(n)])
+    argumentos = {'c': matrix(c / escala_c), 'G': _spmatrix_cvxopt(G), 'h': matrix(h)}
+    if filas_eq.any():
+        argumentos['A'] = _spmatrix_cvxopt((sp.diags(escala_eq) @ A_eq).tocsr()[filas_eq])
+        argumentos['b'] = matrix((b_eq * escala_eq)[filas_eq])
+    compilacion = time.time() - inicio
+
+    solvers.options['show_progress'] = verbose
+    solvers.options.update(opciones)
+    if solver == 'glpk':
+        solvers.options['glpk'] = {'msg_lev': 'GLP_MSG_ON' if verbose else 'GLP_MSG_OFF'}
+    try:
+        sol = solvers.lp(solver=solver, **argumentos)
+    except (ValueError, ArithmeticError) as error:
+        tiempos = {'compilacion': compilacion, 'solucion': np.nan, 'total': time.time() - inicio}
+        return _resultado_vacio('error', n, m_eq, m_ub, tiempos,
+                                {'backend': backend, 'iteraciones': None, 'mensaje': str(error)})
+    total = time.time() - inicio
+
+    tiempos = {'compilacion': compilacion, 'solucion': total - compilacion, 'total': total}
+    info = {'backend': backend, 'iteraciones': sol.get('iterations'), 'mensaje': sol['status']}
+
+    # Los certificados de infactibilidad del punto interior no son confiables en estos modelos (ver arriba), así que
+    # cualquier estado diferente a 'optimal' se reporta como error con el mensaje del solver
+    estados = {'optimal': 'optimo'}
+    if solver == 'glpk':
+        estados.update({'primal infeasible': 'infactible', 'dual infeasible': 'no_acotado'})
+    estado = estados.get(sol['status'], 'error')
+    if estado != 'optimo':
+        return _resultado_vacio(estado, n, m_eq, m_ub, tiempos, info)
+
+    # Con el Lagrangiano de CVXOPT, c'x + y'(Ax - b) + z'(Gx - h), d objetivo / d b = -y y d objetivo / d h = -z. En
+    # el problema escalado el objetivo está dividido por escala_c y cada lado derecho multiplicado por su escala
+    duales_eq = np.zeros(m_eq)
+    if filas_eq.any():
+        duales_eq[filas_eq] = -np.array(sol['y']).ravel()
+    z = np.array(sol['z']).ravel()
+    duales = {'eq': duales_eq * escala_eq * escala_c, 'ub': -z[:m_ub] * escala_ub * escala_c,
+              'reducidos': z[m_ub:] * escala_c}
+    x = np.array(sol['x']).ravel()
+
+    return ResultadoSolver(estado, x, float(c @ x), duales, tiempos, info)
+
+
+def resolver(c, A_eq, b_eq, A_ub, b_ub, backend='glpk', **opciones):
+    """
+    Resuelve min c'X s.a. A_eq @ X == b_eq, A_ub @ X <= b_ub, X >= 0 con el backend indicado. Las opciones adicionales
+    se pasan al backend (por ejemplo `verbose` o `tiempo_limite` para HiGHS).
+
+    :param c: np.array de costos de las actividades
+    :param A_eq: matriz (scipy.sparse) de restricciones de igualdad
+    :param b_eq: np.array con lado derecho de las restricciones de igualdad
+    :param A_ub: matriz (scipy.sparse) de restricciones de desigualdad
+    :param b_ub: np.array con lado derecho de las restricciones de desigualdad
+    :param backend: uno de BACKENDS
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info)
+    """
+    if backend == 'glpk':
+        return _resolver_glpk_cvxpy(c, A_eq, b_eq, A_ub, b_ub, **opciones)
+    elif backend in ['highs', 'highs-ds', 'highs-ipm']:
+        return _resolver_highs(c, A_eq, b_eq, A_ub, b_ub, metodo=backend, **opciones)
+    elif backend == 'highspy':
+        return _resolver_highspy(c, A_eq, b_eq, A_ub, b_ub, **opciones)
+    elif backend == 'cvxopt':
+        return _resolver_cvxopt(c, A_eq, b_eq, A_ub, b_ub, **opciones)
+    elif backend == 'cvxopt-glpk':
+        return _resolver_cvxopt(c, A_eq, b_eq, A_ub, b_ub, solver='glpk', **opciones)
+    else:
+        raise ValueError(f"Backend {backend} no reconocido. Opciones: {BACKENDS}")
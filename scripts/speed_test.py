@@ -1,12 +1,55 @@
 from creacion_items_actividades import *
+from optimization import matrices_modelo, optimizacion
+from flujo_red import optimizacion_flujo
+from solvers import resolver
+from perfilado import RegistroEjecucion
+from limpieza_masters import leer_excel
+import scipy.sparse as sp
 import numpy as np
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
 import time
 
+# Escalas de los masters sintéticos. 'grande' es del tamaño del master real (12 meses, 47 familias, ~50 mil actividades)
+ESCALAS = {
+    'pequena': {'meses': 2, 'familias': 3, 'ciudades': 20, 'cedis': 3, 'tarifas_por_ciudad': 2},
+    'mediana': {'meses': 6, 'familias': 10, 'ciudades': 60, 'cedis': 5, 'tarifas_por_ciudad': 3},
+    'grande': {'meses': 12, 'familias': 47, 'ciudades': 45, 'cedis': 8, 'tarifas_por_ciudad': 2,
+               'densidad_demanda': 0.3},
+    'muy_grande': {'meses': 24, 'familias': 60, 'ciudades': 150, 'cedis': 12, 'tarifas_por_ciudad': 4},
+}
+CARPETA_BENCHMARK = 'output/benchmark/'
+
+
+def matrices_iguales(matriz_a, matriz_b):
+    """
+    Compara dos matrices de coeficientes que pueden ser densas (np.array) o dispersas (scipy.sparse). La comparación
+    se hace sin convertir la matriz dispersa a densa cuando ambas son dispersas.
+
+    :param matriz_a: np.array o scipy.sparse
+    :param matriz_b: np.array o scipy.sparse
+    :return: True si tienen la misma dimensión y los mismos valores
+    """
+    if matriz_a.shape != matriz_b.shape:
+        return False
+    if sp.issparse(matriz_a) and sp.issparse(matriz_b):
+        return (matriz_a != matriz_b).nnz == 0
+    if sp.issparse(matriz_a):
+        matriz_a = matriz_a.toarray()
+    if sp.issparse(matriz_b):
+        matriz_b = matriz_b.toarray()
+    return np.array_equal(matriz_a, matriz_b)
+
 
 def matriz_test(df_items, df_actividades, funcs, n_iters=10):
     """
     Testea qué funciones de creación de matrices son más rapidas, a través de la realización de n_iters, para luego
-    entregar el tiempo promedio de ejecución. También compara que los resultados de las funciones sean idénticos.
+    entregar el tiempo promedio de ejecución. También compara que los resultados de las funciones sean idénticos, así
+    una función entregue la matriz dispersa y la otra densa.
 
     :param funcs: lista de funciones a testear
     """
@@ -14,40 +57,337 @@ def matriz_test(df_items, df_actividades, funcs, n_iters=10):
     matrices = []
 
     for func in funcs:
-        times_dict[func] = []
+        times_dict[func.__name__] = []
         for i in range(n_iters):
             init_time = time.time()
             if i == 0:
                 matrices.append(func(df_items, df_actividades))
             else:
                 func(df_items, df_actividades)
-            times_dict[func].append(time.time() - init_time)
+            times_dict[func.__name__].append(time.time() - init_time)
 
         # Calcular promedio
-        times_dict[func] = sum(times_dict[func]) / n_iters
-    print("\nLas matrices son %d" % (np.array_equal(matrices[0], matrices[1])))
+        times_dict[func.__name__] = sum(times_dict[func.__name__]) / n_iters
+    print("\nLas matrices son %d" % (matrices_iguales(matrices[0], matrices[1])))
     return times_dict
 
 
-if __name__ == '__main__':
-    # Abrir tests
+def solver_test(df_items, df_actividades, matriz, backends, **opciones):
+    """
+    Resuelve el mismo modelo con cada backend de `backends` y entrega el estado, costo óptimo, iteraciones y tiempos de
+    cada uno, para escoger el motor más rápido por instancia.
+
+    :param backends: lista de backends de solvers.BACKENDS
+    :return: pd.DataFrame con una fila por backend
+    """
+    c, A_eq, b_eq, A_ub, b_ub, _ = matrices_modelo(df_items, df_actividades, matriz)
+    filas = []
+    for backend in backends:
+        resultado = resolver(c, A_eq, b_eq, A_ub, b_ub, backend=backend, **opciones)
+        filas.append({'backend': backend, 'estado': resultado.estado, 'objetivo': resultado.objetivo,
+                      'iteraciones': resultado.info['iteraciones'], **resultado.tiempos})
+    return pd.DataFrame(filas)
+
+
+def flujo_test(df_items, df_actividades, matriz, backends=('glpk',), n_iters=3):
+    """
+    Compara el motor de flujo a costo mínimo (flujo_red.py) contra backends de programación lineal, con el tiempo
+    promedio de `n_iters` ejecuciones y la diferencia de costo contra el primer backend.
+
+    :param backends: backends de solvers.BACKENDS contra los que se compara
+    :return: pd.DataFrame con una fila por motor
+    """
+    motores = [('flujo', lambda: optimizacion_flujo(df_items, df_actividades, matriz))]
+    motores += [(backend, lambda backend=backend: optimizacion(df_items, df_actividades, matriz, solver=backend))
+                for backend in backends]
+    filas = []
+    for nombre, motor in motores:
+        tiempos = []
+        for i in range(n_iters):
+            init_time = time.time()
+            resultado = motor()
+            tiempos.append(time.time() - init_time)
+        filas.append({'motor': nombre, 'estado': resultado.estado, 'objetivo': resultado.objetivo,
+                      'respaldo': resultado.info.get('respaldo'), 'tiempo': sum(tiempos) / n_iters})
+    filas = pd.DataFrame(filas)
+    # La fila 0 es el motor de flujo; la referencia es el primer backend de programación lineal
+    filas['diferencia_objetivo'] = filas['objetivo'] - (filas['objetivo'].iloc[1] if len(backends) else np.nan)
+    return filas
+
+
+def generar_masters(meses=12, familias=10, ciudades=50, cedis=5, plantas=2, tarifas_por_ciudad=3,
+                    densidad_demanda=0.5, densidad_red=0.5, vehiculos=(4.5, 8.5, 17.0, 34.0), capacidad_din=1e7,
+                    fraccion_din=0.3, capacidad_est=1e7, produccion_max=99999, semilla=0):
+    """
+    Genera masters sintéticos con las mismas columnas que los masters limpios (salida de limpieza_masters), para medir
+    la herramienta a distintas escalas. Cada dimensión se escala por separado:
+        - meses y familias: pares (fecha, familia) de la demanda
+        - ciudades: clientes, cada uno con tarifas desde `tarifas_por_ciudad` CEDIs
+        - cedis, plantas y densidad_red: nodos y arcos de master_red_infraestructura
+        - vehiculos: capacidades del tarifario, una tarifa por arco y vehículo
+        - capacidad_din (en una fracción `fraccion_din` de los CEDIs), capacidad_est y produccion_max: con valores
+          bajos las filas de capacidad y producción quedan activas
+
+    Todas las plantas llegan a todos los CEDIs y todos los CEDIs pueden atender clientes, así que con las capacidades
+    por defecto el modelo siempre es factible.
+
+    :param semilla: semilla de números aleatorios, para que el benchmark sea reproducible
+    :return: diccionario con los cinco masters
+    """
+    rng = np.random.RandomState(semilla)
+    nombres_plantas = [f'PLANTA_{i + 1}' for i in range(plantas)]
+    nombres_cedis = [f'CEDI_{i + 1}' for i in range(cedis)]
+    nombres_ciudades = [f'CIUDAD_{i + 1}' for i in range(ciudades)]
+    nombres_familias = [f'FAMILIA_{i + 1}' for i in range(familias)]
+    posicion = {nodo: rng.uniform(0, 1000, 2) for nodo in nombres_plantas + nombres_cedis + nombres_ciudades}
+
+    # Ubicaciones: los CEDIs almacenan, y algunos tienen capacidad dinámica
+    master_ubicaciones = pd.DataFrame({
+        'id_locacion': nombres_plantas + nombres_cedis,
+        'locacion': nombres_plantas + nombres_cedis,
+        'capacidad_din': [np.nan] * plantas + list(np.where(rng.rand(cedis) < fraccion_din, capacidad_din, np.nan)),
+        'capacidad_est': [np.nan] * plantas + [capacidad_est] * cedis,
+        'Costo Fijo Mensual Operación': np.nan,
+        'costo_almacenamiento': [np.nan] * plantas + list(rng.uniform(10000, 40000, cedis).round()),
+        'id_ciudad': nombres_plantas + nombres_cedis,
+        'abre/cierra': 1.0})
+
+    # Red: plantas a todos los CEDIs, CEDIs entre sí según densidad_red, y CEDIs a clientes
+    arcos = [(planta, cedi) for planta in nombres_plantas for cedi in nombres_cedis]
+    arcos += [(a, b) for a in nombres_cedis for b in nombres_cedis if a != b and rng.rand() < densidad_red]
+    arcos += [(cedi, 'CLIENTE') for cedi in nombres_cedis]
+    master_red = pd.DataFrame(arcos, columns=['id_locacion_origen', 'id_locacion_destino'])
+    master_red.insert(0, 'id_red_infraestructura', np.arange(1, master_red.shape[0] + 1))
+
+    # Tarifario: una tarifa por arco y vehículo, con economía de escala en la capacidad
+    tramos = [(a, b) for a, b in arcos if b != 'CLIENTE']
+    for ciudad in nombres_ciudades:
+        tramos += [(cedi, ciudad) for cedi in rng.choice(nombres_cedis, min(tarifas_por_ciudad, cedis), replace=False)]
+    tarifas = [(a, b, capacidad, round(np.linalg.norm(posicion[a] - posicion[b]) * 300 * capacidad ** 0.8 + 50000))
+               for a, b in tramos for capacidad in vehiculos]
+    master_tarifario = pd.DataFrame(tarifas, columns=['id_ciudad_origen', 'id_ciudad_destino', 'capacidad', 'costo'])
+
+    # Producción: cada familia en una o dos plantas
+    master_producto = pd.DataFrame(
+        [(familia, planta, produccion_max) for familia in nombres_familias
+         for planta in rng.choice(nombres_plantas, min(plantas, 1 + rng.randint(2)), replace=False)],
+        columns=['familia', 'ubicacion_producto', 'produccion_max'])
+
+    # Demanda: cada (mes, familia) con una fracción `densidad_demanda` de las ciudades
+    demanda = [(2019, mes, familia, ciudad, round(rng.gamma(2, 20), 3))
+               for mes in range(1, meses + 1) for familia in nombres_familias
+               for ciudad in np.array(nombres_ciudades)[rng.rand(ciudades) < densidad_demanda]]
+    master_demanda = pd.DataFrame(demanda, columns=['año', 'fecha', 'familia', 'id_ciudad', 'cantidad'])
+
+    return {'master_producto': master_producto, 'master_ubicaciones': master_ubicaciones,
+            'master_demanda': master_demanda, 'master_tarifario': master_tarifario,
+            'master_red_infraestructura': master_red}
+
+
+def benchmark_etapas(DATASETS, backends=('highs',), escala=''):
+    """
+    Mide cada etapa de la herramienta (build_items, build_activities, matriz_coef y cada backend de solución) con
+    perfilado.RegistroEjecucion: tiempo de reloj, CPU y memoria pico.
+
+    :param DATASETS: diccionario con los masters (por ejemplo de generar_masters)
+    :param backends: backends de solvers.BACKENDS, o 'flujo' para el motor de flujo
+    :param escala: nombre de la escala, para identificar las filas
+    :return: pd.DataFrame con una fila por etapa, con el tamaño del modelo y el objetivo de cada backend
+    """
+    registro = RegistroEjecucion('benchmark', escala=escala)
+    with registro.etapa('build_items'):
+        items = build_items(DATASETS['master_red_infraestructura'], DATASETS['master_ubicaciones'],
+                            DATASETS['master_demanda'], DATASETS['master_producto'])
+    with registro.etapa('build_activities'):
+        actividades = build_activities(DATASETS['master_red_infraestructura'], DATASETS['master_tarifario'],
+                                       DATASETS['master_demanda'], DATASETS['master_ubicaciones'])
+    with registro.etapa('matriz_coef'):
+        matriz = matriz_coef(items, actividades)
+
+    objetivos = {}
+    for backend in backends:
+        # Los solvers imprimen su avance; se omite para no llenar la salida del benchmark
+        with registro.etapa(f'solver_{backend}'), contextlib.redirect_stdout(io.StringIO()):
+            if backend == 'flujo':
+                resultado = optimizacion_flujo(items, actividades, matriz)
+            else:
+                resultado = optimizacion(items, actividades, matriz, solver=backend, verbose=False)
+        objetivos[f'solver_{backend}'] = (resultado.estado, resultado.objetivo)
 
+    tabla = registro.resumen()
+    tabla.insert(0, 'escala', escala)
+    tabla['filas'], tabla['columnas'], tabla['no_nulos'] = items.shape[0], actividades.shape[0], matriz.nnz
+    tabla['estado'] = tabla['etapa'].map(lambda etapa: objetivos.get(etapa, (None, None))[0])
+    tabla['objetivo'] = tabla['etapa'].map(lambda etapa: objetivos.get(etapa, (None, None))[1])
+    return tabla
+
+
+def suite_benchmark(escalas=None, backends=('highs',), semilla=0):
+    """
+    Corre benchmark_etapas() sobre masters sintéticos de cada escala.
+
+    :param escalas: diccionario {nombre: parámetros de generar_masters}. Por defecto ESCALAS sin 'muy_grande'
+    :param backends: backends a medir en cada escala
+    :return: pd.DataFrame con todas las escalas
+    """
+    if escalas is None:
+        escalas = {nombre: parametros for nombre, parametros in ESCALAS.items() if nombre != 'muy_grande'}
+    tablas = []
+    for nombre, parametros in escalas.items():
+        DATASETS = generar_masters(semilla=semilla, **parametros)
+        tabla = benchmark_etapas(DATASETS, backends, escala=nombre)
+        print(f"Escala {nombre} {parametros}: {tabla['filas'].iloc[0]} filas, {tabla['columnas'].iloc[0]} "
+              f"columnas, {tabla['tiempo'].sum()} segundos")
+        tablas.append(tabla)
+    return pd.concat(tablas, ignore_index=True)
+
+
+def barrido(parametro, valores, base='mediana'):
+    """
+    Escalas que varían un solo parámetro de generar_masters() sobre una escala base, para ver qué dimensión deja de
+    escalar.
+
+    :param parametro: parámetro de generar_masters(), por ejemplo 'meses', 'familias', 'ciudades' o 'cedis'
+    :param valores: valores del parámetro
+    :param base: escala base de ESCALAS
+    :return: diccionario de escalas para suite_benchmark()
+    """
+    return {f'{parametro}={valor}': dict(ESCALAS[base], **{parametro: valor}) for valor in valores}
+
+
+def revisar_regresiones(resultados, ruta_linea_base, tolerancia=0.25, minimo=0.05, actualizar=False):
+    """
+    Compara los tiempos de cada (escala, etapa) contra una línea base guardada. Hay regresión si el tiempo supera la
+    línea base en más de `tolerancia` (relativo) y `minimo` segundos (para no marcar ruido en etapas muy cortas), o si
+    el objetivo de un backend cambió.
+
+    :param resultados: pd.DataFrame de suite_benchmark()
+    :param ruta_linea_base: ruta del JSON con la línea base
+    :param tolerancia: aumento relativo de tiempo permitido
+    :param minimo: aumento absoluto mínimo, en segundos, para marcar regresión
+    :param actualizar: si es True, guarda `resultados` como nueva línea base
+    :return: pd.DataFrame con la comparación y columna booleana 'regresion'
+    """
+    comparacion = resultados.loc[:, ['escala', 'etapa', 'tiempo', 'objetivo']].copy()
+    if os.path.exists(ruta_linea_base):
+        with open(ruta_linea_base, encoding='utf-8') as archivo:
+            linea_base = pd.DataFrame(json.load(archivo)['etapas'])
+        linea_base = linea_base.rename(columns={'tiempo': 'tiempo_base', 'objetivo': 'objetivo_base'})
+        comparacion = comparacion.merge(linea_base, on=['escala', 'etapa'], how='left')
+        comparacion['razon'] = comparacion['tiempo'] / comparacion['tiempo_base']
+        lento = (comparacion['tiempo'] > comparacion['tiempo_base'] * (1 + tolerancia)) & \
+                (comparacion['tiempo'] - comparacion['tiempo_base'] > minimo)
+        cambio_objetivo = comparacion['objetivo_base'].notna() & \
+            ~np.isclose(comparacion['objetivo'].astype(float), comparacion['objetivo_base'].astype(float),
+                        rtol=1e-6, equal_nan=True)
+        comparacion['regresion'] = lento | cambio_objetivo
+        print(f"{int(comparacion['regresion'].sum())} regresiones contra {ruta_linea_base}")
+    else:
+        comparacion['regresion'] = False
+        print(f"No existe la línea base {ruta_linea_base}")
+
+    if actualizar:
+        os.makedirs(os.path.dirname(ruta_linea_base) or '.', exist_ok=True)
+        with open(ruta_linea_base, 'w', encoding='utf-8') as archivo:
+            json.dump({'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'etapas': resultados.loc[:, ['escala', 'etapa', 'tiempo', 'objetivo']].to_dict('records')},
+                      archivo, indent=2)
+        print(f"Línea base actualizada en {ruta_linea_base}")
+
+    return comparacion
+
+
+def comparar_datamaster():
+    """
+    Comparaciones sobre datamaster.xlsx: matriz dispersa contra densa, backends de solución y motor de flujo.
+    """
     DATA_PATH = 'datamaster.xlsx'
 
     # Necesitamos las primeras cuatro hojas del .xlsx
     DATASET_NAMES = ['master_producto', 'master_ubicaciones', 'master_demanda',
                      'master_tarifario', 'master_red_infraestructura']
-    DATASETS = [pd.read_excel(DATA_PATH, sheet_name=i) for i in DATASET_NAMES]
+    DATASETS = list(leer_excel(DATA_PATH, DATASET_NAMES).values())
 
     # ejecutamos build_items() para construir tabla de items
     items = build_items(DATASETS[4], DATASETS[1], DATASETS[2], DATASETS[0])
 
     # Ejecutamos build_activities() construir tabla de actividades
-    actividades = build_activities(DATASETS[0], DATASETS[4], DATASETS[2], DATASETS[1])
+    actividades = build_activities(DATASETS[4], DATASETS[3], DATASETS[2], DATASETS[1])
+
+    # Comparar matriz dispersa contra la densa. La densa reserva len(items) x len(actividades), así que solo se
+    # compara en el primer mes de demanda
+    primer_mes = sorted(DATASETS[2]['fecha'].unique())[0]
+    items_mes = items.loc[items['tiempo'] == primer_mes].reset_index(drop=True)
+    actividades_mes = actividades.loc[actividades['tiempo'] == primer_mes].reset_index(drop=True)
+    print(matriz_test(items_mes, actividades_mes, [matriz_coef, matriz_coef_densa], n_iters=5))
+
+    matriz = matriz_coef(items, actividades)
+    print(f"Matriz de {matriz.shape[0]} filas, {matriz.shape[1]} columnas y {matriz.nnz} valores no nulos")
+
+    # Comparar backends de solución
+    print(solver_test(items, actividades, matriz, ['highs-ds', 'highs-ipm', 'cvxopt-glpk', 'glpk'], verbose=False))
+
+    # Comparar motor de flujo contra GLPK
+    print(flujo_test(items, actividades, matriz, backends=['glpk'], n_iters=1))
+
 
-    # Ejecutamos matriz_coef() para construir matriz de coeficientes
-    print(matriz_test(items, actividades, [matriz_coef, matriz_coef_v1], n_iters=5))
+def comparar_input(carpeta='input/', backends=('highs', 'highspy', 'cvxopt', 'glpk')):
+    """
+    Compara los backends de solución sobre los masters limpios de `carpeta` (la instancia real, en .csv). El punto
+    interior de CVXOPT es el que más se aleja de los demás en esta instancia, así que se revisa aquí además de en los
+    masters sintéticos. Sobre input/ tarda varios minutos.
+    """
+    from output import carga_datos
 
+    data = carga_datos(carpeta)
+    items = build_items(data['master_red_infraestructura'], data['master_ubicaciones'], data['master_demanda'],
+                        data['master_producto'])
+    actividades = build_activities(data['master_red_infraestructura'], data['master_tarifario'],
+                                   data['master_demanda'], data['master_ubicaciones'])
     matriz = matriz_coef(items, actividades)
-    matriz_df = pd.DataFrame(data=matriz, index=items, columns=actividades)
-    matriz_df.to_csv('test_input/output/output_coef.csv')
+    print(solver_test(items, actividades, matriz, list(backends), verbose=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de la herramienta sobre masters sintéticos')
+    parser.add_argument('--escalas', nargs='+', default=['pequena', 'mediana', 'grande'], choices=list(ESCALAS),
+                        help='escalas de ESCALAS a medir')
+    parser.add_argument('--barrido', nargs='+', default=None,
+                        help='parámetro y valores a barrer sobre la escala mediana, p. ej. --barrido ciudades 50 100 o '
+                             '--barrido densidad_red 0.3 0.8')
+    parser.add_argument('--backends', nargs='+', default=['highs', 'flujo'], help='backends de solución a medir')
+    parser.add_argument('--linea-base', default=CARPETA_BENCHMARK + 'linea_base.json', help='JSON de línea base')
+    parser.add_argument('--actualizar-linea-base', action='store_true', help='guardar esta corrida como línea base')
+    parser.add_argument('--datamaster', action='store_true', help='correr también las comparaciones sobre datamaster')
+    parser.add_argument('--input', default=None, metavar='CARPETA',
+                        help='comparar también los backends sobre los masters limpios de CARPETA, p. ej. input/')
+    args = parser.parse_args()
+
+    if args.datamaster:
+        comparar_datamaster()
+    if args.input:
+        comparar_input(args.input)
+
+    if args.barrido:
+        # Los valores se leen como JSON, para barrer también parámetros float (densidad_red 0.3) o listas
+        # (vehiculos [4.5,34]), igual que las opciones de herramienta.py
+        valores = []
+        for valor in args.barrido[1:]:
+            try:
+                valores.append(json.loads(valor))
+            except ValueError:
+                parser.error(f"El valor {valor} de --barrido no es un número ni JSON válido")
+        escalas = barrido(args.barrido[0], valores)
+    else:
+        escalas = {nombre: ESCALAS[nombre] for nombre in args.escalas}
+    resultados = suite_benchmark(escalas, backends=args.backends)
+
+    os.makedirs(CARPETA_BENCHMARK, exist_ok=True)
+    resultados.to_csv(CARPETA_BENCHMARK + time.strftime('benchmark_%Y%m%d_%H%M%S.csv'), index=False)
+    print(resultados.loc[:, ['escala', 'etapa', 'tiempo', 'cpu', 'memoria_pico_mb', 'filas', 'columnas',
+                             'objetivo']].to_string(index=False))
+
+    comparacion = revisar_regresiones(resultados, args.linea_base, actualizar=args.actualizar_linea_base)
+    if comparacion['regresion'].any():
+        print(comparacion.loc[comparacion['regresion']].to_string(index=False))
+        sys.exit(1)
@@ -0,0 +1,163 @@
+"""
+En este script se encuentra el modo de vehículos enteros. En el modelo lineal la decisión de cada arco de transporte es
+un número continuo de vehículos (el coeficiente 'transporte' es la capacidad del vehículo), por lo que aparecen
+camiones fraccionarios. En este modo cada arco de transporte tiene dos columnas:
+    - carga x: vehículos llenos equivalentes que se mueven por el arco (continua), con la que se cumplen las filas de
+      demanda, flujo, producción y capacidades igual que en el modelo lineal
+    - vehículos y: vehículos despachados (entera), con y >= x. El costo del arco se paga por vehículo despachado
+El almacenamiento sigue siendo continuo y conserva su costo sobre x.
+
+Se resuelve con el MIP de HiGHS (highspy, dependencia opcional). Antes se resuelve la relajación lineal con el backend
+indicado, y el redondeo hacia arriba de sus vehículos (y = techo(x), que siempre es factible) se entrega a HiGHS como
+solución inicial. Así, si se cumple el tiempo límite, se retorna al menos esa solución. Se detiene al llegar a la
+brecha de optimalidad `brecha` o al tiempo límite.
+
+Uso:
+    resultado = optimizacion_entera(items, actividades, matriz, tiempo_limite=600, brecha=0.01)
+    resultado.info['vehiculos']  # vehículos enteros por actividad (almacenamiento continuo)
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+from optimization import matrices_modelo
+from solvers import resolver, ResultadoSolver
+
+
+def redondeo_vehiculos(x, transporte, tolerancia=1e-6):
+    """
+    Redondea hacia arriba los vehículos de las columnas de transporte. Los valores que están a menos de `tolerancia` de
+    un entero se llevan a ese entero, para no abrir un vehículo por error numérico del solver.
+    :param x: np.array con la decisión continua
+    :param transporte: np.array booleano que indica las columnas de transporte
+    :return: np.array con los vehículos (enteros en transporte, igual a x en almacenamiento)
+    """
+    vehiculos = np.asarray(x, dtype=float).copy()
+    vehiculos[transporte] = np.ceil(np.maximum(vehiculos[transporte], 0) - tolerancia)
+    return vehiculos
+
+
+def _modelo_entero(c, A_eq, b_eq, A_ub, b_ub, transporte):
+    """
+    Carga en highspy el modelo con columnas [x, y]: x continua (todas las actividades) e y entera (una por actividad de
+    transporte). Las filas son las del modelo lineal sobre x, más x_j - y_j <= 0 por cada actividad de transporte.
+    """
+    import highspy
+
+    n, columnas = c.shape[0], np.where(transporte)[0]
+    k = columnas.shape[0]
+    enlace = sp.hstack([sp.csr_matrix((np.ones(k), (np.arange(k), columnas)), shape=(k, n)), -sp.identity(k)])
+    A = sp.vstack([sp.hstack([sp.csr_matrix(A_eq), sp.csr_matrix((A_eq.shape[0], k))]),
+                   sp.hstack([sp.csr_matrix(A_ub), sp.csr_matrix((A_ub.shape[0], k))]),
+                   enlace]).tocsc()
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = n + k
+    lp.num_row_ = A.shape[0]
+    lp.col_cost_ = np.concatenate([np.where(transporte, 0.0, c), c[columnas]]).astype(float)
+    lp.col_lower_ = np.zeros(n + k)
+    lp.col_upper_ = np.full(n + k, highspy.kHighsInf)
+    lp.row_lower_ = np.concatenate([b_eq, np.full(b_ub.shape[0] + k, -highspy.kHighsInf)]).astype(float)
+    lp.row_upper_ = np.concatenate([b_eq, b_ub, np.zeros(k)]).astype(float)
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+    lp.integrality_ = [highspy.HighsVarType.kContinuous] * n + [highspy.HighsVarType.kInteger] * k
+
+    return lp, columnas
+
+
+def optimizacion_entera(items_df, actividades_df, coef_mat, tiempo_limite=600, brecha=0.01, redondeo=True,
+                        solver='highs', hilos=None, verbose=False, opciones_mip=None, **opciones):
+    """
+    Resuelve el modelo con vehículos enteros en las actividades de transporte.
+
+    :param items_df: pd.DataFrame con los items del problema
+    :param actividades_df: pd.DataFrame con las actividades del problema
+    :param coef_mat: matriz de coeficientes (scipy.sparse o np.array)
+    :param tiempo_limite: segundos de reloj para el MIP (sin contar la relajación lineal)
+    :param brecha: brecha relativa de optimalidad con la que se detiene HiGHS
+    :param redondeo: si es True, se resuelve la relajación lineal y su redondeo se usa como solución inicial
+    :param solver: backend de la relajación lineal (ver solvers.BACKENDS)
+    :param hilos: número de hilos que puede usar HiGHS
+    :param opciones_mip: diccionario con opciones adicionales de HiGHS para el MIP
+    :param opciones: opciones adicionales del backend de la relajación lineal
+    :return: ResultadoSolver con (estado, x, objetivo, duales, tiempos, info). `x` es la carga de cada actividad, que
+    cumple las restricciones del modelo lineal, y info['vehiculos'] son los vehículos despachados (enteros en
+    transporte). El objetivo es el costo de los vehículos despachados. El MIP no tiene duales, quedan en NaN. El estado
+    es 'limite' si se cumplió el tiempo con una solución que no alcanza la brecha
+    """
+    import highspy
+
+    print("Proceso de optimización ha comenzado con vehículos enteros (HiGHS MIP)")
+    inicio = time.time()
+    c, A_eq, b_eq, A_ub, b_ub, _ = matrices_modelo(items_df, actividades_df, coef_mat)
+    n, m_eq, m_ub = c.shape[0], A_eq.shape[0], A_ub.shape[0]
+    if 'almacenamiento' in actividades_df.columns:
+        transporte = ~actividades_df['almacenamiento'].values.astype(bool)
+    else:
+        transporte = ~actividades_df['origen'].astype(str).str.endswith('_ALMACENAMIENTO').values
+
+    info = {'backend': 'highspy-mip', 'iteraciones': None, 'mensaje': None, 'relajacion': None,
+            'costo_redondeo': None, 'brecha': None, 'cota_inferior': None}
+    nan = {'eq': np.full(m_eq, np.nan), 'ub': np.full(m_ub, np.nan), 'reducidos': np.full(n, np.nan)}
+
+    # Relajación lineal y redondeo hacia arriba como solución inicial
+    relajacion = None
+    if redondeo:
+        relajacion = resolver(c, A_eq, b_eq, A_ub, b_ub, backend=solver, **opciones)
+        info['relajacion'] = relajacion.objetivo
+        if relajacion.estado in ['infactible', 'no_acotado']:
+            tiempos = {'compilacion': time.time() - inicio, 'solucion': 0.0, 'total': time.time() - inicio}
+            info['mensaje'] = 'relajación lineal ' + relajacion.estado
+            return ResultadoSolver(relajacion.estado, np.full(n, np.nan), np.nan, nan, tiempos, info)
+
+    lp, columnas = _modelo_entero(c, A_eq, b_eq, A_ub, b_ub, transporte)
+    h = highspy.Highs()
+    opciones_highs = {'output_flag': verbose, 'time_limit': float(tiempo_limite), 'mip_rel_gap': float(brecha)}
+    if hilos is not None:
+        opciones_highs['threads'] = int(hilos)
+    opciones_highs.update(opciones_mip or {})
+    for opcion, valor in opciones_highs.items():
+        if h.setOptionValue(opcion, valor) != highspy.HighsStatus.kOk:
+            raise ValueError(f"HiGHS no aceptó la opción del MIP {opcion}={valor!r}")
+    h.passModel(lp)
+
+    if relajacion is not None and relajacion.estado == 'optimo':
+        carga = np.maximum(relajacion.x, 0)
+        vehiculos = redondeo_vehiculos(carga, transporte)
+        info['costo_redondeo'] = float(c @ vehiculos)
+        inicial = highspy.HighsSolution()
+        inicial.col_value = list(np.concatenate([carga, vehiculos[columnas]]))
+        h.setSolution(inicial)
+    compilacion = time.time() - inicio
+
+    h.run()
+    solucion = time.time() - inicio - compilacion
+    tiempos = {'compilacion': compilacion, 'solucion': solucion, 'total': compilacion + solucion}
+
+    info_highs = h.getInfo()
+    estado_modelo = h.getModelStatus()
+    info.update({'iteraciones': info_highs.simplex_iteration_count, 'mensaje': h.modelStatusToString(estado_modelo),
+                 'nodos': info_highs.mip_node_count, 'brecha': info_highs.mip_gap,
+                 'cota_inferior': info_highs.mip_dual_bound})
+    estados = {highspy.HighsModelStatus.kOptimal: 'optimo', highspy.HighsModelStatus.kInfeasible: 'infactible',
+               highspy.HighsModelStatus.kUnbounded: 'no_acotado', highspy.HighsModelStatus.kTimeLimit: 'limite',
+               highspy.HighsModelStatus.kIterationLimit: 'limite', highspy.HighsModelStatus.kSolutionLimit: 'limite'}
+    estado = estados.get(estado_modelo, 'error')
+
+    # Con tiempo límite se retorna la mejor solución encontrada, si existe
+    factible = info_highs.primal_solution_status == highspy.SolutionStatus.kSolutionStatusFeasible
+    if estado not in ['optimo', 'limite'] or not factible:
+        return ResultadoSolver(estado, np.full(n, np.nan), np.nan, nan, tiempos, info)
+
+    valores = np.array(h.getSolution().col_value)
+    x = valores[:n]
+    vehiculos = x.copy()
+    vehiculos[columnas] = np.round(valores[n:])
+    info['vehiculos'] = vehiculos
+
+    print(f"Estado de la solución: {estado}. Tiempo de compilación {compilacion}, tiempo de solución {solucion}. "
+          f"Brecha {info['brecha']:.4%}, relajación lineal {info['relajacion']}, redondeo {info['costo_redondeo']}")
+
+    return ResultadoSolver(estado, x, float(c @ vehiculos), nan, tiempos, info)